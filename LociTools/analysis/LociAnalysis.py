@@ -0,0 +1,341 @@
+#! /usr/bin/env python
+
+import os
+import re
+import logging
+import os.path as op
+from collections import OrderedDict
+
+from LociTools import utils
+from LociTools.utils import instrumentation
+from LociTools.utils.workspace import Workspace
+from LociTools.utils.resources import detectResources
+from LociTools.io import MappedBlasrReader
+from LociTools.external import BlasrRunner
+from LociTools.analysis.ReadFilter import ReadFilter
+from LociTools.analysis.ReadSampler import ReadSampler
+from LociTools.analysis.LocusScheduler import LocusJob, LocusScheduler
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LAA_EXE = "laa"
+REFERENCE_FILE  = "loci_reference.fasta"
+ALIGNMENT_FILE  = "{0}.loci.m1"
+WHITELIST_FILE  = "subreads.txt"
+LOCUS_RESULT    = "amplicon_analysis.fastq"
+LOCUS_LOG       = "laa.log"
+RESULT_FILE     = "loci_analysis.fastq"
+
+CLUSTER_NAME = re.compile(r'^(?P<prefix>.+?)_Cluster(?P<cluster>\d+)(?P<suffix>_.*)?$')
+
+
+class LociAnalysisError(Exception):
+    pass
+
+
+## Private utilities
+
+def _locusFromFilename( filename ):
+    """Return the locus of a per-locus reference file, e.g. 'A' for 'A_gen.fasta'"""
+    return op.basename( filename ).split('.')[0].split('_')[0]
+
+def _asFloats( arg ):
+    return {k: float(v) for k, v in (arg or {}).iteritems()}
+
+def _asInts( arg ):
+    return {k: int(v) for k, v in (arg or {}).iteritems()}
+
+
+class LociAnalysis( object ):
+    """
+    Run Long Amplicon Analysis independently on each locus and combine the
+    results.  Passing reads are assigned to the locus of their best BLASR
+    hit against the per-locus references, sampled per barcode and locus,
+    and then one LAA job per locus is run on a whitelist of its sampled
+    reads.  Jobs run concurrently within the --nproc budget, largest locus
+    first, and their results are merged into a single 'loci_analysis.fastq'.
+    """
+
+    def __init__( self, referenceDirectory, outputDirectory, nproc=None,
+                        laaExe=DEFAULT_LAA_EXE, blasrExe=None,
+                        readFilter=None, sampler=None,
+                        doLoci=None, ignoreLoci=None, combineLoci=None,
+                        minLengthByLocus=None, maxLengthByLocus=None,
+                        minReadScoreByLocus=None, minSnrByLocus=None,
+                        scratchDir=None ):
+        self.referenceDirectory  = referenceDirectory
+        self.outputDirectory     = outputDirectory
+        self.nproc               = nproc or detectResources().cpus
+        self.laaExe              = laaExe
+        self.blasrExe            = blasrExe
+        self.readFilter          = readFilter or ReadFilter()
+        self.sampler             = sampler or ReadSampler()
+        self.doLoci              = set(doLoci) if doLoci else None
+        self.ignoreLoci          = set(ignoreLoci or [])
+        self.combineLoci         = combineLoci
+        self.minLengthByLocus    = _asInts( minLengthByLocus )
+        self.maxLengthByLocus    = _asInts( maxLengthByLocus )
+        self.minReadScoreByLocus = _asFloats( minReadScoreByLocus )
+        self.minSnrByLocus       = _asFloats( minSnrByLocus )
+        self.scratchDir          = scratchDir
+        self._workspace          = None
+
+        # The global thresholds are kept here and applied per-locus, while
+        #  the read filter only applies the loosest of them to the index
+        self.minLength    = self.readFilter.minLength
+        self.maxLength    = self.readFilter.maxLength
+        self.minReadScore = self.readFilter.minReadScore
+        self.minSnr       = self.readFilter.minSnr
+        self._loosenFilter()
+
+    @classmethod
+    def fromOptions( cls, opts ):
+        """Build an analysis from the parsed 'analysis' options"""
+        return cls( opts.referenceDirectory,
+                    opts.outputDirectory,
+                    nproc=opts.nproc,
+                    laaExe=opts.laaExe,
+                    blasrExe=opts.blasrExe,
+                    readFilter=ReadFilter.fromOptions( opts ),
+                    sampler=ReadSampler.fromOptions( opts ),
+                    doLoci=opts.doLoci,
+                    ignoreLoci=opts.ignoreLoci,
+                    combineLoci=opts.combineLoci,
+                    minLengthByLocus=opts.minLengthByLocus,
+                    maxLengthByLocus=opts.maxLengthByLocus,
+                    minReadScoreByLocus=opts.minReadScoreByLocus,
+                    minSnrByLocus=opts.minSnrByLocus,
+                    scratchDir=opts.scratchDir )
+
+    @property
+    def combineLoci(self):
+        return self._combineLoci
+
+    @combineLoci.setter
+    def combineLoci(self, arg):
+        # Invert 'NewName:LocusA:LocusB' into a map of locus to new name
+        self._combineLoci = {}
+        for newName, loci in (arg or {}).iteritems():
+            for locus in loci:
+                self._combineLoci[locus] = newName
+
+    ## Private methods
+
+    def _loosenFilter( self ):
+        """
+        Relax the index filter to the most permissive global or per-locus
+        threshold, so per-locus overrides can admit reads the global ones
+        would have rejected
+        """
+        f = self.readFilter
+        f.minLength    = min([self.minLength] + self.minLengthByLocus.values())
+        if self.maxLength > 0 and len(self.maxLengthByLocus) > 0:
+            limits = self.maxLengthByLocus.values()
+            f.maxLength = 0 if min(limits) < 1 else max([self.maxLength] + limits)
+        f.minReadScore = min([self.minReadScore] + self.minReadScoreByLocus.values())
+        f.minSnr       = min([self.minSnr] + self.minSnrByLocus.values())
+
+    def _outputPath( self, *parts ):
+        return op.join( self.outputDirectory, *parts )
+
+    def _scratchPath( self, filename ):
+        return self._workspace.file( filename )
+
+    def _referenceFiles( self ):
+        files = [op.join(self.referenceDirectory, f) for f in sorted(os.listdir( self.referenceDirectory ))
+                                                     if utils.isFastaFile( f )]
+        if not files:
+            msg = 'No per-locus reference FASTA files found in "{0}"'.format(self.referenceDirectory)
+            log.error( msg )
+            raise LociAnalysisError( msg )
+        return files
+
+    def _locusName( self, locus ):
+        """Return the name a locus is analyzed under, or None if it is skipped"""
+        combined = self._combineLoci.get( locus, locus )
+        if locus in self.ignoreLoci or combined in self.ignoreLoci:
+            return None
+        if self.doLoci is not None and locus not in self.doLoci and combined not in self.doLoci:
+            return None
+        return combined
+
+    def _passesLocus( self, locus, length, stats ):
+        """Apply the per-locus (or global) thresholds to one read"""
+        if length < self.minLengthByLocus.get( locus, self.minLength ):
+            return False
+        maxLength = self.maxLengthByLocus.get( locus, self.maxLength )
+        if maxLength > 0 and length > maxLength:
+            return False
+        if stats is not None:
+            readScore, snr = stats
+            if readScore < self.minReadScoreByLocus.get( locus, self.minReadScore ):
+                return False
+            if snr < self.minSnrByLocus.get( locus, self.minSnr ):
+                return False
+        return True
+
+    def _buildReference( self ):
+        """
+        Combine the per-locus references into one FASTA, returning it and a
+        dictionary of reference sequence name to locus
+        """
+        from pbcore.io import FastaReader, FastaWriter
+        referenceFile = self._scratchPath( REFERENCE_FILE )
+        refLoci = {}
+        with FastaWriter( referenceFile ) as writer:
+            for filename in self._referenceFiles():
+                locus = _locusFromFilename( filename )
+                with FastaReader( utils.openSequenceFile( filename )) as reader:
+                    for record in reader:
+                        refLoci[record.id] = locus
+                        writer.writeRecord( record )
+        log.info('Combined references for {0} loci'.format(len(set(refLoci.itervalues()))))
+        return referenceFile, refLoci
+
+    def _alignReads( self, readFiles, referenceFile ):
+        """
+        Align every barcode's reads against the combined reference at once,
+        splitting the cores between them, and return their alignment files
+        """
+        blasr = BlasrRunner.BlasrRunner( self.blasrExe, nproc=self.nproc )
+        perJob = max(1, self.nproc // max(1, len(readFiles)))
+        tasks = [(readFile, referenceFile, {'m': 1, 'bestn': 1, 'nproc': perJob,
+                                            'out': self._scratchPath( ALIGNMENT_FILE.format(barcode) )})
+                 for barcode, readFile in readFiles.iteritems()]
+        alignFiles = blasr.alignMany( tasks )
+        return OrderedDict( zip( readFiles.keys(), alignFiles ))
+
+    def _assignLoci( self, barcode, alignFile, refLoci, stats ):
+        """
+        Offer each of one barcode's aligned reads to its locus' sample.
+        BLASR reports all the hits of a read together, so repeats are
+        skipped against the previous read alone, and a read's score and
+        SNR are only looked up once the sampler would keep it.
+        """
+        previous = None
+        count = 0
+        reader = MappedBlasrReader( alignFile, 'm1', columns=('qname', 'tname', 'qlength') )
+        for record in reader:
+            name = record.qname
+            if name == previous:
+                continue
+            previous = name
+            count += 1
+            if name not in stats and name.rsplit('/', 1)[0] in stats:
+                name = name.rsplit('/', 1)[0]
+            rawLocus = refLoci.get( record.tname.split()[0] )
+            if rawLocus is None:
+                continue
+            locus = self._locusName( rawLocus )
+            if locus is None:
+                continue
+            length = int(record.qlength)
+            if not self._passesLocus( locus, length, None ):
+                continue
+            accept = lambda: self._passesLocus( locus, length, stats.get( name ))
+            self.sampler.offer( barcode, locus, name, accept=accept )
+        instrumentation.addCount( "assignedReads", records=count )
+        utils.removeFile( alignFile )
+
+    def _locusJobs( self ):
+        """Write each locus' whitelist of sampled reads and build its job"""
+        byLocus = OrderedDict()
+        for barcode, locus in self.sampler.groups():
+            byLocus.setdefault( locus, [] ).extend( name for name, _ in self.sampler.sample( barcode, locus ))
+
+        jobs = []
+        for locus, names in byLocus.iteritems():
+            locusDir = self._outputPath( locus )
+            if not op.isdir( locusDir ):
+                os.makedirs( locusDir )
+            with open( op.join( locusDir, WHITELIST_FILE ), 'w' ) as handle:
+                for name in names:
+                    handle.write( name + '\n' )
+            log.info('Sampled {0} reads for locus "{1}"'.format(len(names), locus))
+            jobs.append( LocusJob( locus, None, len(names), op.join( locusDir, LOCUS_LOG )))
+        return jobs
+
+    def _laaCommand( self, inputFile, job ):
+        locusDir = self._outputPath( job.name )
+        command = [self.laaExe, inputFile,
+                   '--subreadsToUse', op.join( locusDir, WHITELIST_FILE ),
+                   '--resultFile', op.join( locusDir, LOCUS_RESULT ),
+                   '--numThreads', str(job.threads),
+                   '--minLength', str(self.minLengthByLocus.get( job.name, self.minLength )),
+                   '--maxReads', str(self.sampler.capacity( job.name )),
+                   '--maxClusteringReads', str(self.sampler.clusteringCapacity( job.name ))]
+        if self.readFilter.barcodes:
+            command += ['--doBc', ','.join(sorted(self.readFilter.barcodes))]
+        return command
+
+    def _mergeResults( self, jobs ):
+        """
+        Merge the per-locus results in locus order, renumbering clusters
+        within each barcode so that every sequence name stays unique
+        """
+        from pbcore.io import FastqReader, FastqWriter, FastqRecord
+        resultFile = self._scratchPath( RESULT_FILE )
+        nextCluster = {}
+        count = 0
+        with FastqWriter( resultFile ) as writer:
+            for job in sorted( jobs, key=lambda j: j.name ):
+                locusResult = self._outputPath( job.name, LOCUS_RESULT )
+                if not utils.isValidFile( locusResult ):
+                    log.warn('No results found for locus "{0}"'.format(job.name))
+                    continue
+                renamed = {}
+                for record in FastqReader( locusResult ):
+                    name = record.header
+                    match = CLUSTER_NAME.match( name )
+                    if match:
+                        prefix, cluster = match.group('prefix'), match.group('cluster')
+                        if (prefix, cluster) not in renamed:
+                            renamed[(prefix, cluster)] = nextCluster.get( prefix, 0 )
+                            nextCluster[prefix] = renamed[(prefix, cluster)] + 1
+                        name = '{0}_Cluster{1}{2}'.format(prefix, renamed[(prefix, cluster)],
+                                                          match.group('suffix') or '')
+                    writer.writeRecord( FastqRecord( name, record.sequence, record.quality ))
+                    count += 1
+        resultFile = self._workspace.commit( resultFile, self._outputPath( RESULT_FILE ))
+        log.info('Merged {0} consensus sequences from {1} loci into "{2}"'.format(count, len(jobs), resultFile))
+        return resultFile
+
+    ## Public methods
+
+    def __call__( self, inputFile ):
+        """
+        Run the full per-locus analysis of a BAM or DataSet, returning the
+        path of the merged results
+        """
+        from pbcore.io import openDataSet
+        dataset = openDataSet( inputFile )
+
+        # Filtered reads, the combined reference and the alignments are
+        #  intermediates, kept in a scratch workspace for the run
+        with Workspace( self.scratchDir ) as self._workspace:
+            with instrumentation.stage("filter"):
+                stats = {}
+                readFiles = self.readFilter.writeFasta( dataset, self._workspace.path, stats )
+
+            with instrumentation.stage("assign"):
+                referenceFile, refLoci = self._buildReference()
+                alignFiles = self._alignReads( readFiles, referenceFile )
+                for barcode, alignFile in alignFiles.iteritems():
+                    self._assignLoci( barcode, alignFile, refLoci, stats[barcode] )
+
+            jobs = self._locusJobs()
+            if not jobs:
+                msg = "No reads were assigned to any locus"
+                log.error( msg )
+                raise LociAnalysisError( msg )
+
+            scheduler = LocusScheduler( self.nproc )
+            scheduler.assignThreads( jobs )
+            for job in jobs:
+                job.command = self._laaCommand( inputFile, job )
+
+            with instrumentation.stage("laa"):
+                scheduler( jobs )
+
+            with instrumentation.stage("merge"):
+                return self._mergeResults( jobs )
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+import logging
+
+from LociTools.external.ProcessSupervisor import ProcessJob, ProcessSupervisor
+
+log = logging.getLogger(__name__)
+
+
+class LocusJobError(Exception):
+    pass
+
+
+class LocusJob( object ):
+    """
+    One external per-locus analysis command, with the number of reads
+    it covers (used to order jobs) and the threads it may use
+    """
+
+    def __init__( self, name, command, size, logFile, threads=1 ):
+        self.name       = name
+        self.command    = command
+        self.size       = size
+        self.logFile    = logFile
+        self.threads    = threads
+        self.returnCode = None
+        self.wallTime   = None
+
+
+class LocusScheduler( object ):
+    """
+    Run independent per-locus jobs concurrently within a budget of
+    `nproc` cores.  Larger jobs are started first and given threads in
+    proportion to their size, and smaller jobs back-fill any cores left
+    free while larger ones are still running.
+    """
+
+    def __init__( self, nproc=1 ):
+        self._nproc = max(1, nproc)
+
+    @property
+    def nproc(self):
+        return self._nproc
+
+    def assignThreads( self, jobs ):
+        """Split the core budget between jobs in proportion to their size"""
+        total = float(sum(max(1, j.size) for j in jobs)) or 1.0
+        for job in jobs:
+            share = int(round( self._nproc * max(1, job.size) / total ))
+            job.threads = max(1, min(self._nproc, share))
+        return jobs
+
+    def __call__( self, jobs ):
+        """
+        Run all jobs to completion, largest first, and raise if any failed
+        """
+        ordered = sorted( jobs, key=lambda j: (-j.size, j.name) )
+        processes = [ProcessJob( job.name, job.command, cost=job.threads, logFile=job.logFile )
+                     for job in ordered]
+        log.info('Running analysis of {0} loci on {1} core(s)'.format(len(ordered), self._nproc))
+        ProcessSupervisor( self._nproc )( processes, check=False )
+
+        for job, process in zip( ordered, processes ):
+            job.returnCode = process.returnCode
+            job.wallTime   = process.wallTime
+            if job.returnCode == 0:
+                log.info('Finished analysis of locus "{0}" in {1:.1f}s'.format(job.name, job.wallTime))
+            else:
+                log.error('Analysis of locus "{0}" failed with exit code {1}, see "{2}"'.format(job.name, job.returnCode, job.logFile))
+
+        failed = [j.name for j in jobs if j.returnCode != 0]
+        if failed:
+            msg = "Per-locus analysis failed for: {0}".format(', '.join(sorted(failed)))
+            log.error( msg )
+            raise LocusJobError( msg )
+        return jobs
@@ -0,0 +1,219 @@
+#! /usr/bin/env python
+
+import struct
+import hashlib
+import logging
+import os.path as op
+from collections import OrderedDict
+
+import numpy as np
+
+from LociTools.utils import instrumentation
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_LENGTH = 3000
+DEFAULT_MAX_LENGTH = 0
+DEFAULT_MIN_READ_SCORE = 0.75
+DEFAULT_MIN_SNR = 3.75
+DEFAULT_MIN_BARCODE_SCORE = 0
+NO_BARCODE = "all"
+
+
+## Private utilities
+
+def _nameHash( name ):
+    return struct.unpack('<q', hashlib.md5( name ).digest()[:8])[0]
+
+
+class ReadStats( object ):
+    """
+    The read score and SNR of the reads written for one barcode, looked up
+    by name.  Only a 64-bit name hash and the dataset row are held per
+    read, in sorted arrays, and a read's record is decoded again when its
+    stats are asked for, so callers should only ask for the few reads
+    they keep.
+    """
+
+    def __init__( self, dataset, rows, hashes ):
+        order = np.argsort( np.asarray( hashes, dtype=np.int64 ), kind='mergesort' )
+        self._dataset = dataset
+        self._hashes  = np.asarray( hashes, dtype=np.int64 )[order]
+        self._rows    = np.asarray( rows, dtype=np.int64 )[order]
+
+    def __len__( self ):
+        return len(self._rows)
+
+    def _record( self, name ):
+        key = _nameHash( name )
+        start = np.searchsorted( self._hashes, key, side='left' )
+        end = np.searchsorted( self._hashes, key, side='right' )
+        for row in self._rows[start:end]:
+            record = self._dataset[int(row)]
+            if record.readName == name:
+                return record
+        return None
+
+    def __contains__( self, name ):
+        key = _nameHash( name )
+        i = np.searchsorted( self._hashes, key )
+        return i < len(self._hashes) and self._hashes[i] == key
+
+    def get( self, name ):
+        """Return the (read score, SNR) of a written read, or None"""
+        record = self._record( name )
+        if record is None:
+            return None
+        return (record.readScore, min(record.hqRegionSnr))
+
+
+class ReadFilter( object ):
+    """
+    Filter the reads of a BAM or DataSet using only its index columns.
+    Length, read quality and barcode thresholds are applied as vectorized
+    masks over the index before any record is decoded, and only passing
+    reads are decoded and streamed on, split by barcode.  SNR is not
+    stored in the index, so it is checked on the passing records alone.
+    """
+
+    def __init__( self, minLength=DEFAULT_MIN_LENGTH,
+                        maxLength=DEFAULT_MAX_LENGTH,
+                        minReadScore=DEFAULT_MIN_READ_SCORE,
+                        minSnr=DEFAULT_MIN_SNR,
+                        minBarcodeScore=DEFAULT_MIN_BARCODE_SCORE,
+                        barcodes=None ):
+        self.minLength       = minLength
+        self.maxLength       = maxLength
+        self.minReadScore    = minReadScore
+        self.minSnr          = minSnr
+        self.minBarcodeScore = minBarcodeScore
+        self.barcodes        = barcodes
+
+    @classmethod
+    def fromOptions( cls, opts ):
+        """Build a filter from the parsed 'analysis' options"""
+        barcodes = opts.doBc.split(',') if opts.doBc else None
+        return cls( minLength=opts.minLength,
+                    maxLength=opts.maxLength,
+                    minReadScore=opts.minReadScore,
+                    minSnr=opts.minSnr,
+                    minBarcodeScore=opts.minBarcodeScore,
+                    barcodes=barcodes )
+
+    @property
+    def barcodes(self):
+        return self._barcodes
+
+    @barcodes.setter
+    def barcodes(self, args):
+        self._barcodes = set(args) if args else None
+
+    ## Private methods
+
+    def _hasBarcodes( self, index ):
+        return 'bcForward' in index.dtype.names and 'bcReverse' in index.dtype.names
+
+    def _groupByBarcode( self, index, rows ):
+        """
+        Split rows by barcode pair, labelled in the '0--0' form, using an
+        integer key per row so only the distinct pairs are ever formatted
+        """
+        if not self._hasBarcodes( index ):
+            return [(NO_BARCODE, rows)]
+        forward = index.bcForward[rows].astype(np.int64)
+        reverse = index.bcReverse[rows].astype(np.int64)
+        keys = (forward << 32) | (reverse & 0xFFFFFFFF)
+        uniqueKeys, inverse = np.unique( keys, return_inverse=True )
+        order = np.argsort( inverse, kind='mergesort' )
+        bounds = np.searchsorted( inverse[order], np.arange(len(uniqueKeys) + 1) )
+        groups = []
+        for i, key in enumerate(uniqueKeys):
+            label = '{0}--{1}'.format(key >> 32, ((key & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000)
+            groups.append( (label, rows[order[bounds[i]:bounds[i + 1]]]) )
+        return groups
+
+    def _passesSnr( self, record ):
+        if self.minSnr <= 0:
+            return True
+        return min(record.hqRegionSnr) >= self.minSnr
+
+    ## Public methods
+
+    def mask( self, index ):
+        """
+        Return a boolean mask of the index rows passing every threshold
+        that can be tested from the index alone
+        """
+        lengths = index.qEnd - index.qStart
+        mask = lengths >= self.minLength
+        if self.maxLength > 0:
+            mask &= lengths <= self.maxLength
+        if self.minReadScore > 0:
+            mask &= index.readQual >= self.minReadScore
+        if self.minBarcodeScore > 0:
+            if 'bcQual' in index.dtype.names:
+                mask &= index.bcQual >= self.minBarcodeScore
+            else:
+                log.warn("No barcode scores found in the index, ignoring minBarcodeScore")
+        return mask
+
+    def passingRows( self, index ):
+        """
+        Return the passing index rows grouped by barcode, in file order
+        """
+        rows = np.flatnonzero( self.mask( index ))
+        groups = OrderedDict()
+        for label, labelRows in self._groupByBarcode( index, rows ):
+            if self.barcodes is not None and label not in self.barcodes:
+                continue
+            groups[label] = labelRows
+        nPassing = sum(len(r) for r in groups.itervalues())
+        log.info('{0} of {1} reads passed the index filters'.format(nPassing, len(index)))
+        instrumentation.addCount( "indexedReads", records=len(index) )
+        instrumentation.addCount( "passingReads", records=nPassing )
+        return groups
+
+    def records( self, dataset, rows, withRows=False ):
+        """
+        Decode and yield the records in the given rows that pass SNR, with
+        their rows if asked
+        """
+        for row in rows:
+            record = dataset[int(row)]
+            if self._passesSnr( record ):
+                yield (int(row), record) if withRows else record
+
+    def __call__( self, dataset ):
+        """
+        Yield a (barcode, records) pair for each barcode with passing reads,
+        where records lazily decodes only that barcode's passing reads
+        """
+        for barcode, rows in self.passingRows( dataset.index ).iteritems():
+            yield barcode, self.records( dataset, rows )
+
+    def writeFasta( self, dataset, outputDir, stats=None ):
+        """
+        Stream the passing reads of each barcode to its own FASTA file,
+        returning a dictionary of barcode to filename.  If a `stats`
+        dictionary is given, it is filled with the ReadStats of each
+        barcode's written reads.
+        """
+        from pbcore.io import FastaRecord, FastaWriter
+        outputs = OrderedDict()
+        for barcode, rows in self.passingRows( dataset.index ).iteritems():
+            filename = op.join( outputDir, "{0}.passing.fasta".format(barcode) )
+            count = 0
+            written = np.zeros( len(rows), dtype=np.int64 )
+            hashes = np.zeros( len(rows), dtype=np.int64 )
+            with FastaWriter( filename ) as writer:
+                for row, record in self.records( dataset, rows, withRows=True ):
+                    writer.writeRecord( FastaRecord( record.readName, record.read(aligned=False) ))
+                    written[count] = row
+                    hashes[count] = _nameHash( record.readName )
+                    count += 1
+            if stats is not None:
+                stats[barcode] = ReadStats( dataset, written[:count], hashes[:count] )
+            log.info('Wrote {0} passing reads for barcode "{1}"'.format(count, barcode))
+            instrumentation.addCount( "decodedReads", records=count )
+            outputs[barcode] = filename
+        return outputs
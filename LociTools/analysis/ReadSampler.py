@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+
+import heapq
+import struct
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_READS = 1000
+DEFAULT_MAX_CLUSTERING_READS = 250
+DEFAULT_SEED = 42
+
+
+## Private utilities
+
+def _digest( *parts ):
+    return hashlib.md5( '\0'.join(str(p) for p in parts) ).digest()
+
+def _groupSeed( seed, barcode, locus ):
+    """Derive the seed of one (barcode, locus) group from the global seed"""
+    return _digest( seed, barcode, locus )
+
+def _priority( groupSeed, name ):
+    """
+    Draw a read's random 64-bit priority from its group's seeded generator.
+    The draw is keyed by read name rather than taken in arrival order, so
+    it doesn't depend on how reads are split between or ordered across
+    workers.
+    """
+    return struct.unpack('<Q', _digest( groupSeed, name )[:8])[0]
+
+
+class Reservoir( object ):
+    """
+    A single-pass, bounded sample of at most `capacity` reads, keeping the
+    reads with the lowest priorities.  Reservoirs over disjoint parts of
+    the same stream can be merged, giving exactly the sample that a single
+    reservoir over the whole stream would have kept.
+    """
+
+    def __init__( self, capacity, groupSeed ):
+        self._capacity  = capacity
+        self._groupSeed = groupSeed
+        self._heap      = []     # Max-heap on priority, via negation
+        self._names     = set()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__( self ):
+        return len(self._heap)
+
+    def _push( self, priority, name, item, accept=None ):
+        if name in self._names or self._capacity <= 0:
+            return
+        entry = (-priority, name, item)
+        full = len(self._heap) >= self._capacity
+        if full and not entry[:2] > self._heap[0][:2]:
+            return
+        # A read's priority doesn't depend on what else was offered, so
+        #  testing it only once it would be kept samples exactly as testing
+        #  every read up front would
+        if accept is not None and not accept():
+            return
+        if not full:
+            heapq.heappush( self._heap, entry )
+        else:
+            evicted = heapq.heapreplace( self._heap, entry )
+            self._names.discard( evicted[1] )
+        self._names.add( name )
+
+    def offer( self, name, item=None, accept=None ):
+        """
+        Consider one read for the sample.  If given, `accept()` is called
+        only when the read would be kept, to reject it after all.
+        """
+        self._push( _priority( self._groupSeed, name ), name, item, accept )
+
+    def merge( self, other ):
+        """Fold the sample of another reservoir over the same group into this one"""
+        for negPriority, name, item in other._heap:
+            self._push( -negPriority, name, item )
+
+    def entries( self, limit=None ):
+        """Return the sampled (name, item) pairs, lowest priority first"""
+        ordered = sorted( self._heap, key=lambda e: (-e[0], e[1]) )
+        if limit is not None:
+            ordered = ordered[:limit]
+        return [(name, item) for _, name, item in ordered]
+
+
+class ReadSampler( object ):
+    """
+    Deterministically subsample reads per barcode and locus, capping each
+    group at --maxReads and choosing a nested subset of at most
+    --maxClusteringReads of those for clustering.  Each group draws from
+    its own generator seeded from --rngSeed, so the chosen reads are the
+    same however many workers fed the sampler, and in whatever order.
+    """
+
+    def __init__( self, maxReads=DEFAULT_MAX_READS,
+                        maxClusteringReads=DEFAULT_MAX_CLUSTERING_READS,
+                        maxReadsByLocus=None,
+                        maxClusteringReadsByLocus=None,
+                        seed=DEFAULT_SEED ):
+        self.maxReads                  = maxReads
+        self.maxClusteringReads        = maxClusteringReads
+        self.maxReadsByLocus           = maxReadsByLocus
+        self.maxClusteringReadsByLocus = maxClusteringReadsByLocus
+        self.seed                      = seed
+        self._reservoirs               = {}
+
+    @classmethod
+    def fromOptions( cls, opts ):
+        """Build a sampler from the parsed 'analysis' options"""
+        return cls( maxReads=opts.maxReads,
+                    maxClusteringReads=opts.maxClusteringReads,
+                    maxReadsByLocus=opts.maxReadsByLocus,
+                    maxClusteringReadsByLocus=opts.maxClusteringReadsByLocus,
+                    seed=opts.rngSeed )
+
+    @property
+    def maxReadsByLocus(self):
+        return self._maxReadsByLocus
+
+    @maxReadsByLocus.setter
+    def maxReadsByLocus(self, arg):
+        self._maxReadsByLocus = {k: int(v) for k, v in (arg or {}).iteritems()}
+
+    @property
+    def maxClusteringReadsByLocus(self):
+        return self._maxClusteringReadsByLocus
+
+    @maxClusteringReadsByLocus.setter
+    def maxClusteringReadsByLocus(self, arg):
+        self._maxClusteringReadsByLocus = {k: int(v) for k, v in (arg or {}).iteritems()}
+
+    def capacity( self, locus ):
+        return self.maxReadsByLocus.get( locus, self.maxReads )
+
+    def clusteringCapacity( self, locus ):
+        cap = self.maxClusteringReadsByLocus.get( locus, self.maxClusteringReads )
+        return min(cap, self.capacity( locus ))
+
+    def _reservoir( self, barcode, locus ):
+        key = (barcode, locus)
+        if key not in self._reservoirs:
+            self._reservoirs[key] = Reservoir( self.capacity( locus ),
+                                               _groupSeed( self.seed, barcode, locus ))
+        return self._reservoirs[key]
+
+    def offer( self, barcode, locus, name, item=None, accept=None ):
+        """Consider one read of a barcode and locus for the sample"""
+        self._reservoir( barcode, locus ).offer( name, item, accept )
+
+    def merge( self, other ):
+        """Fold in a sampler that saw a different part of the same reads"""
+        for (barcode, locus), reservoir in other._reservoirs.iteritems():
+            self._reservoir( barcode, locus ).merge( reservoir )
+
+    def groups( self ):
+        """Return the sampled (barcode, locus) groups in sorted order"""
+        return sorted( self._reservoirs )
+
+    def sample( self, barcode, locus ):
+        """Return the sampled (name, item) pairs of a group"""
+        if (barcode, locus) not in self._reservoirs:
+            return []
+        return self._reservoirs[(barcode, locus)].entries()
+
+    def clusteringSample( self, barcode, locus ):
+        """Return the nested subset of a group's sample used for clustering"""
+        if (barcode, locus) not in self._reservoirs:
+            return []
+        return self._reservoirs[(barcode, locus)].entries( self.clusteringCapacity( locus ))
@@ -0,0 +1,5 @@
+
+from .ReadFilter import ReadFilter
+from .ReadSampler import ReadSampler
+from .LocusScheduler import LocusScheduler
+from .LociAnalysis import LociAnalysis
@@ -1,9 +1,11 @@
 
 import logging
-import subprocess
 import os.path as op
 
 from LociTools import utils
+from LociTools.utils.resources import detectResources
+from LociTools.external.ProcessSupervisor import ProcessJob, ProcessSupervisor, ProcessJobError
+from LociTools.io.BlasrBinaryIO import isBinaryBlasrFile, convertBlasrFile
 
 log = logging.getLogger(__name__)
 
@@ -14,13 +16,16 @@ class BlasrExecutableError(Exception):
 class BlasrIOError(IOError):
     pass
 
+class BlasrExecutionError(Exception):
+    pass
+
 class BlasrRunner( object ):
 
     _validFiles = []
     _refWithIndex = []
     _refSizes = {}
 
-    def __init__( self, exe=None, nproc=8 ):
+    def __init__( self, exe=None, nproc=None, timeout=None, retries=0 ):
         if exe is None:
             log.debug("No BLASR executable supplied, searching PATH...")
             self._exe = utils.which('blasr')
@@ -29,7 +34,9 @@ class BlasrRunner( object ):
             self._exe = op.abspath( exe )
         else:
             raise BlasrExecutableError("No blasr executable supplied or in PATH!")
-        self._nproc = nproc
+        self._nproc = nproc or detectResources().blasrThreads
+        self._timeout = timeout
+        self._retries = retries
 
     def _validateQuery( self, query ):
         if query not in self._validFiles:
@@ -41,18 +48,35 @@ class BlasrRunner( object ):
                 raise BlasrIOError( msg )
 
     def _validateReference( self, refFile ):
-        print refFile
         if refFile not in self._validFiles:
-            print refFile
             if utils.isValidFasta( refFile ):
-                print refFile
                 self._validFiles.append( refFile )
             else:
-                print refFile
                 msg = "Supplied reference FASTA for BLASR isn't valid"
                 log.error( msg )
                 raise BlasrIOError( msg )
 
+    def _storedReferenceSize( self, refFile ):
+        """Read the record count stored beside a reference, if still current"""
+        countFile = refFile + ".count"
+        if not utils.isValidFile( countFile ) or op.getmtime( countFile ) < op.getmtime( refFile ):
+            return None
+        try:
+            with open( countFile ) as handle:
+                return int( handle.read().strip() )
+        except (IOError, ValueError):
+            return None
+
+    def _referenceSize( self, refFile ):
+        """Count the records of a reference, once per version of the file"""
+        key = (op.abspath( refFile ), op.getsize( refFile ), op.getmtime( refFile ))
+        if key not in self._refSizes:
+            size = self._storedReferenceSize( refFile )
+            if size is None:
+                size = utils.fastaRecordCount( refFile )
+            self._refSizes[key] = size
+        return self._refSizes[key]
+
     def _validateArgs( self, args ):
         if "out" not in args.keys():
             msg = "No valid output file for BLASR supplied!"
@@ -97,34 +121,84 @@ class BlasrRunner( object ):
         cmdString = " ".join(cmd)
         log.debug('Calling BLASR with the following options: {0}'.format(cmdString))
 
-    def _executeCommand( self, command ):
-        log.debug('Executing BLASR command as subprocess' % command)
-        with open('/dev/null', 'w') as handle:
-            subprocess.check_call( command,
-                                   stdout=handle,
-                                   stderr=subprocess.STDOUT )
-        log.debug("Subprocess finished successfully")
-
-    def __call__( self, query, refFile, args ):
-        """
-        Call Blasr
-        """
+    def _job( self, command, args ):
+        return ProcessJob( 'blasr', command,
+                           cost=int(args.get('nproc', 1)),
+                           timeout=self._timeout,
+                           retries=self._retries )
+
+    def _executeJobs( self, jobs, capacity ):
+        log.debug('Executing {0} BLASR command(s) as subprocesses'.format(len(jobs)))
+        try:
+            ProcessSupervisor( capacity )( jobs )
+        except ProcessJobError as e:
+            msg = "BLASR failed: {0}".format(e)
+            log.error( msg )
+            raise BlasrExecutionError( msg )
+        log.debug("Subprocesses finished successfully")
+
+    def _uncompressed( self, filename, output, tag, temporary ):
+        """BLASR can't read gzip, so inflate compressed inputs beside the output"""
+        if not utils.isCompressedFile( filename ):
+            return filename
+        inflated = '{0}.{1}.{2}'.format(output, tag, utils.getFileType( filename ))
+        log.debug('Decompressing "{0}" for BLASR'.format(filename))
+        temporary.append( utils.decompressSequenceFile( filename, inflated ))
+        return inflated
+
+    def _prepare( self, query, refFile, args, temporary ):
+        """Validate one alignment and return its command"""
         self._validateQuery( query )
         self._validateReference( refFile )
         self._validateArgs( args )
+        query = self._uncompressed( query, args["out"], "query", temporary )
+        refFile = self._uncompressed( refFile, args["out"], "reference", temporary )
         cmd = self._formatCommand( query, refFile, args )
         self._logCommand( cmd )
-        self._executeCommand( cmd )
+        return cmd
+
+    def __call__( self, query, refFile, args ):
+        """
+        Call Blasr
+        """
+        temporary = []
+        try:
+            cmd = self._prepare( query, refFile, args, temporary )
+            self._executeJobs( [self._job( cmd, args )], self._nproc )
+        finally:
+            for filename in temporary:
+                utils.removeFile( filename )
         self._validateOutput( args["out"] )
 
         # Return the output file for parsing
         return args["out"]
 
-    def fullBestAlignment( self, query, refFile, output=None ):
+    def alignMany( self, tasks ):
+        """
+        Run several independent (query, refFile, args) alignments at once,
+        sharing this runner's `nproc` cores between them according to
+        each one's own 'nproc' argument, and return their output files
+        """
+        temporary = []
+        try:
+            jobs = [self._job( self._prepare( query, refFile, args, temporary ), args )
+                    for query, refFile, args in tasks]
+            self._executeJobs( jobs, self._nproc )
+        finally:
+            for filename in temporary:
+                utils.removeFile( filename )
+        return [self._validateOutput( args["out"] ) for _, _, args in tasks]
+
+    def fullBestAlignment( self, query, refFile, output=None, compress=False ):
         if output is None:
             output = "temp.m5"
+        if isBinaryBlasrFile( output ):
+            textOutput = self.fullBestAlignment( query, refFile, output[:-1] )
+            convertBlasrFile( textOutput, output, compress=compress )
+            utils.removeFile( textOutput )
+            return output
         self._validateReference( refFile )
-        refCount = utils.fastaRecordCount( refFile )
+        refCount = self._referenceSize( refFile )
         args = {'nproc': self._nproc,
                 'out': output,
                 'm': 5,
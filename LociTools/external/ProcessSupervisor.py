@@ -0,0 +1,272 @@
+#! /usr/bin/env python
+
+import os
+import time
+import fcntl
+import errno
+import select
+import signal
+import logging
+import subprocess
+from collections import deque
+
+from LociTools.utils import instrumentation, tracing
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.05
+TAIL_LINES    = 50
+READ_SIZE     = 65536
+
+
+class ProcessJobError(Exception):
+    pass
+
+
+## Private utilities
+
+def _setNonBlocking( fd ):
+    flags = fcntl.fcntl( fd, fcntl.F_GETFL )
+    fcntl.fcntl( fd, fcntl.F_SETFL, flags | os.O_NONBLOCK )
+
+def _exitCode( status ):
+    """Convert a wait status to a Popen-style code, negative for signals"""
+    if os.WIFSIGNALED( status ):
+        return -os.WTERMSIG( status )
+    return os.WEXITSTATUS( status )
+
+
+class ProcessJob( object ):
+    """
+    One external command run by a ProcessSupervisor.  Stdout goes to
+    `logFile`, or is discarded if there is none, while stderr is both
+    appended to `logFile` and kept as a tail of its last lines.  After
+    running, the job holds its exit code, attempts and resource usage.
+    """
+
+    def __init__( self, name, command, cost=1, timeout=None, retries=0,
+                        logFile=None, tailLines=TAIL_LINES ):
+        self.name       = name
+        self.command    = command
+        self.cost       = cost
+        self.timeout    = timeout
+        self.retries    = retries
+        self.logFile    = logFile
+        self.stderrTail = deque( maxlen=tailLines )
+        self.returnCode = None
+        self.timedOut   = False
+        self.attempts   = 0
+        self.wallTime   = None
+        self.userTime   = None
+        self.systemTime = None
+        self.maxRssKb   = None
+
+    @property
+    def succeeded(self):
+        return self.returnCode == 0
+
+    def errorMessage( self ):
+        """Describe how the job failed, with the tail of its stderr"""
+        if self.timedOut:
+            reason = "timed out after {0}s".format(self.timeout)
+        else:
+            reason = "failed with exit code {0}".format(self.returnCode)
+        msg = '"{0}" {1} after {2} attempt(s)'.format(self.name, reason, self.attempts)
+        if self.stderrTail:
+            msg += ", last stderr output:\n" + "\n".join(self.stderrTail)
+        return msg
+
+
+class _Running( object ):
+    """The state of one attempt of a job while its process is alive"""
+
+    def __init__( self, job ):
+        self.job     = job
+        self.handle  = open( job.logFile, 'w' ) if job.logFile else open( os.devnull, 'w' )
+        try:
+            self.process = subprocess.Popen( job.command, stdout=self.handle,
+                                             stderr=subprocess.PIPE, close_fds=True )
+        except:
+            self.handle.close()
+            raise
+        self.fd      = self.process.stderr.fileno()
+        self.partial = ''
+        self.start   = time.time()
+        self.status  = None
+        self.rusage  = None
+        self.deadline = self.start + job.timeout if job.timeout else None
+        _setNonBlocking( self.fd )
+        job.attempts += 1
+        job.timedOut = False
+        job.stderrTail.clear()
+
+    def read( self ):
+        """Read whatever stderr is available, returning False at EOF"""
+        while True:
+            try:
+                data = os.read( self.fd, READ_SIZE )
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                raise
+            if not data:
+                self._closeStderr()
+                return False
+            if self.job.logFile:
+                self.handle.write( data )
+                self.handle.flush()
+            lines = (self.partial + data).split('\n')
+            self.partial = lines.pop()
+            self.job.stderrTail.extend( lines )
+
+    def _closeStderr( self ):
+        if self.partial:
+            self.job.stderrTail.append( self.partial )
+            self.partial = ''
+        self.process.stderr.close()
+        self.fd = None
+
+    def reap( self ):
+        """Collect the exit status and resource usage if the process exited"""
+        pid, status, rusage = os.wait4( self.process.pid, os.WNOHANG )
+        if pid == 0:
+            return False
+        self.status = status
+        self.rusage = rusage
+        self.process.returncode = _exitCode( status )
+        return True
+
+    def kill( self ):
+        try:
+            os.kill( self.process.pid, signal.SIGKILL )
+        except OSError:
+            pass
+        self.job.timedOut = True
+
+    def abort( self ):
+        """Kill and reap the process, closing its stderr pipe and log"""
+        if self.status is None:
+            try:
+                os.kill( self.process.pid, signal.SIGKILL )
+            except OSError:
+                pass
+            try:
+                os.waitpid( self.process.pid, 0 )
+            except OSError:
+                pass
+        if self.fd is not None:
+            self._closeStderr()
+        self.handle.close()
+
+    def finish( self ):
+        """Drain any remaining stderr and record the attempt on the job"""
+        # Everything the process wrote is already buffered in the pipe
+        if self.fd is not None and self.read():
+            self._closeStderr()
+        self.handle.close()
+        job = self.job
+        job.returnCode = self.process.returncode
+        job.wallTime   = time.time() - self.start
+        job.userTime   = self.rusage.ru_utime
+        job.systemTime = self.rusage.ru_stime
+        job.maxRssKb   = self.rusage.ru_maxrss
+        instrumentation.recordProcess( job.name, job.command, job.wallTime, job.userTime,
+                                       job.systemTime, job.maxRssKb, job.returnCode )
+        tracing.addSpan( job.name, "process", self.start, job.wallTime, self.process.pid,
+                         command=' '.join( job.command ), attempt=job.attempts,
+                         returnCode=job.returnCode, maxRssKb=job.maxRssKb )
+
+
+class ProcessSupervisor( object ):
+    """
+    Run many external commands from a single thread, with at most
+    `capacity` units of job cost running at once.  One select() loop
+    streams every job's stderr, enforces per-job timeouts, re-queues failed
+    jobs that have retries left, and collects per-job CPU time and peak
+    memory with wait4().  Jobs are started in the order given, with later
+    and cheaper jobs back-filling any capacity left free, and a job
+    costing more than the whole capacity still runs, alone.
+    """
+
+    def __init__( self, capacity=1, pollInterval=POLL_INTERVAL ):
+        self._capacity     = max(1, capacity)
+        self._pollInterval = pollInterval
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def _startJobs( self, pending, running, free ):
+        for job in list(pending):
+            if job.cost > free and running:
+                continue
+            pending.remove( job )
+            log.debug('Starting "{0}" (attempt {1})'.format(job.name, job.attempts + 1))
+            running.append( _Running( job ))
+            free -= job.cost
+        return free
+
+    def _wait( self, running ):
+        """Block until stderr is readable, a deadline passes or a poll is due"""
+        timeout = self._pollInterval
+        now = time.time()
+        for entry in running:
+            if entry.deadline is not None:
+                timeout = min(timeout, max(0, entry.deadline - now))
+        fds = [entry.fd for entry in running if entry.fd is not None]
+        if not fds:
+            time.sleep( timeout )
+            return set()
+        try:
+            readable, _, _ = select.select( fds, [], [], timeout )
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = []
+        return set(readable)
+
+    def __call__( self, jobs, check=True ):
+        """
+        Run all jobs to completion, returning them.  If `check` is set,
+        raise ProcessJobError describing every job that still failed
+        after its retries.
+        """
+        pending = deque( jobs )
+        running = []
+        free = self._capacity
+        try:
+            while pending or running:
+                free = self._startJobs( pending, running, free )
+                readable = self._wait( running )
+
+                now = time.time()
+                for entry in list(running):
+                    if entry.fd in readable:
+                        entry.read()
+                    if entry.deadline is not None and now >= entry.deadline and not entry.job.timedOut:
+                        log.warn('"{0}" exceeded its {1}s timeout, killing it'.format(entry.job.name, entry.job.timeout))
+                        entry.kill()
+                    if not entry.reap():
+                        continue
+                    running.remove( entry )
+                    entry.finish()
+                    free += entry.job.cost
+                    job = entry.job
+                    if job.succeeded:
+                        log.debug('"{0}" finished in {1:.1f}s'.format(job.name, job.wallTime))
+                    elif job.attempts <= job.retries:
+                        log.warn(job.errorMessage() + "\nRetrying")
+                        pending.appendleft( job )
+                    else:
+                        log.error( job.errorMessage() )
+        finally:
+            # On any error or interrupt, leave no child running, unreaped
+            #  or holding a pipe or log open
+            for entry in running:
+                log.warn('Killing "{0}" after an error in the supervisor'.format(entry.job.name))
+                entry.abort()
+
+        failed = [job for job in jobs if not job.succeeded]
+        if check and failed:
+            raise ProcessJobError( "\n".join(job.errorMessage() for job in failed) )
+        return jobs
@@ -1,11 +1,14 @@
 #! /usr/bin/env python
 
 import re
+import os.path as op
 
 from collections import defaultdict
 
 from pbcore.io import FastaRecord, FastaWriter
 
+from .MsaMatrix import MsaMatrix
+
 
 class ImgtAlignment( object ):
 
@@ -30,7 +33,7 @@ class ImgtAlignment( object ):
             id = parts[0]
 
             # Only process recognizable sequence alignments
-            if id.startswith(locus + "*"):
+            if id.startswith(self._locus + "*"):
                 substr = ''.join(parts[1:])
                 data[id] += substr
 
@@ -68,7 +71,7 @@ class ImgtAlignment( object ):
 
         self._dict = data
 
-    def Write( self ):
+    def Write( self, outputDir="." ):
         """Write out the data to the desired form"""
         raise NotImplementedError("You need to define a Write method!")
 
@@ -78,9 +81,9 @@ class ImgtGenomicAlignment( ImgtAlignment ):
     def __init__( self, *args, **kwargs ):
         super(ImgtGenomicAlignment, self).__init__( *args, **kwargs )
 
-    def Write( self ):
+    def Write( self, outputDir="." ):
         """Clean-up the sequences and write out a Genomic Fasta"""
-        filename = "{0}_genomic.fasta".format( self._locus )
+        filename = op.join( outputDir, "{0}_genomic.fasta".format( self._locus ))
         with FastaWriter( filename ) as handle:
             for allele, seq in self._dict.iteritems():
                 # Remove inserts, exon/intron boundaries, and trimmed regions
@@ -88,6 +91,11 @@ class ImgtGenomicAlignment( ImgtAlignment ):
                 record = FastaRecord( allele, seq )
                 handle.writeRecord( record )
 
+    def WriteMatrix( self, outputDir="." ):
+        """Keep the alignment itself, as an MSA matrix for MSA typing"""
+        filename = op.join( outputDir, "{0}_msa.npz".format( self._locus ))
+        return MsaMatrix.fromAlignment( self._locus, self._dict, self._first ).save( filename )
+
 
 class ImgtNucleotideAlignment( ImgtAlignment ):
     """
@@ -98,7 +106,7 @@ class ImgtNucleotideAlignment( ImgtAlignment ):
     def __init__( self, *args, **kwargs ):
         super(ImgtNucleotideAlignment, self).__init__( *args, **kwargs )
 
-    def Write( self ):
+    def Write( self, outputDir="." ):
         """Clean-up the sequences and write out a Genomic Fasta"""
 
         sets    = []
@@ -108,7 +116,7 @@ class ImgtNucleotideAlignment( ImgtAlignment ):
             exons = seq.split("|")
 
             while len(writers) < len(exons):
-                fasta = "{0}_exon{1}.fasta".format(self._locus, len(writers) + 1)
+                fasta = op.join( outputDir, "{0}_exon{1}.fasta".format(self._locus, len(writers) + 1) )
                 writers.append( FastaWriter(fasta) )
                 sets.append( set() )
 
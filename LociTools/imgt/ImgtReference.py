@@ -10,6 +10,8 @@ from collections import defaultdict
 
 from pbcore.io import FastaRecord, FastaWriter
 
+from LociTools.utils import tracing
+
 from .ImgtAlignment import ImgtGenomicAlignment, ImgtNucleotideAlignment
 
 LOCUS_LIST = ["A", "B", "C"]
@@ -76,7 +78,11 @@ class ImgtReference(object):
     def writeMetadata(self):
         pass
 
-    def updateGenomicReference(self):
+    def updateGenomicReference(self, referenceDir="."):
+        """
+        Write the genomic sequences and MSA matrix of every locus into its
+        directory under referenceDir, e.g. <referenceDir>/A/A_msa.npz
+        """
         for filename in self._zip.namelist():
             base   = os.path.basename(filename)
             locus = base.split('_')[0]
@@ -84,8 +90,13 @@ class ImgtReference(object):
                 continue
             if base.endswith(GEN_SUFFIX):
                 log.info("Processing {0} for genomic data from locus: {1}".format(base, locus))
-                aln = ImgtGenomicAlignment( locus, z.open(filename) )
-                aln.Write()
+                locusDir = os.path.join( referenceDir, locus )
+                if not os.path.isdir( locusDir ):
+                    os.makedirs( locusDir )
+                with tracing.span( locus, "imgt", file=base ):
+                    aln = ImgtGenomicAlignment( locus, self._zip.open(filename) )
+                    aln.Write( locusDir )
+                    aln.WriteMatrix( locusDir )
 
     def updateCDNAReference(self):
         pass
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+## Column encoding
+#
+# Every allele of a locus is one row of a (alleles x columns) uint8 matrix,
+#  in the shared coordinate system of the IMGT multiple alignment.  Columns
+#  an allele was never sequenced over ('*' in IMGT) are UNSEQUENCED and
+#  never count for or against it; IMGT insertion placeholders ('.') are GAP.
+
+UNSEQUENCED = 0
+GAP         = 5
+OTHER       = 6
+BASES       = 'ACGT'
+
+_CODES = np.empty( 256, dtype=np.uint8 )
+_CODES.fill( OTHER )
+for _code, _base in enumerate( BASES, 1 ):
+    _CODES[ord(_base)] = _code
+    _CODES[ord(_base.lower())] = _code
+_CODES[ord('*')] = UNSEQUENCED
+_CODES[ord('.')] = GAP
+_CODES[ord('-')] = GAP
+
+
+class MsaFormatError(ValueError):
+    pass
+
+
+## Private utilities
+
+def _encode( seq ):
+    """Convert a sequence or alignment string to column codes"""
+    return _CODES[np.frombuffer( seq, dtype=np.uint8 )]
+
+def _alleleName( name ):
+    """Strip any accession prefix, e.g. 'HLA00001_A*01:01:01:01' to 'A*01:01:01:01'"""
+    return name.split()[0].split('_')[-1]
+
+
+class MsaMatrix( object ):
+    """
+    The multiple alignment of one locus as a compact matrix, with the
+    columns at which alleles differ and the exon/intron boundaries kept
+    """
+
+    def __init__( self, locus, alleles, matrix, boundaries=() ):
+        if matrix.shape[0] != len(alleles):
+            raise MsaFormatError("MSA matrix has {0} rows for {1} alleles".format(matrix.shape[0], len(alleles)))
+        self.locus      = locus
+        self.alleles    = list(alleles)
+        self.matrix     = matrix
+        self.boundaries = np.asarray( boundaries, dtype=np.int32 )
+        self._index     = {name: i for i, name in enumerate( self.alleles )}
+        self._columns   = {}
+        self.__summarize()
+
+    def __summarize( self ):
+        """Index the polymorphic columns and the one base of every other column"""
+        present = np.zeros( (OTHER + 1, self.matrix.shape[1]), dtype=bool )
+        for code in range(1, OTHER + 1):
+            present[code] = (self.matrix == code).any( axis=0 )
+        nCodes = present.sum( axis=0 )
+        self.polymorphic = np.flatnonzero( nCodes > 1 ).astype( np.int32 )
+        self.monomorphic = np.flatnonzero( nCodes == 1 ).astype( np.int32 )
+        self.consensus   = self.matrix.max( axis=0 )
+
+    @classmethod
+    def fromAlignment( cls, locus, alignment, first ):
+        """
+        Build the matrix from IMGT alignment strings, as reconstructed by
+        ImgtAlignment, with the first allele's row defining the columns
+        """
+        reference = alignment[first].split('|')
+        boundaries = np.cumsum( [len(part) for part in reference[:-1]] )
+        width = sum(len(part) for part in reference)
+        alleles = [first] + sorted( a for a in alignment if a != first )
+        matrix = np.zeros( (len(alleles), width), dtype=np.uint8 )
+        for row, allele in enumerate( alleles ):
+            seq = alignment[allele].replace('|', '')[:width]
+            matrix[row, :len(seq)] = _encode( seq )
+        log.info('Built a {0} x {1} MSA matrix for locus {2}'.format(len(alleles), width, locus))
+        return cls( locus, alleles, matrix, boundaries )
+
+    @classmethod
+    def load( cls, filename ):
+        try:
+            data = np.load( filename )
+            return cls( str(data['locus']), [str(a) for a in data['alleles']],
+                        data['matrix'], data['boundaries'] )
+        except (IOError, KeyError, ValueError) as e:
+            raise MsaFormatError('Could not read MSA matrix "{0}": {1}'.format(filename, e))
+
+    def save( self, filename ):
+        with open( filename, 'wb' ) as handle:
+            np.savez_compressed( handle, locus=np.array( self.locus ),
+                                         alleles=np.array( self.alleles ),
+                                         matrix=self.matrix,
+                                         boundaries=self.boundaries )
+        return filename
+
+    @property
+    def mask(self):
+        """Per-allele masks of the columns each allele was sequenced over"""
+        return self.matrix != UNSEQUENCED
+
+    def __len__( self ):
+        return len(self.alleles)
+
+    def __contains__( self, name ):
+        return _alleleName( name ) in self._index
+
+    def row( self, name ):
+        return self._index[_alleleName( name )]
+
+    def baseColumns( self, row ):
+        """Map each base of an allele's ungapped sequence to its column"""
+        if row not in self._columns:
+            codes = self.matrix[row]
+            self._columns[row] = np.flatnonzero( (codes != UNSEQUENCED) & (codes != GAP) )
+        return self._columns[row]
+
+    def project( self, tname, tstart, tstring, qstring ):
+        """
+        Project a query onto the MSA columns through its alignment to one
+        allele, returning the query's column codes and the span covered.
+        Query insertions fill the allele's gap columns, in order.
+        """
+        columns = self.baseColumns( self.row( tname ))
+        query = np.zeros( self.matrix.shape[1], dtype=np.uint8 )
+        tpos = tstart
+        last, inserted = None, []
+        for t, q in zip( tstring, qstring ):
+            if t == '-':
+                inserted.append( q )
+                continue
+            if tpos >= len(columns):
+                break
+            column = columns[tpos]
+            if last is not None and column > last + 1:
+                gaps = column - last - 1
+                fill = ''.join(inserted[:gaps]).ljust( gaps, '.' )
+                query[last+1:column] = _encode( fill )
+            query[column] = _CODES[ord(q)]
+            last, inserted = column, []
+            tpos += 1
+        if last is None:
+            return query, 0, 0
+        return query, columns[tstart], last + 1
+
+    def score( self, query, start, end ):
+        """
+        Count every allele's mismatches to a projected query, and the
+        columns compared, in a few whole-matrix operations.  Monomorphic
+        columns are compared once against the consensus.
+        """
+        seen = query != UNSEQUENCED
+        poly = self.polymorphic[(self.polymorphic >= start) & (self.polymorphic < end)]
+        poly = poly[seen[poly]]
+        alleles = self.matrix[:, poly]
+        covered = alleles != UNSEQUENCED
+        mismatches = ((alleles != query[poly]) & covered).sum( axis=1 )
+        compared = covered.sum( axis=1 )
+
+        mono = self.monomorphic[(self.monomorphic >= start) & (self.monomorphic < end)]
+        mono = mono[seen[mono]]
+        monoCovered = self.matrix[:, mono] != UNSEQUENCED
+        differs = query[mono] != self.consensus[mono]
+        mismatches += monoCovered[:, differs].sum( axis=1 )
+        compared += monoCovered.sum( axis=1 )
+        return mismatches, compared
+
+    def rank( self, query, start, end ):
+        """Return allele rows best first: fewest mismatches, then most compared"""
+        mismatches, compared = self.score( query, start, end )
+        order = np.lexsort( (-compared, mismatches) )
+        return order, mismatches, compared
@@ -0,0 +1,299 @@
+
+import gzip
+import zlib
+import struct
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+## Blocked GZIP (BGZF) support
+#
+# A BGZF file is a series of independent gzip members of at most 64KB each,
+#  whose 'BC' extra field records the size of the compressed block.  Block
+#  boundaries can therefore be found without inflating anything, and the
+#  blocks inflated in parallel - zlib releases the GIL, so threads suffice.
+#  Every BGZF file is also a valid multi-member gzip file.
+
+DEFAULT_THREADS = 4
+DEFAULT_LEVEL = 6
+
+_GZIP_MAGIC   = '\x1f\x8b'
+_HEADER       = struct.Struct('<4sI2sH')   # magic+CM+FLG, MTIME, XFL+OS, XLEN
+_FEXTRA       = 4
+_BLOCK_DATA   = 0xff00                     # Uncompressed bytes per block, as in htslib
+_EOF_BLOCK    = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+                 '\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+class BgzfFormatError(IOError):
+    pass
+
+
+## Private utilities
+
+def _blockSize( extra ):
+    """Return the total size of a block from its 'BC' extra subfield, if any"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        si, slen = extra[pos:pos+2], struct.unpack('<H', extra[pos+2:pos+4])[0]
+        if si == 'BC' and slen == 2:
+            return struct.unpack('<H', extra[pos+4:pos+6])[0] + 1
+        pos += 4 + slen
+    return None
+
+def _readBlocks( handle ):
+    """Yield the raw compressed BGZF blocks of a file, in order"""
+    while True:
+        header = handle.read( _HEADER.size )
+        if not header:
+            return
+        if len(header) < _HEADER.size or header[:2] != _GZIP_MAGIC:
+            raise BgzfFormatError("Truncated or invalid BGZF block header")
+        magic, _, _, xlen = _HEADER.unpack( header )
+        extra = handle.read( xlen )
+        size = _blockSize( extra ) if ord(magic[3]) & _FEXTRA else None
+        if size is None:
+            raise BgzfFormatError("Block has no BGZF size field")
+        body = handle.read( size - _HEADER.size - xlen )
+        if len(body) != size - _HEADER.size - xlen:
+            raise BgzfFormatError("Truncated BGZF block")
+        yield body
+
+def _inflate( body ):
+    """Inflate one block body (deflate data, CRC32 and ISIZE) and check it"""
+    data = zlib.decompress( body[:-8], -15 )
+    crc, isize = struct.unpack('<Ii', body[-8:])
+    if isize != len(data) & 0xffffffff or crc != zlib.crc32(data) & 0xffffffff:
+        raise BgzfFormatError("BGZF block failed its CRC or size check")
+    return data
+
+def _deflate( args ):
+    data, level = args
+    compressor = zlib.compressobj( level, zlib.DEFLATED, -15 )
+    deflated = compressor.compress( data ) + compressor.flush()
+    blockSize = _HEADER.size + 6 + len(deflated) + 8
+    return ''.join([_GZIP_MAGIC, '\x08\x04', '\x00\x00\x00\x00', '\x00\xff',
+                    struct.pack('<H2sHH', 6, 'BC', 2, blockSize - 1),
+                    deflated,
+                    struct.pack('<Ii', zlib.crc32(data) & 0xffffffff, len(data))])
+
+def isBgzfFile( filename ):
+    """Check whether a file starts with a BGZF block header"""
+    with open( filename, 'rb' ) as handle:
+        header = handle.read( _HEADER.size )
+        if len(header) < _HEADER.size or header[:2] != _GZIP_MAGIC:
+            return False
+        magic, _, _, xlen = _HEADER.unpack( header )
+        return bool(ord(magic[3]) & _FEXTRA) and _blockSize( handle.read( xlen )) is not None
+
+
+class BgzfReader( object ):
+    """
+    A read-only, file-like view of the decompressed contents of a BGZF
+    file.  Blocks are inflated by a pool of threads, a bounded number
+    ahead of the reader, and handed back in file order.  It has the full
+    file interface, write methods included, since pbcore only accepts
+    handles with both; as for a file opened 'rb' those raise IOError.
+    """
+
+    def __init__( self, filename, nproc=DEFAULT_THREADS ):
+        self._filename = filename
+        self._handle   = open( filename, 'rb' )
+        self._blocks   = _readBlocks( self._handle )
+        self._nproc    = max(1, nproc)
+        self._pool     = ThreadPool( self._nproc ) if self._nproc > 1 else None
+        self._window   = deque()
+        self._buffer   = ''
+        self._pos      = 0
+        self._eof      = False
+
+    def _fill( self ):
+        """Queue blocks up to the read-ahead limit and return the next one"""
+        if self._pool is None:
+            for body in self._blocks:
+                return _inflate( body )
+            return None
+        for body in self._blocks:
+            self._window.append( self._pool.apply_async( _inflate, (body,) ))
+            if len(self._window) >= 4 * self._nproc:
+                break
+        if not self._window:
+            return None
+        return self._window.popleft().get()
+
+    def _nextBuffer( self ):
+        """Move on to the next non-empty block, returning False at the end"""
+        while not self._eof:
+            data = self._fill()
+            if data is None:
+                self._eof = True
+            elif data:
+                self._buffer, self._pos = data, 0
+                return True
+        return False
+
+    def read( self, size=-1 ):
+        parts = []
+        while size < 0 or size > 0:
+            if self._pos >= len(self._buffer) and not self._nextBuffer():
+                break
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._pos + size)
+            parts.append( self._buffer[self._pos:end] )
+            if size > 0:
+                size -= end - self._pos
+            self._pos = end
+        return ''.join(parts)
+
+    def readline( self ):
+        parts = []
+        while True:
+            if self._pos >= len(self._buffer) and not self._nextBuffer():
+                break
+            end = self._buffer.find( '\n', self._pos )
+            if end >= 0:
+                parts.append( self._buffer[self._pos:end+1] )
+                self._pos = end + 1
+                break
+            parts.append( self._buffer[self._pos:] )
+            self._pos = len(self._buffer)
+        return ''.join(parts)
+
+    def readlines( self ):
+        return list( self )
+
+    def __iter__( self ):
+        return self
+
+    def next( self ):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def write( self, data ):
+        raise IOError("File not open for writing")
+
+    def writelines( self, lines ):
+        raise IOError("File not open for writing")
+
+    def flush( self ):
+        pass
+
+    @property
+    def name(self):
+        return self._filename
+
+    @property
+    def mode(self):
+        return 'rb'
+
+    @property
+    def closed(self):
+        return self._handle.closed
+
+    def close( self ):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self._handle.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+
+class BgzfWriter( object ):
+    """
+    A write-only, file-like object producing a BGZF file, so intermediate
+    files stay compressed but remain readable in parallel.  Like a file
+    opened 'wb' it still has the read methods, which raise IOError.
+    """
+
+    def __init__( self, filename, level=DEFAULT_LEVEL, nproc=1 ):
+        self._filename = filename
+        self._handle   = open( filename, 'wb' )
+        self._level    = level
+        self._pool     = ThreadPool( nproc ) if nproc > 1 else None
+        self._pending  = []
+        self._size     = 0
+
+    def _flush( self, final=False ):
+        """Compress every full block buffered so far, or everything if final"""
+        data = ''.join( self._pending )
+        limit = len(data) if final else len(data) - len(data) % _BLOCK_DATA
+        chunks = [(data[i:i+_BLOCK_DATA], self._level) for i in range(0, limit, _BLOCK_DATA)]
+        if self._pool is None:
+            blocks = [_deflate( chunk ) for chunk in chunks]
+        else:
+            blocks = self._pool.map( _deflate, chunks )
+        self._handle.write( ''.join(blocks) )
+        self._pending = [data[limit:]]
+        self._size = len(data) - limit
+
+    def write( self, data ):
+        self._pending.append( data )
+        self._size += len(data)
+        if self._size >= _BLOCK_DATA * 16:
+            self._flush()
+
+    def writelines( self, lines ):
+        for line in lines:
+            self.write( line )
+
+    def flush( self ):
+        """Write out every full block; the last partial one waits for close()"""
+        self._flush()
+        self._handle.flush()
+
+    def read( self, size=-1 ):
+        raise IOError("File not open for reading")
+
+    def readline( self ):
+        raise IOError("File not open for reading")
+
+    def __iter__( self ):
+        return self
+
+    def next( self ):
+        raise IOError("File not open for reading")
+
+    @property
+    def name(self):
+        return self._filename
+
+    @property
+    def mode(self):
+        return 'wb'
+
+    @property
+    def closed(self):
+        return self._handle.closed
+
+    def close( self ):
+        if self._handle.closed:
+            return
+        self._flush( final=True )
+        self._handle.write( _EOF_BLOCK )
+        self._handle.close()
+        if self._pool is not None:
+            self._pool.terminate()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+
+def openCompressedFile( filename, mode='r', nproc=DEFAULT_THREADS ):
+    """
+    Open a compressed file for reading or writing.  BGZF files are read in
+    parallel and plain gzip files sequentially, and files are always
+    written as BGZF.
+    """
+    if mode.startswith('w'):
+        return BgzfWriter( filename, nproc=nproc )
+    if isBgzfFile( filename ):
+        return BgzfReader( filename, nproc=nproc )
+    return gzip.open( filename, 'rb' )
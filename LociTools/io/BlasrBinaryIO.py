@@ -0,0 +1,326 @@
+
+import json
+import mmap
+import struct
+import zlib
+import os.path as op
+
+import numpy as np
+
+from .BlasrIO import BlasrTypeError, MappedBlasrReader, _datatypeFor, _projectedType
+
+## Binary alignment container
+#
+# A binary Blasr file is a small JSON header followed by one 8-byte aligned
+#  data section per column:
+#
+#   magic (4 bytes) | header length (uint32) | JSON header | sections...
+#
+# Numeric columns are stored as fixed-width little-endian arrays, query and
+#  reference names as indices into a shared string table, and alignment
+#  strings as one blob per column with an offsets array, optionally zlib
+#  compressed.  Section offsets in the header are relative to the end of it.
+
+MAGIC = 'LCBA'
+VERSION = 1
+BINARY_SUFFIXES = {'m1': 'm1b', 'm5': 'm5b'}
+
+_NAME   = 'name'
+_STRAND = 'strand'
+_TEXT   = 'text'
+_STRAND_SYMBOLS = '+-'
+
+_SCHEMAS = {
+    'm1': [('qname', _NAME), ('tname', _NAME), ('qstrand', '<u1'),
+           ('tstrand', '<u1'), ('score', '<i4'), ('pctsimilarity', '<f8'),
+           ('tstart', '<i4'), ('tend', '<i4'), ('tlength', '<i4'),
+           ('qstart', '<i4'), ('qend', '<i4'), ('qlength', '<i4'),
+           ('ncells', '<i8')],
+    'm5': [('qname', _NAME), ('qlength', '<i4'), ('qstart', '<i4'),
+           ('qend', '<i4'), ('qstrand', _STRAND), ('tname', _NAME),
+           ('tlength', '<i4'), ('tstart', '<i4'), ('tend', '<i4'),
+           ('tstrand', _STRAND), ('score', '<i4'), ('nmat', '<i4'),
+           ('nmis', '<i4'), ('nins', '<i4'), ('ndel', '<i4'),
+           ('mapqv', '<i4'), ('qstring', _TEXT), ('astring', _TEXT),
+           ('tstring', _TEXT)]
+}
+
+
+class BlasrBinaryFormatError(ValueError):
+    pass
+
+
+## Private utilities
+
+def _padding( size ):
+    return (8 - size % 8) % 8
+
+def _binaryType( filename ):
+    """Return the alignment type ('m1' or 'm5') of a binary Blasr filename"""
+    suffix = filename.split('.')[-1].lower()
+    for filetype, binarySuffix in BINARY_SUFFIXES.iteritems():
+        if suffix == binarySuffix:
+            return filetype
+    return None
+
+def _formatValue( value, kind ):
+    """Convert a stored numeric value back to its text-file representation"""
+    if kind == _STRAND:
+        return _STRAND_SYMBOLS[value]
+    elif kind == '<f8':
+        return repr(float(value))
+    return str(value)
+
+
+class BlasrBinaryWriter( object ):
+    """
+    A Class for writing Blasr records into the binary columnar format.
+    Columns are accumulated in memory and written out when closed.
+    """
+
+    def __init__( self, filename, filetype=None, compress=False ):
+        filetype = filetype or _binaryType( filename )
+        if filetype is None:
+            raise BlasrTypeError("Filetype must be M1 or M5!")
+        self._filetype, self._datatype = _datatypeFor( filetype )
+        self._filename = filename
+        self._compress = compress
+        self._schema   = _SCHEMAS[self._filetype]
+        self._names    = {}
+        self._columns  = {name: [] for name, _ in self._schema}
+        self._count    = 0
+        self._closed   = False
+
+    def _nameIndex( self, name ):
+        try:
+            return self._names[name]
+        except KeyError:
+            index = len(self._names)
+            self._names[name] = index
+            return index
+
+    def writeRecord( self, record ):
+        """
+        Add a single Blasr record to the columns to be written
+        """
+        if not isinstance( record, self._datatype ):
+            raise BlasrTypeError("Invalid type to BlasrBinaryWriter")
+        for (name, kind), value in zip(self._schema, record):
+            if kind == _NAME:
+                value = self._nameIndex( value )
+            elif kind == _STRAND:
+                value = _STRAND_SYMBOLS.index( value )
+            elif kind != _TEXT:
+                value = float(value) if kind == '<f8' else int(value)
+            self._columns[name].append( value )
+        self._count += 1
+
+    def write( self, records ):
+        """
+        Add all Blasr records in a container to the columns to be written
+        """
+        for record in records:
+            self.writeRecord( record )
+
+    def _textSections( self, values, compress=False ):
+        lengths = np.fromiter((len(v) for v in values), dtype='<u8', count=len(values))
+        offsets = np.zeros(len(values) + 1, dtype='<u8')
+        np.cumsum(lengths, out=offsets[1:])
+        blob = ''.join( values )
+        if compress:
+            blob = zlib.compress( blob )
+        return offsets.tostring(), blob
+
+    def _sections( self ):
+        """Yield the (header entry, data sections) for each column"""
+        names = sorted(self._names, key=self._names.get)
+        offsets, blob = self._textSections( names )
+        yield {'name': '__names__', 'kind': _TEXT, 'compressed': False}, [offsets, blob]
+
+        for name, kind in self._schema:
+            values = self._columns[name]
+            entry = {'name': name, 'kind': kind, 'compressed': False}
+            if kind == _TEXT:
+                entry['compressed'] = self._compress
+                yield entry, list(self._textSections( values, self._compress ))
+            else:
+                dtype = '<u4' if kind == _NAME else ('<u1' if kind == _STRAND else kind)
+                entry['dtype'] = dtype
+                yield entry, [np.array(values, dtype=dtype).tostring()]
+
+    def close( self ):
+        if self._closed:
+            return
+        entries = []
+        data = []
+        position = 0
+        for entry, sections in self._sections():
+            entry['sections'] = []
+            for section in sections:
+                entry['sections'].append( [position, len(section)] )
+                data.append( section )
+                pad = _padding( len(section) )
+                data.append( '\0' * pad )
+                position += len(section) + pad
+            entries.append( entry )
+
+        header = json.dumps({'version': VERSION,
+                             'filetype': self._filetype,
+                             'count': self._count,
+                             'columns': entries})
+        header += ' ' * _padding( len(MAGIC) + 4 + len(header) )
+        with open( self._filename, 'wb' ) as handle:
+            handle.write( MAGIC )
+            handle.write( struct.pack('<I', len(header)) )
+            handle.write( header )
+            for section in data:
+                handle.write( section )
+        self._closed = True
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        if exc_type is None:
+            self.close()
+
+
+class BlasrBinaryReader( object ):
+    """
+    A Class for reading binary Blasr files.  Numeric columns are returned
+    as zero-copy NumPy views into the memory-mapped file, while iteration
+    yields the same records as the text BlasrReader.  The views hold the
+    mapping open, so stay valid after the reader is closed.
+    """
+
+    def __init__( self, filename, columns=None ):
+        self._handle = open( filename, 'rb' )
+        self._mm = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise BlasrBinaryFormatError('"{0}" is not a binary Blasr file'.format( filename ))
+        headerSize = struct.unpack('<I', self._mm[len(MAGIC):len(MAGIC) + 4])[0]
+        headerStart = len(MAGIC) + 4
+        header = json.loads( self._mm[headerStart:headerStart + headerSize] )
+        if header['version'] != VERSION:
+            self.close()
+            raise BlasrBinaryFormatError('Unsupported binary Blasr version "{0}"'.format( header['version'] ))
+
+        self._dataStart = headerStart + headerSize
+        self._filetype  = str(header['filetype'])
+        self._count     = header['count']
+        self._entries   = {str(e['name']): e for e in header['columns']}
+        self._nameTable = None
+
+        datatype = _datatypeFor( self._filetype )[1]
+        columns = tuple(columns or datatype._fields)
+        for column in columns:
+            if column not in datatype._fields:
+                self.close()
+                raise BlasrTypeError('Invalid column "%s" for Blasr type %s' % (column, self._filetype))
+        self._datatype = _projectedType( datatype, columns )
+
+    @property
+    def filetype(self):
+        return self._filetype
+
+    @property
+    def columns(self):
+        return self._datatype._fields
+
+    def __len__( self ):
+        return self._count
+
+    def _section( self, entry, index ):
+        offset, length = entry['sections'][index]
+        start = self._dataStart + offset
+        return start, length
+
+    def _text( self, entry ):
+        """Return the offsets and (decompressed) blob of a text column"""
+        start, length = self._section( entry, 0 )
+        offsets = np.frombuffer(self._mm, dtype='<u8', count=length // 8, offset=start)
+        start, length = self._section( entry, 1 )
+        blob = self._mm[start:start + length]
+        if entry['compressed']:
+            blob = zlib.decompress( blob )
+        return offsets, blob
+
+    def names( self ):
+        """Return the string table of query and reference names"""
+        if self._nameTable is None:
+            offsets, blob = self._text( self._entries['__names__'] )
+            self._nameTable = [blob[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+        return self._nameTable
+
+    def column( self, name ):
+        """
+        Return a column as a zero-copy NumPy array; name columns are
+        returned as indices into names(), and text columns as a list
+        """
+        try:
+            entry = self._entries[name]
+        except KeyError:
+            raise BlasrTypeError('Invalid column "%s" for Blasr type %s' % (name, self._filetype))
+        if entry['kind'] == _TEXT:
+            offsets, blob = self._text( entry )
+            return [blob[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+        start, length = self._section( entry, 0 )
+        dtype = np.dtype( str(entry['dtype']) )
+        return np.frombuffer(self._mm, dtype=dtype, count=length // dtype.itemsize, offset=start)
+
+    def _formattedColumn( self, name ):
+        """Return a column as a list of strings, as found in text files"""
+        kind = self._entries[name]['kind']
+        values = self.column( name )
+        if kind == _TEXT:
+            return values
+        elif kind == _NAME:
+            table = self.names()
+            return [table[i] for i in values]
+        return [_formatValue( v, kind ) for v in values.tolist()]
+
+    def __iter__( self ):
+        columns = [self._formattedColumn( name ) for name in self.columns]
+        make = self._datatype._make
+        for values in zip(*columns):
+            yield make( values )
+
+    def close( self ):
+        # Column views may outlive the reader, so the mapping is left to be
+        #  unmapped by the garbage collector once the last of them is gone
+        self._mm = None
+        self._handle.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
+
+
+## Public module functions
+
+def isBinaryBlasrFile( filename ):
+    return _binaryType( filename ) is not None
+
+def openBlasrFile( filename, columns=None, nproc=1 ):
+    """
+    Open an m1/m5 alignment file, either text or binary, with the
+    appropriate reader
+    """
+    if isBinaryBlasrFile( filename ):
+        return BlasrBinaryReader( filename, columns=columns )
+    return MappedBlasrReader( filename, columns=columns, nproc=nproc )
+
+def convertBlasrFile( inputFile, outputFile, compress=False ):
+    """
+    Convert a text m1/m5 file into the binary columnar format
+    """
+    reader = MappedBlasrReader( inputFile )
+    filetype = _binaryType( outputFile )
+    if filetype != reader.filetype:
+        raise BlasrTypeError('Cannot convert {0} file "{1}" to "{2}"'.format(reader.filetype, op.basename(inputFile), op.basename(outputFile)))
+    with BlasrBinaryWriter( outputFile, compress=compress ) as writer:
+        writer.write( reader )
+    return outputFile
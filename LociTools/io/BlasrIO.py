@@ -1,5 +1,8 @@
 
+import mmap
+import os.path as op
 from collections import namedtuple
+from multiprocessing import Pool
 
 from pbcore.io.base import ReaderBase, WriterBase, getFileHandle
 
@@ -10,39 +13,204 @@ BlasrM1 = namedtuple('BlasrM1', blasrM1Spec)
 BlasrM5 = namedtuple('BlasrM5', blasrM5Spec)
 
 
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+
 class BlasrTypeError(TypeError):
     pass
 
 
+class BlasrParseError(ValueError):
+    pass
+
+
+def _datatypeFor( filetype ):
+    """Return the canonical filetype and record type for an m1/m5 file"""
+    if filetype.lower() == 'm1':
+        return 'm1', BlasrM1
+    elif filetype.lower() == 'm5':
+        return 'm5', BlasrM5
+    else:
+        raise BlasrTypeError("Invalid type to BlasrReader")
+
+
 class BlasrReader( ReaderBase ):
 
     def __init__(self, f, filetype=None):
-        print f, filetype
         self.file = getFileHandle(f, 'r')
 
         filetype = filetype or f.split('.')[-1]
-        if filetype.lower() == 'm1':
-            self._filetype = 'm1'
-            self._datatype = BlasrM1
-        elif filetype.lower() == 'm5':
-            self._filetype = 'm5'
-            self._datatype = BlasrM5
-        else:
-            raise BlasrTypeError("Invalid type to BlasrReader")
+        self._filetype, self._datatype = _datatypeFor( filetype )
 
     @property
     def filetype(self):
         return self._filetype
 
     def __iter__(self):
-        try:
-            for line in self.file:
+        offset = 0
+        for line in self.file:
+            try:
                 entry = self._datatype._make(line.strip().split())
-                if entry.qname == 'qname':
+            except TypeError:
+                raise BlasrParseError("Invalid Blasr entry of type %s at byte offset %s" % (self.filetype, offset))
+            offset += len(line)
+            if entry.qname == 'qname':
+                continue
+            yield entry
+
+
+## Memory-mapped, chunk-parallel reading
+
+_PROJECTIONS = {}
+
+def _projectedType( datatype, columns ):
+    """Return a (cached) record type holding only the requested columns"""
+    if columns == datatype._fields:
+        return datatype
+    key = (datatype.__name__, columns)
+    if key not in _PROJECTIONS:
+        _PROJECTIONS[key] = namedtuple(datatype.__name__, columns)
+    return _PROJECTIONS[key]
+
+def _newlineAlignedRanges( mm, size, chunkSize ):
+    """
+    Split a mapped file into (start, end) byte ranges of roughly chunkSize
+    that each end immediately after a newline
+    """
+    ranges = []
+    start = 0
+    while start < size:
+        end = min(start + chunkSize, size)
+        if end < size:
+            newline = mm.find('\n', end - 1)
+            end = size if newline == -1 else newline + 1
+        ranges.append( (start, end) )
+        start = end
+    return ranges
+
+def _sliceFields( mm, pos, end, count ):
+    """
+    Slice out only the first `count` space-delimited fields of the line
+    mm[pos:end], leaving the rest of the line untouched
+    """
+    fields = []
+    while len(fields) < count and pos < end:
+        stop = mm.find(' ', pos, end)
+        if stop == -1:
+            stop = end
+        if stop > pos:
+            fields.append( mm[pos:stop].rstrip() )
+        pos = stop + 1
+    return fields
+
+def _parseRange( task ):
+    """
+    Parse every Blasr record in one byte range of a file, returning the
+    projected columns of each as a plain tuple
+    """
+    filename, filetype, indices, start, end = task
+    nFields = len(_datatypeFor( filetype )[1]._fields)
+    # Only whole lines are split; projections stop slicing at the last
+    #  column requested, so trailing alignment strings are never copied
+    needed = max(indices) + 1
+    project = needed < nFields
+
+    records = []
+    with open(filename, 'rb') as handle:
+        mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = start
+            while pos < end:
+                newline = mm.find('\n', pos, end)
+                stop = end if newline == -1 else newline
+                if project:
+                    fields = _sliceFields( mm, pos, stop, needed )
+                    valid = len(fields) == needed
+                else:
+                    fields = mm[pos:stop].split()
+                    valid = len(fields) == nFields
+                if not fields:
+                    pos = stop + 1
                     continue
-                yield entry
-        except:
-            raise ValueError("Invalid Blasr entry of type %s" % self.filetype)
+                if not valid:
+                    raise BlasrParseError("Invalid Blasr entry of type %s at byte offset %s" % (filetype, pos))
+                if fields[0] != 'qname':
+                    records.append( tuple(fields[i] for i in indices) )
+                pos = stop + 1
+        finally:
+            mm.close()
+    return records
+
+
+class MappedBlasrReader( object ):
+    """
+    A memory-mapped Blasr reader for very large m1/m5 files.  The file is
+    split into newline-aligned byte ranges that are parsed in parallel,
+    with records returned in file order.  If a list of columns is given,
+    records only contain (and only slice out) those columns.
+    """
+
+    def __init__( self, filename, filetype=None, columns=None,
+                                  nproc=1, chunkSize=DEFAULT_CHUNK_SIZE ):
+        self._filename = op.abspath( filename )
+        filetype = filetype or filename.split('.')[-1]
+        self._filetype, datatype = _datatypeFor( filetype )
+
+        columns = tuple(columns or datatype._fields)
+        for column in columns:
+            if column not in datatype._fields:
+                raise BlasrTypeError('Invalid column "%s" for Blasr type %s' % (column, self._filetype))
+        self._indices  = tuple(datatype._fields.index(c) for c in columns)
+        self._datatype = _projectedType( datatype, columns )
+        self._nproc = max(1, nproc)
+        self._chunkSize = max(1, chunkSize)
+
+    @property
+    def filetype(self):
+        return self._filetype
+
+    @property
+    def columns(self):
+        return self._datatype._fields
+
+    def _ranges( self ):
+        size = op.getsize( self._filename )
+        if size == 0:
+            return []
+        with open( self._filename, 'rb' ) as handle:
+            mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return _newlineAlignedRanges( mm, size, self._chunkSize )
+            finally:
+                mm.close()
+
+    def _chunks( self ):
+        tasks = [(self._filename, self._filetype, self._indices, start, end)
+                 for start, end in self._ranges()]
+        if self._nproc == 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _parseRange( task )
+        else:
+            pool = Pool( min(self._nproc, len(tasks)) )
+            try:
+                for chunk in pool.imap( _parseRange, tasks ):
+                    yield chunk
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+
+    def __iter__( self ):
+        make = self._datatype._make
+        for chunk in self._chunks():
+            for fields in chunk:
+                yield make( fields )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        pass
 
 
 class BlasrWriter( WriterBase ):
@@ -82,13 +250,21 @@ class BlasrWriter( WriterBase ):
         """
         if isinstance( record, BlasrM1 ) or isinstance( record, BlasrM5 ):
             self.file.write( self._recordToString( record ) + "\n" )
-            self.file.write("\n")
         else:
             raise BlasrTypeError("Invalid type to BlasrReader")
 
-    def write( self, records ):
+    def write( self, records, batchSize=1000 ):
         """
-        Write all Blasr records in a container out to the file handle
+        Write all Blasr records in a container out to the file handle,
+        batching many records into each write call
         """
+        batch = []
         for record in records:
-            self.writeRecord( record )
+            if not (isinstance( record, BlasrM1 ) or isinstance( record, BlasrM5 )):
+                raise BlasrTypeError("Invalid type to BlasrReader")
+            batch.append( self._recordToString( record ))
+            if len(batch) >= batchSize:
+                self.file.write( "\n".join( batch ) + "\n" )
+                batch = []
+        if batch:
+            self.file.write( "\n".join( batch ) + "\n" )
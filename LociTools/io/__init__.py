@@ -1,2 +1,4 @@
 
-from .BlasrIO import BlasrReader
+from .BlasrIO import BlasrReader, MappedBlasrReader
+from .BlasrBinaryIO import BlasrBinaryReader, BlasrBinaryWriter, openBlasrFile
+from .BgzfIO import BgzfReader, BgzfWriter
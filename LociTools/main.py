@@ -5,40 +5,141 @@
 from __future__ import absolute_import
 
 import logging
-import itertools
-import time
-
-from pbcore.io import openDataSet
 
 from LociTools import options
 from LociTools.options import Applications
-from LociTools import references
-from LociTools.imgt.ImgtReference import ImgtReference
-from LociTools.typing import LociTyper
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
+# Each subcommand imports only what it needs, so that '--help' and short
+#  scheduler-launched jobs don't pay for pbcore, pkg_resources, etc.
+
+def _submitTyping():
+    from LociTools.server import TypingClient
+
+    log.debug("Typing via server")
+    client = TypingClient( options.options.server )
+    for typingQuery in options.options.typingQueries:
+        print client.typing( typingQuery, force=options.options.force )
+
+def _runSharding():
+    from LociTools.typing import Sharding
+
+    opts = options.options
+    selectMemory = opts.selectMemory << 20 if opts.selectMemory else None
+    if opts.scatter:
+        from LociTools.typing import LociTyper
+        log.debug("Typing scatter")
+        for manifest in Sharding.scatterInput( LociTyper("all", scratchDir=opts.scratchDir, preset=opts.preset), opts.typingQuery, opts.scatter, opts.shards ):
+            print manifest
+    elif opts.shard:
+        log.debug("Typing shard")
+        print Sharding.runShard( opts.typingQuery, resume=not opts.force, scratchDir=opts.scratchDir,
+                                 selectMemory=selectMemory )
+    else:
+        log.debug("Typing gather")
+        results = None
+        if opts.results:
+            from LociTools.typing.ResultsStore import ResultsStore
+            results = ResultsStore( opts.results )
+        try:
+            print Sharding.gatherShards( opts.typingQuery, selectMemory=selectMemory, store=results )['selected']
+        finally:
+            if results is not None:
+                results.close()
+
+def _runTyping():
+    if options.options.server:
+        return _submitTyping()
+    if options.options.scatter or options.options.shard or options.options.gather:
+        return _runSharding()
+
+    from LociTools import references
+    from LociTools.typing import LociTyper
+    from LociTools.utils import instrumentation
+
+    log.debug("Typing")
+    if options.options.profile:
+        instrumentation.enable()
+    print references.genomicReference()
+    print references.cDNAReference()
+    print references.exonReference()
+    results = None
+    if options.options.results:
+        from LociTools.typing.ResultsStore import ResultsStore
+        results = ResultsStore( options.options.results )
+    selectMemory = options.options.selectMemory
+    typer = LociTyper("all", resume=not options.options.force, scratchDir=options.options.scratchDir,
+                      preset=options.options.preset,
+                      selectMemory=selectMemory << 20 if selectMemory else None,
+                      results=results)
+    print typer.genomicRef
+    print typer.cDnaRef
+    print typer.exonRef
+    try:
+        with instrumentation.stage("typing"):
+            if len(options.options.typingQueries) == 1:
+                typer( options.options.typingQuery )
+            else:
+                from LociTools.typing.TypingPipeline import TypingPipeline
+                pipeline = TypingPipeline( typer, workers=options.options.stageWorkers,
+                                           queueSize=options.options.queueSize )
+                for selected in pipeline( options.options.typingQueries ):
+                    print selected
+    finally:
+        if results is not None:
+            results.close()
+        if options.options.profile:
+            instrumentation.writeReport( options.options.profile )
+
+def _runAnalysis():
+    from LociTools.analysis import LociAnalysis
+
+    log.debug("Analysis")
+    analysis = LociAnalysis.fromOptions( options.options )
+    analysis( options.options.inputFilename )
+
+def _runUpdate():
+    from LociTools import references
+    from LociTools.imgt.ImgtReference import ImgtReference
+
+    log.debug("Update")
+    log.info('Installed references are version {0}, dated {1}'.format(references.version(), references.date()))
+    imgt = ImgtReference( options.options.imgtAlignmentZip )
+    imgt.updateGenomicReference( references.referenceDirectory() )
+    references.makeGenomicReference()
+    references.makeCDNAReference()
+    references.makePresetReferences()
+
+def _runServe():
+    from LociTools.server.TypingServer import TypingServer
+
+    log.debug("Serve")
+    server = TypingServer( options.options.socket, workers=options.options.workers,
+                          scratchDir=options.options.scratchDir )
+    server.serve()
+
 def main():
     options.parseOptions()
     app = options.whichApplication()
-    if app == Applications.TYPING:
-        log.debug("Typing")
-        print references.genomicReference()
-        print references.cDNAReference()
-        print references.exonReference()
-        typer = LociTyper("all")
-        print typer.genomicRef
-        print typer.cDnaRef
-        print typer.exonRef
-        typer( options.options.typingQuery )
-    elif app == Applications.ANALYSIS:
-        log.debug("Analysis")
-    elif app == Applications.UPDATE:
-        log.debug("Update")
-        references.get_reference_version()
-        references.get_reference_date()
-        imgt = ImgtReference( options.options.imgtAlignmentZip )
+    trace = getattr( options.options, 'trace', None )
+    if trace:
+        from LociTools.utils import tracing
+        tracing.enable()
+    try:
+        if app == Applications.TYPING:
+            _runTyping()
+        elif app == Applications.ANALYSIS:
+            _runAnalysis()
+        elif app == Applications.UPDATE:
+            _runUpdate()
+        elif app == Applications.SERVE:
+            _runServe()
+    finally:
+        if trace:
+            tracing.writeTrace( trace )
+            tracing.disable()
     log.debug("Done")
 
 if __name__ == "__main__":
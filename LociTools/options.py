@@ -41,9 +41,16 @@ class Applications(Enum):
     TYPING = 1
     ANALYSIS = 2
     UPDATE = 3
+    SERVE = 4
 
 PRESETS = ["classI", "fiveLoci", "gendx"]
 
+DEFAULT_SOCKET = "~/.locitools.sock"
+
+# Typing options that only apply to a local run, not to a job submitted to a server
+SERVER_EXCLUDED_OPTIONS = ["preset", "results", "selectMemory", "profile", "trace", "scratchDir",
+                           "stageWorkers", "scatter", "shard", "gather", "shards"]
+
 options = argparse.Namespace()
 
 __all__ = ["options", "parseOptions", "whichApplication"]
@@ -53,13 +60,136 @@ __all__ = ["options", "parseOptions", "whichApplication"]
 def _canonicalizedFilePath(path):
     return op.abspath(op.expanduser(path))
 
+def _parseStageWorkers( value ):
+    try:
+        return {p.split(':')[0]: int(p.split(':')[1]) for p in value.split(',')}
+    except (IndexError, ValueError):
+        raise argparse.ArgumentTypeError("Expected STAGE:INT pairs, e.g. 'align:2,finish:2'")
+
+class _ResourcesAction( argparse.Action ):
+    """Print the detected resources and the defaults derived from them, then exit"""
+
+    def __call__( self, parser, namespace, values, option_string=None ):
+        from LociTools.utils.resources import detectResources
+        sys.stdout.write( detectResources().report() + "\n" )
+        parser.exit()
+
+def _addTraceOption( parser ):
+    parser.add_argument(
+        "--trace",
+        metavar="JSON",
+        type=_canonicalizedFilePath,
+        help="Write a Chrome trace-event timeline of every stage, subprocess and "
+             "sample, for chrome://tracing or Perfetto")
+
 def _addTypingOptions( subparser ):
     subparser.set_defaults(application=Applications.TYPING)
 
     subparser.add_argument(
-        "typingQuery",
+        "typingQueries",
+        nargs="+",
+        metavar="typingQuery",
         type=_canonicalizedFilePath,
-        help="The input directory of per-locus reference sequences")
+        help="The analysis FASTA/FASTQ file(s) or result directories to type, or a shard "
+             "manifest or shard directory with --shard or --gather")
+    subparser.add_argument(
+        "--profile",
+        metavar="JSON",
+        type=_canonicalizedFilePath,
+        help="Write a JSON report of per-stage timings, counters and resource usage")
+    _addTraceOption( subparser )
+    subparser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-run every typing stage, ignoring the stage manifest of any previous run")
+    subparser.add_argument(
+        "--scratchDir",
+        metavar="DIR",
+        type=_canonicalizedFilePath,
+        help="Directory for per-run intermediate files, e.g. /dev/shm or a local SSD. "
+             "Default = $LOCITOOLS_SCRATCH or the system temporary directory")
+    subparser.add_argument(
+        "--preset",
+        choices=PRESETS,
+        help="Type against the reduced reference of a preset's loci only, "
+             "rather than the full genomic reference")
+    subparser.add_argument(
+        "--results",
+        metavar="DB",
+        type=_canonicalizedFilePath,
+        help="Also record each sample's selected sequences, hits, allele calls and "
+             "stage timings in this SQLite results store, creating it if needed. "
+             "With sharding, the plate is recorded by --gather")
+    subparser.add_argument(
+        "--selectMemory",
+        metavar="MB",
+        type=int,
+        help="Group alignments for selection out of core, spilling to the scratch "
+             "directory beyond this many megabytes. Default = group in memory")
+    subparser.add_argument(
+        "--server",
+        metavar="SOCKET",
+        type=_canonicalizedFilePath,
+        help="Submit the job to the 'loci serve' worker on this socket instead of typing locally")
+
+    pipeline = subparser.add_argument_group("Multi-Sample Options",
+        "Several inputs are typed as a pipeline, each stage working on a "
+        "different sample at once.")
+    pipeline.add_argument(
+        "--stageWorkers",
+        metavar="STRING",
+        type=_parseStageWorkers,
+        help="Concurrent samples per stage, as e.g. 'prepare:1,align:2,finish:2'. Default = 1 each")
+    pipeline.add_argument(
+        "--queueSize",
+        type=int,
+        metavar="INT",
+        default=2,
+        help="The number of samples that may wait between two stages. Default = 2")
+
+    sharding = subparser.add_argument_group("Scatter/Gather Options",
+        "Split a large plate into shards that can be typed independently on "
+        "other nodes sharing the filesystem, then merge their results.")
+    modes = sharding.add_mutually_exclusive_group()
+    modes.add_argument(
+        "--scatter",
+        metavar="SHARDDIR",
+        type=_canonicalizedFilePath,
+        help="Split the input into shards in this directory instead of typing it")
+    modes.add_argument(
+        "--shard",
+        action="store_true",
+        help="Type the single shard whose manifest is given as the input")
+    modes.add_argument(
+        "--gather",
+        action="store_true",
+        help="Merge the results of the finished shards in the shard directory given as the input")
+    sharding.add_argument(
+        "--shards",
+        type=int,
+        metavar="INT",
+        help="The number of shards to scatter into. Default = one per 8 usable CPUs, at least 2")
+
+def _addServeOptions( subparser ):
+    subparser.set_defaults(application=Applications.SERVE)
+
+    subparser.add_argument(
+        "--socket",
+        metavar="SOCKET",
+        default=DEFAULT_SOCKET,
+        type=_canonicalizedFilePath,
+        help="The Unix socket to accept typing jobs on. Default = {0}".format(DEFAULT_SOCKET))
+    subparser.add_argument(
+        "--scratchDir",
+        metavar="DIR",
+        type=_canonicalizedFilePath,
+        help="Directory for per-run intermediate files, e.g. /dev/shm or a local SSD. "
+             "Default = $LOCITOOLS_SCRATCH or the system temporary directory")
+    subparser.add_argument(
+        "--workers",
+        type=int,
+        metavar="INT",
+        help="The number of typing jobs to run at once. Default = one per 4 usable CPUs, at most 4")
 
 def _addUpdateOptions( subparser ):
     subparser.set_defaults(application=Applications.UPDATE)
@@ -68,6 +198,7 @@ def _addUpdateOptions( subparser ):
         "imgtAlignmentZip",
         type=_canonicalizedFilePath,
         help="The ZIP file of reference sequence alignments to update from")
+    _addTraceOption( subparser )
 
 ## Public module functions
 
@@ -83,6 +214,12 @@ def parseOptions():
     """
 
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resources",
+        nargs=0,
+        action=_ResourcesAction,
+        help="Report the usable CPUs and memory detected, the parallelism and buffer "
+             "defaults derived from them, and exit")
     subparsers = parser.add_subparsers(title='LociTools',
                                        description='Available tools for analyzing Loci-specific amplicons',
                                        help='additional help')
@@ -95,6 +232,10 @@ def parseOptions():
     analysis_parser = subparsers.add_parser('analysis', help=analysis_desc)
     analysis_parser.set_defaults(application=Applications.ANALYSIS)
 
+    serveDesc = "Keep the references loaded and serve typing jobs over a local socket"
+    serveParser = subparsers.add_parser('serve', help=serveDesc)
+    _addServeOptions( serveParser )
+
     updateDesc = "Update the reference sequences from the IMGT database used by LociTools"
     updateParser = subparsers.add_parser('update', help=updateDesc)
     _addUpdateOptions( updateParser )
@@ -166,8 +307,23 @@ def parseOptions():
         "-n", "--nproc",
         type=int,
         metavar="INT",
-        default=1,
-        help="The number of processors to be used")
+        help="The number of processors to be used. Default = all usable CPUs")
+    basics.add_argument(
+        "--scratchDir",
+        metavar="DIR",
+        type=_canonicalizedFilePath,
+        help="Directory for per-run intermediate files, e.g. /dev/shm or a local SSD. "
+             "Default = $LOCITOOLS_SCRATCH or the system temporary directory")
+    basics.add_argument(
+        "--laaExe",
+        metavar="STRING",
+        default="laa",
+        help="The Long Amplicon Analysis executable to run on each locus. Default = laa")
+    basics.add_argument(
+        "--blasrExe",
+        metavar="STRING",
+        help="The BLASR executable used to assign reads to loci. Default = blasr in PATH")
+    _addTraceOption( basics )
 
     barcoding = analysis_parser.add_argument_group("Barcode Options")
     barcoding.add_argument(
@@ -213,13 +369,13 @@ def parseOptions():
         type=int,
         metavar="INT",
         default=1000,
-        help="Minimum length of input reads. Default = 1000")
+        help="Maximum number of reads to sample per barcode and locus. Default = 1000")
     filtering.add_argument(
         "-c", "--maxClusteringReads",
         type=int,
         metavar="INT",
         default=250,
-        help="Minimum length of input reads. Default = 250")
+        help="Maximum number of sampled reads per barcode and locus to use for clustering. Default = 250")
     filtering.add_argument(
         "--skipRate",
         type=float,
@@ -303,8 +459,22 @@ def parseOptions():
 
     parser.parse_args(namespace=options)
 
+    # Sharding and single-sample typing work on the first typing query
+    if whichApplication() == Applications.TYPING:
+        options.typingQuery = options.typingQueries[0]
+        if len(options.typingQueries) > 1 and (options.scatter or options.shard or options.gather):
+            parser.error("--scatter, --shard and --gather take a single input")
+        # Shards are only partial results, so the plate is recorded once gathered
+        if options.results and (options.scatter or options.shard):
+            parser.error("--results cannot be used with --scatter or --shard, only --gather")
+        # The server types with its own settings, so local-only options would be lost
+        if options.server:
+            for name in SERVER_EXCLUDED_OPTIONS:
+                if getattr(options, name):
+                    parser.error("--{0} cannot be used with --server".format(name))
+
     # If we're running the Analysis tool, sanity-check the supplied arguments
-    if whichApplication == 'analysis':
+    if whichApplication() == Applications.ANALYSIS:
         # Check that we don't have multiple competing presets
         optDict = vars(options)
         for i in range(len(PRESETS)-1):
@@ -2,10 +2,8 @@
 import os
 import logging
 import calendar
+import subprocess
 import os.path as op
-import pkg_resources as pkg
-
-from pbcore.io import FastaReader, FastaWriter
 
 from LociTools import utils
 
@@ -14,14 +12,32 @@ log = logging.getLogger(__name__)
 ## Private Constant variables
 
 _REF_DIR        = "LociTools.references"
-_REF_PATH       = pkg.resource_filename(_REF_DIR, '')
-_VERSION_REF    = pkg.resource_filename(_REF_DIR, 'version.txt')
-_DATE_REF       = pkg.resource_filename(_REF_DIR, 'date.txt')
-_GENOMIC_REF    = pkg.resource_filename(_REF_DIR, 'genomic.fasta')
+_REF_ENV        = "LOCITOOLS_REFERENCES"
+_VERSION_REF    = 'version.txt'
+_DATE_REF       = 'date.txt'
+_GENOMIC_REF    = 'genomic.fasta'
 _GENOMIC_SUFFIX = "gen"
-_CDNA_REF       = pkg.resource_filename(_REF_DIR, 'cDNA.fasta')
+_CDNA_REF       = 'cDNA.fasta'
 _CDNA_SUFFIX    = "nuc"
-_EXON_REF       = pkg.resource_filename(_REF_DIR, 'exon.map')
+_EXON_REF       = 'exon.map'
+_MSA_SUFFIX     = "msa"
+_G_GROUP_REF    = 'hla_nom_g.txt'
+_P_GROUP_REF    = 'hla_nom_p.txt'
+_PRESET_REF     = 'genomic.{0}.fasta'
+_COUNT_SUFFIX   = '.count'
+_ALIAS_SUFFIX   = '.aliases.txt'
+_SA_SUFFIX      = '.sa'
+_SA_WRITER      = 'sawriter'
+
+# The loci covered by each of the typing / analysis presets in LociTools.options
+PRESET_LOCI = {
+    "classI":   ["A", "B", "C"],
+    "fiveLoci": ["A", "B", "C", "DQB1", "DRB1"],
+    "gendx":    ["A", "B", "C", "DQA1", "DQB1", "DPA1", "DPB1", "DRB1", "DRB3", "DRB4", "DRB5"],
+}
+
+# Resolved on first use, so importing this module stays cheap
+_refPath        = None
 
 ## Reference Exceptions
 
@@ -43,6 +59,21 @@ class ReferenceIOException(ReferenceException):
 
 ## Private utility functions
 
+def _referencePath():
+    """
+    Resolve the reference directory, from the environment if overridden
+    """
+    global _refPath
+    if _refPath is None:
+        _refPath = os.environ.get(_REF_ENV)
+        if not _refPath:
+            import pkg_resources as pkg
+            _refPath = pkg.resource_filename(_REF_DIR, '')
+    return _refPath
+
+def _referenceFile( filename ):
+    return op.join( _referencePath(), filename )
+
 def _monthToInt( month ):
     months = {m.lower(): idx for idx, m in enumerate(calendar.month_name)}
     try:
@@ -74,8 +105,10 @@ def _readFasta( filepath ):
     """
     Attempt to read a reference FASTA into memory as a list of records
     """
+    from pbcore.io import FastaReader
     try:
-        recs = list(FastaReader(filepath))
+        with FastaReader(utils.openSequenceFile(filepath)) as reader:
+            recs = list(reader)
     except:
         raise ReferenceFormatException('Reference file "{0}" is not a well-formated FASTA file!'.format( filepath ))
     return recs
@@ -84,6 +117,7 @@ def _writeFasta( filepath, records ):
     """
     Attempt to write a list of records to a new reference FASTA
     """
+    from pbcore.io import FastaWriter
     try:
         with FastaWriter( filepath ) as handle:
             for record in records:
@@ -105,20 +139,87 @@ def _writeMap( filepath, data ):
 
 def _makeReference( output_path, type_suffix ):
     recs = []
-    for resource in pkg.resource_listdir(_REF_DIR, ''):
-        if pkg.resource_isdir(_REF_DIR, resource ):
+    refPath = _referencePath()
+    for resource in os.listdir( refPath ):
+        if op.isdir( op.join(refPath, resource) ):
             expected_file = "{0}_{1}.fasta".format(resource, type_suffix)
-            expected_path = op.join(_REF_PATH, resource, expected_file)
+            expected_path = op.join(refPath, resource, expected_file)
             if op.exists( expected_path ):
                 recs += _readFasta( expected_path )
             else:
                 raise MissingReferenceException('Missing expected reference file "{0}" for Locus "{1}"'.format(expected_file, resource))
+    # Keep one representative of every distinct sequence, so identical
+    #  alleles don't tie as BLASR candidates, and record what each stands for
+    from LociTools.utils.aliases import collapseRecords, writeAliasTable
+    recs, aliases = collapseRecords( recs )
+    _writeFasta( output_path, recs )
+    try:
+        writeAliasTable( _aliasFile( output_path ), aliases )
+    except IOError:
+        raise ReferenceIOException('Unable to write reference alias table for "{0}"'.format( output_path ))
+    return True
+
+def _aliasFile( filepath ):
+    return op.splitext( filepath )[0] + _ALIAS_SUFFIX
+
+def _recordLocus( name ):
+    """Return the locus of a reference record, e.g. 'A' for 'HLA00001_A*01:01:01:01'"""
+    return name.split('*')[0].split('_')[-1]
+
+def _presetLoci( preset ):
+    try:
+        return PRESET_LOCI[preset]
+    except KeyError:
+        raise MissingReferenceException('Unknown reference preset "{0}"'.format(preset))
+
+def _writeCount( filepath, count ):
+    """Record the number of records in a reference beside it, for BLASR's 'bestn'"""
+    try:
+        with open( filepath + _COUNT_SUFFIX, 'w' ) as handle:
+            handle.write("{0}\n".format(count))
+    except:
+        raise ReferenceIOException('Unable to write reference record count for "{0}"'.format( filepath ))
+
+def _makeSuffixArray( filepath ):
+    """
+    Index a reference with BLASR's sawriter, if available, where BlasrRunner
+    will find and use it.  A missing index only costs alignment speed.
+    """
+    exe = utils.which( _SA_WRITER )
+    if exe is None:
+        log.warn('No "{0}" found in PATH, not indexing "{1}"'.format(_SA_WRITER, filepath))
+        return False
+    saFile = filepath + _SA_SUFFIX
+    with open( os.devnull, 'w' ) as devnull:
+        returnCode = subprocess.call( [exe, saFile, filepath], stdout=devnull, stderr=devnull )
+    if returnCode != 0:
+        log.warn('Failed to index "{0}" with "{1}"'.format(filepath, exe))
+        if op.exists( saFile ):
+            os.remove( saFile )
+        return False
+    return True
+
+def _makePresetReference( output_path, preset ):
+    """
+    Subset the combined genomic reference to the loci of a preset, and
+    record its size and suffix array beside it
+    """
+    loci = set(_presetLoci( preset ))
+    recs = [r for r in _readFasta( genomicReference() ) if _recordLocus( r.id ) in loci]
+    if not recs:
+        raise MissingReferenceException('No reference sequences found for the loci of preset "{0}"'.format(preset))
+    missing = loci - set(_recordLocus( r.id ) for r in recs)
+    if missing:
+        log.warn('No reference sequences for locus/loci {0} of preset "{1}"'.format(', '.join(sorted(missing)), preset))
     _writeFasta( output_path, recs )
+    _writeCount( output_path, len(recs) )
+    _makeSuffixArray( output_path )
+    log.info('Wrote {0} reference sequences for preset "{1}" to "{2}"'.format(len(recs), preset, output_path))
     return True
 
 def _makeExonMap( output_path, locus ):
     data = {}
-    exon_dir = op.join( _REF_PATH, locus, "exons" )
+    exon_dir = op.join( _referencePath(), locus, "exons" )
     if _dir_exists( exon_dir ):
         for filename in os.listdir( exon_dir ):
             if filename.endswith(".fasta"):
@@ -132,46 +233,61 @@ def _makeExonMap( output_path, locus ):
 
 ## Public accessor functions
 
+def referenceDirectory():
+    """Return the directory the references are read from and updated in"""
+    return _referencePath()
+
 def genomicReferenceExists():
-    return utils.isValidFile( _GENOMIC_REF )
+    return utils.isValidFile( _referenceFile(_GENOMIC_REF) )
 
 def cDNAReferenceExists():
-    return utils.isValidFile( _CDNA_REF )
+    return utils.isValidFile( _referenceFile(_CDNA_REF) )
 
 def exonReferenceExists():
-    return utils.isValidFile( _EXON_REF )
+    return utils.isValidFile( _referenceFile(_EXON_REF) )
+
+def presetReferenceExists( preset ):
+    return utils.isValidFile( _referenceFile(_PRESET_REF.format(preset)) )
 
 def makeGenomicReference():
-    return _makeReference( _GENOMIC_REF, _GENOMIC_SUFFIX )
+    return _makeReference( _referenceFile(_GENOMIC_REF), _GENOMIC_SUFFIX )
 
 def makeCDNAReference():
-    return _makeReference( _CDNA_REF, _CDNA_SUFFIX )
+    return _makeReference( _referenceFile(_CDNA_REF), _CDNA_SUFFIX )
+
+def makePresetReference( preset ):
+    return _makePresetReference( _referenceFile(_PRESET_REF.format(preset)), preset )
+
+def makePresetReferences():
+    """(Re-)build the reduced genomic reference of every preset"""
+    return all( makePresetReference( preset ) for preset in sorted(PRESET_LOCI) )
 
 def makeExonReference():
     data = {}
-    for resource in pkg.resource_listdir(_REF_DIR, ''):
-        if pkg.resource_isdir(_REF_DIR, resource ):
+    refPath = _referencePath()
+    for resource in os.listdir( refPath ):
+        if op.isdir( op.join(refPath, resource) ):
             expected_file = "{0}_exons.map".format(resource)
-            expected_path = op.join(_REF_PATH, resource, expected_file)
+            expected_path = op.join(refPath, resource, expected_file)
             if op.exists( expected_path ):
                 data[resource] = expected_path
             elif _make_exon_map( expected_path, resource ):
                 data[resource] = expected_path
             else:
                 raise MissingReferenceException('Missing expected reference file "{0}" for Locus "{1}"'.format(expected_file, resource))
-    _writeMap( _EXON_REF, data )
+    _writeMap( _referenceFile(_EXON_REF), data )
     return True
 
 def version():
     try:
-        with open(_VERSION_REF) as handle:
+        with open(_referenceFile(_VERSION_REF)) as handle:
             return handle.read().strip()
     except:
         raise MissingMetaDataException("Unable to read reference version")
 
 def date():
     try:
-        with open(_DATE_REF) as handle:
+        with open(_referenceFile(_DATE_REF)) as handle:
             return handle.read().strip()
     except:
         raise MissingMetaDataException("Unable to read reference date")
@@ -179,29 +295,65 @@ def date():
 def genomicReference():
     if genomicReferenceExists():
         log.debug("Using existing Genomic Reference FASTA")
-        return _GENOMIC_REF
+        return _referenceFile(_GENOMIC_REF)
     elif makeGenomicReference():
         log.debug("No Genomic Reference FASTA found, attempting to generate one...")
-        return _GENOMIC_REF
+        return _referenceFile(_GENOMIC_REF)
     else:
         raise MissingReferenceException('Unable to generate Genomic reference FASTA')
 
 def cDNAReference():
     if cDNAReferenceExists():
         log.debug("Using existing cDNA Reference FASTA")
-        return _CDNA_REF
+        return _referenceFile(_CDNA_REF)
     elif makeCDNAReference():
         log.debug("No cDNA Reference FASTA found, attempting to generate one...")
-        return _CDNA_REF
+        return _referenceFile(_CDNA_REF)
     else:
         raise MissingReferenceException('Unable to generate cDNA reference FASTA')
 
+def presetReference( preset ):
+    if presetReferenceExists( preset ):
+        log.debug('Using existing Genomic Reference FASTA for preset "{0}"'.format(preset))
+        return _referenceFile(_PRESET_REF.format(preset))
+    elif makePresetReference( preset ):
+        log.debug('No Genomic Reference FASTA found for preset "{0}", attempting to generate one...'.format(preset))
+        return _referenceFile(_PRESET_REF.format(preset))
+    else:
+        raise MissingReferenceException('Unable to generate Genomic reference FASTA for preset "{0}"'.format(preset))
+
+def genomicAliases():
+    """Return the alias table of the Genomic reference, which may not exist"""
+    return _aliasFile( _referenceFile(_GENOMIC_REF) )
+
+def cDNAAliases():
+    """Return the alias table of the cDNA reference, which may not exist"""
+    return _aliasFile( _referenceFile(_CDNA_REF) )
+
+def alleleGroupFiles():
+    """Return the IMGT G- and P-group files, or None for either one missing"""
+    return tuple( _referenceFile(f) if utils.isValidFile( _referenceFile(f) ) else None
+                  for f in (_G_GROUP_REF, _P_GROUP_REF) )
+
+def msaReferences():
+    """Return the MSA matrix file of every locus that has one, by locus"""
+    data = {}
+    refPath = _referencePath()
+    for resource in sorted(os.listdir( refPath )):
+        expected_path = op.join( refPath, resource, "{0}_{1}.npz".format(resource, _MSA_SUFFIX) )
+        if utils.isValidFile( expected_path ):
+            data[resource] = expected_path
+    return data
+
+def presetLoci( preset ):
+    return list(_presetLoci( preset ))
+
 def exonReference():
     if exonReferenceExists():
         log.debug("Using existing Exon Reference Map")
-        return _EXON_REF
+        return _referenceFile(_EXON_REF)
     elif makeExonReference():
         log.debug("No Exon Reference Map found, attempting to generate one...")
-        return _EXON_REF
+        return _referenceFile(_EXON_REF)
     else:
         raise MissingReferenceException('Unable to generate exon reference map')
@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+
+import socket
+import logging
+import os.path as op
+
+from LociTools.server import protocol
+from LociTools.server.protocol import TypingServerError
+
+log = logging.getLogger(__name__)
+
+
+class TypingClient( object ):
+    """
+    Submit jobs to a running TypingServer.  This and the protocol module
+    import nothing beyond the standard library, so a submission costs
+    only the round trip.
+    """
+
+    def __init__( self, socketPath ):
+        self._socketPath = socketPath
+
+    def _request( self, request ):
+        connection = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        try:
+            try:
+                connection.connect( self._socketPath )
+            except socket.error as e:
+                raise TypingServerError('No typing server listening on "{0}": {1}'.format(self._socketPath, e))
+            connection.sendall( protocol.encode( request ))
+            handle = connection.makefile('r')
+            line = handle.readline()
+            handle.close()
+        finally:
+            connection.close()
+        if not line:
+            raise TypingServerError("The typing server closed the connection without replying")
+        response = protocol.decode( line )
+        if response.get('status') != protocol.STATUS_OK:
+            raise TypingServerError( response.get('message', 'Unknown server error') )
+        return response
+
+    def ping( self ):
+        """Return the reference version served, or raise if there is no server"""
+        return self._request({'command': protocol.PING})['version']
+
+    def shutdown( self ):
+        self._request({'command': protocol.SHUTDOWN})
+
+    def typing( self, inputArg, force=False ):
+        """Type one input file or directory, returning the selected sequences"""
+        response = self._request({'command': protocol.TYPING,
+                                  'input': op.abspath( inputArg ),
+                                  'force': force})
+        log.info('Typing of "{0}" took {1:.3f}s on the server'.format(inputArg, response['elapsed']))
+        return response['selected']
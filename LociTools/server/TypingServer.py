@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+
+import os
+import time
+import errno
+import socket
+import logging
+import os.path as op
+import threading
+import SocketServer
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from LociTools.server import protocol
+from LociTools.server.protocol import TypingServerError
+from LociTools.utils.resources import detectResources
+
+log = logging.getLogger(__name__)
+
+
+## Private utilities
+
+def _removeStaleSocket( socketPath ):
+    """Remove a socket file left behind by a server that is no longer running"""
+    if not op.exists( socketPath ):
+        return
+    probe = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    try:
+        probe.connect( socketPath )
+    except socket.error as e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            os.remove( socketPath )
+            return
+        raise
+    finally:
+        probe.close()
+    raise TypingServerError('A server is already listening on "{0}"'.format(socketPath))
+
+
+class _RequestHandler( SocketServer.StreamRequestHandler ):
+
+    def handle( self ):
+        start = time.time()
+        try:
+            request = protocol.decode( self.rfile.readline() )
+            response = self.server.dispatch( request )
+        except Exception as e:
+            log.exception("Typing request failed")
+            response = {'status': protocol.STATUS_ERROR, 'message': str(e)}
+        response['elapsed'] = time.time() - start
+        self.wfile.write( protocol.encode( response ))
+
+
+class _ThreadedUnixServer( SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+    daemon_threads = True
+
+
+class TypingServer( object ):
+    """
+    A long-running typing worker listening on a local Unix socket.  The
+    references are resolved, validated and counted once at start-up and
+    kept, with the BLASR runner's caches, for every later job.  Each
+    connection submits one job, and jobs run concurrently on a pool of
+    `workers` threads, the heavy lifting being done in BLASR subprocesses
+    that split the CPUs between them.  Jobs on the same input, given as a
+    file or its directory, share its output files, so they run one at a time.
+    """
+
+    def __init__( self, socketPath, workers=None, typer=None, scratchDir=None ):
+        self._socketPath = socketPath
+        self._workers    = max(1, workers or detectResources().serverWorkers)
+        self._typer      = typer
+        self._scratchDir = scratchDir
+        self._pool       = None
+        self._server     = None
+        self._lock       = threading.Lock()
+        self._jobs       = 0
+        self._inputLocks = {}
+
+    @property
+    def socketPath(self):
+        return self._socketPath
+
+    def _warmUp( self ):
+        """Load everything a typing job needs before accepting any"""
+        if self._typer is None:
+            from LociTools.typing import LociTyper
+            self._typer = LociTyper( "all", scratchDir=self._scratchDir )
+        # Concurrent jobs share the CPUs, as the align workers of a pipeline do
+        if self._workers > 1:
+            self._typer.blasrThreads = self._typer.blasrThreads // self._workers
+        blasr = self._typer._blasr
+        blasr._validateReference( self._typer.genomicRef )
+        blasr._referenceSize( self._typer.genomicRef )
+        log.info('Warmed up references version {0}'.format(self._typer.version))
+
+    @contextmanager
+    def _inputLock( self, inputFile ):
+        """Hold the lock of one input, dropping it once no job is waiting on it"""
+        with self._lock:
+            lock, users = self._inputLocks.get( inputFile, (threading.Lock(), 0) )
+            self._inputLocks[inputFile] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._inputLocks[inputFile]
+                if users == 1:
+                    del self._inputLocks[inputFile]
+                else:
+                    self._inputLocks[inputFile] = (lock, users - 1)
+
+    def _type( self, inputFile, force ):
+        with self._lock:
+            self._jobs += 1
+            jobId = self._jobs
+        with self._inputLock( op.realpath( self._typer.resolveInput( inputFile ))):
+            log.info('Job {0}: typing "{1}"'.format(jobId, inputFile))
+            selected = self._typer( inputFile, resume=not force )
+            log.info('Job {0}: finished'.format(jobId))
+        return selected
+
+    def dispatch( self, request ):
+        """Handle one decoded request, returning the response to send"""
+        command = request.get('command')
+        if command == protocol.PING:
+            return {'status': protocol.STATUS_OK, 'version': self._typer.version}
+        elif command == protocol.SHUTDOWN:
+            threading.Thread( target=self._server.shutdown ).start()
+            return {'status': protocol.STATUS_OK}
+        elif command == protocol.TYPING:
+            inputFile = request.get('input')
+            if not inputFile or not op.isabs( inputFile ):
+                raise TypingServerError("Typing requests need an absolute input path")
+            selected = self._pool.apply( self._type, (inputFile, bool(request.get('force'))) )
+            return {'status': protocol.STATUS_OK, 'selected': selected}
+        raise TypingServerError('Unknown command "{0}"'.format(command))
+
+    def serve( self ):
+        """Serve typing jobs until a shutdown request or interrupt arrives"""
+        _removeStaleSocket( self._socketPath )
+        self._warmUp()
+        self._pool = ThreadPool( self._workers )
+        self._server = _ThreadedUnixServer( self._socketPath, _RequestHandler )
+        self._server.dispatch = self.dispatch
+        os.chmod( self._socketPath, 0600 )
+        log.info('Serving typing jobs on "{0}" with {1} worker(s) of {2} BLASR thread(s)'.format(
+                 self._socketPath, self._workers, self._typer.blasrThreads))
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Interrupted, shutting down")
+        finally:
+            self._server.server_close()
+            self._pool.close()
+            self._pool.join()
+            if op.exists( self._socketPath ):
+                os.remove( self._socketPath )
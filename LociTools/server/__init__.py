@@ -0,0 +1,2 @@
+from .protocol import TypingServerError
+from .TypingClient import TypingClient
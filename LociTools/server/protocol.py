@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+
+import json
+
+# The wire protocol between TypingClient and TypingServer, kept free of
+#  any LociTools import so a client submission loads only the standard
+#  library.  Requests and responses are single-line JSON objects, one per
+#  connection:
+#   {"command": "typing", "input": "/abs/path", "force": false}
+#   {"command": "ping"}
+#   {"command": "shutdown"}
+# Every response carries a "status" of "ok" or "error", with a "message"
+#  for errors.
+
+__all__ = ["TypingServerError", "encode", "decode"]
+
+PING     = 'ping'
+SHUTDOWN = 'shutdown'
+TYPING   = 'typing'
+
+STATUS_OK    = 'ok'
+STATUS_ERROR = 'error'
+
+
+class TypingServerError(Exception):
+    pass
+
+
+def encode( message ):
+    """Serialize one request or response as a line"""
+    return json.dumps( message ) + '\n'
+
+def decode( line ):
+    """Parse one request or response line"""
+    if not line:
+        raise TypingServerError("The connection closed without a message")
+    return json.loads( line )
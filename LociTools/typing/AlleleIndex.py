@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+import re
+import logging
+import os.path as op
+
+log = logging.getLogger(__name__)
+
+__all__ = ["AlleleIndex"]
+
+# Allele names follow the HLA nomenclature, optionally behind an accession:
+#   HLA00001_A*01:01:01:01   locus A, fields (01, 01, 01, 01)
+#   A*01:04:01:01N           expression suffix N, for a null allele
+# G- and P-group files (IMGT's hla_nom_g.txt / hla_nom_p.txt) have lines of
+#   A*;01:01:01:01/01:01:01:02N/...;01:01:01G
+# naming the alleles of each group, with an empty group for ungrouped ones.
+
+_SUFFIX = re.compile(r'^(.*?)([A-Z]?)$')
+
+
+## Private utilities
+
+def _alleleName( name ):
+    """Strip any accession prefix, e.g. 'HLA00001_A*01:01:01:01' to 'A*01:01:01:01'"""
+    return name.split()[0].split('_')[-1]
+
+def _parseName( name ):
+    """Split an allele name into its locus, field tuple and expression suffix"""
+    allele = _alleleName( name )
+    locus, _, rest = allele.partition('*')
+    if not rest:
+        return locus, (), ''
+    body, suffix = _SUFFIX.match( rest ).groups()
+    return locus, tuple(body.split(':')), suffix
+
+def _readGroups( filepath ):
+    """Read a G- or P-group file into a map of allele name to group name"""
+    groups = {}
+    if filepath is None or not op.isfile( filepath ):
+        return groups
+    with open( filepath ) as handle:
+        for line in handle:
+            if line.startswith('#'):
+                continue
+            parts = line.strip().split(';')
+            if len(parts) < 3 or not parts[2]:
+                continue
+            locus = parts[0]
+            for allele in parts[1].split('/'):
+                groups[locus + allele] = locus + parts[2]
+    return groups
+
+
+class _LocusCache( dict ):
+    """Loci by full reference name, parsing each name only the first time it is seen"""
+
+    __slots__ = ()
+
+    def __missing__( self, name ):
+        locus = self[name] = _parseName( name )[0]
+        return locus
+
+
+class _TrieNode( object ):
+    __slots__ = ('children', 'ids')
+
+    def __init__( self ):
+        self.children = {}
+        self.ids      = []
+
+
+class AlleleIndex( object ):
+    """
+    Every allele name of a reference, parsed once into its locus, fields,
+    expression suffix and G/P groups, and addressed by an integer ID.  A
+    trie over locus and fields answers resolution queries, e.g. all the
+    alleles of 'A*01:01', without touching a string per allele.
+    """
+
+    _cache = {}
+
+    def __init__( self, names, gGroupFile=None, pGroupFile=None ):
+        gGroups = _readGroups( gGroupFile )
+        pGroups = _readGroups( pGroupFile )
+        self.names    = []
+        self.loci     = []
+        self.locusIds = []
+        self.fields   = []
+        self.suffixes = []
+        self.gGroups  = []
+        self.pGroups  = []
+        self._ids     = {}
+        self._locusIndex = {}
+        self.lociByName  = _LocusCache()
+        self._root    = _TrieNode()
+        for name in names:
+            self._add( name, gGroups, pGroups )
+        log.debug('Indexed {0} allele names over {1} loci'.format(len(self.names), len(self.loci)))
+
+    @classmethod
+    def forReference( cls, refFile, gGroupFile=None, pGroupFile=None ):
+        """Return the index of a reference FASTA, built once per version of the file"""
+        key = (op.abspath( refFile ), op.getsize( refFile ), op.getmtime( refFile ), gGroupFile, pGroupFile)
+        if key not in cls._cache:
+            with open( refFile ) as handle:
+                names = [line[1:].split()[0] for line in handle if line.startswith('>')]
+            cls._cache[key] = cls( names, gGroupFile, pGroupFile )
+        return cls._cache[key]
+
+    def _add( self, name, gGroups, pGroups ):
+        name = name.split()[0]
+        if name in self._ids:
+            return self._ids[name]
+        locus, fields, suffix = _parseName( name )
+        if locus not in self._locusIndex:
+            self._locusIndex[locus] = len(self.loci)
+            self.loci.append( locus )
+        alleleId = len(self.names)
+        allele = _alleleName( name )
+        self._ids[name] = alleleId
+        self.lociByName[name] = locus
+        self.names.append( name )
+        self.locusIds.append( self._locusIndex[locus] )
+        self.fields.append( fields )
+        self.suffixes.append( suffix )
+        self.gGroups.append( gGroups.get( allele ))
+        self.pGroups.append( pGroups.get( allele ))
+
+        node = self._root
+        for key in (locus,) + fields:
+            node = node.children.setdefault( key, _TrieNode() )
+            node.ids.append( alleleId )
+        return alleleId
+
+    def __len__( self ):
+        return len(self.names)
+
+    def __contains__( self, name ):
+        return name.split()[0] in self._ids
+
+    def id( self, name ):
+        return self._ids[name.split()[0]]
+
+    def locus( self, name ):
+        """
+        Return the locus of a reference name.  Hot loops should call
+        lociByName.__getitem__ directly, a single dict lookup per name.
+        """
+        return self.lociByName[name]
+
+    def resolution( self, alleleId, nFields ):
+        """Return an allele's name at 1-4 field resolution, e.g. 'A*01:01' for 2"""
+        return '{0}*{1}'.format(self.loci[self.locusIds[alleleId]],
+                                ':'.join( self.fields[alleleId][:nFields] ))
+
+    def resolve( self, prefix ):
+        """Return the IDs of every allele under a name prefix, e.g. 'A*01:01'"""
+        locus, fields, _ = _parseName( prefix )
+        node = self._root.children.get( locus )
+        for field in fields:
+            if node is None:
+                break
+            node = node.children.get( field )
+        return list(node.ids) if node is not None else []
+
+    def group( self, alleleId, kind='G' ):
+        """Return an allele's G- or P-group, or None if it has none"""
+        return (self.gGroups if kind == 'G' else self.pGroups)[alleleId]
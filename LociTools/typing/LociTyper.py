@@ -5,10 +5,16 @@ import os.path as op
 from enum import Enum
 
 from LociTools import utils
+from LociTools.utils import instrumentation, tracing
 from LociTools.utils.orientation import orientSequences
+from LociTools.utils.aliases import expandHits
+from LociTools.utils.workspace import Workspace
 from LociTools import references
 from LociTools.external import BlasrRunner
 from LociTools.typing import SequenceSelector
+from LociTools.typing.MsaTyper import MsaTyper
+from LociTools.typing.AlleleIndex import AlleleIndex
+from LociTools.typing.StageRunner import StageRunner
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +26,20 @@ class GroupingType(Enum):
     ALL = 4
 
 
+class _TypingRun( object ):
+    """The state of one input as it moves through the typing stages"""
+
+    def __init__( self, inputArg, inputFile, stages, workspace ):
+        self.inputArg  = inputArg
+        self.inputFile = inputFile
+        self.stages    = stages
+        self.workspace = workspace
+        self.alignFile = None
+
+    def close( self ):
+        self.workspace.close()
+
+
 class LociTyper( object ):
 
     def __init__( self, loci,
@@ -27,16 +47,29 @@ class LociTyper( object ):
                         blasrExe=None,
                         genomicRef=None,
                         cDnaRef=None,
-                        exonRef=None):
+                        exonRef=None,
+                        resume=True,
+                        scratchDir=None,
+                        preset=None,
+                        selectMemory=None,
+                        results=None):
         self.version    = references.version()
         self.date       = references.date()
         self.loci       = loci
         self.grouping   = grouping
+        self.preset     = preset
         self.genomicRef = genomicRef
         self.cDnaRef    = cDnaRef
         self.exonRef    = exonRef
+        self.resume     = resume
+        self.scratchDir = scratchDir
+        self.results    = results
         self._blasr     = BlasrRunner.BlasrRunner( blasrExe )
-        self._selector  = SequenceSelector.SequenceSelector()
+        self._selector  = SequenceSelector.SequenceSelector( maxMemory=selectMemory )
+        if preset is not None:
+            self._selector.loci = references.presetLoci( preset )
+        self._msaTyper  = MsaTyper( references.msaReferences() )
+        self._selector.alleleIndex = AlleleIndex.forReference( self.genomicRef, *references.alleleGroupFiles() )
 
         # Stuff
         print [s.name for s in GroupingType]
@@ -62,13 +95,33 @@ class LociTyper( object ):
         else:
             raise TypeError("Value for 'grouping' not a valid GroupingType!")
 
+    @property
+    def blasrThreads(self):
+        return self._blasr._nproc
+
+    @blasrThreads.setter
+    def blasrThreads(self, arg):
+        self._blasr._nproc = max(1, int(arg))
+
+    @property
+    def preset(self):
+        return self._preset
+
+    @preset.setter
+    def preset(self, arg):
+        if arg is not None and arg not in references.PRESET_LOCI:
+            raise ValueError('Invalid preset "{0}"'.format(arg))
+        self._preset = arg
+
     @property
     def genomicRef(self):
         return self._genomicRef
 
     @genomicRef.setter
     def genomicRef(self, arg):
-        if arg is None:
+        if arg is None and self.preset is not None:
+            self._genomicRef = references.presetReference( self.preset )
+        elif arg is None:
             self._genomicRef = references.genomicReference()
         else:
             log.debug('Overriding default Genomic Reference FASTA with "{0}"'.format(arg))
@@ -108,18 +161,16 @@ class LociTyper( object ):
             log.info("Input appears to be a directory, looking for analysis FASTQ result")
             contents = os.listdir( inputArg )
             absDir = op.abspath( inputArg )
-            if "amplicon_analysis.fastq" in contents:
-                absPath = op.join( absDir, "amplicon_analysis.fastq" )
-                if utils.isValidFastq( absPath ):
-                    return absPath
-            elif "loci_analysis.fastq" in contents:
-                absPath = op.join( absDir, "loci_analysis.fastq" )
-                if utils.isValidFastq( absPath ):
-                    return absPath
-            else:
-                msg = "No valid analysis FASTQ files found in the input directory!"
-                log.error( msg )
-                raise IOError( msg )
+            candidates = [name + suffix for name in ("amplicon_analysis.fastq", "loci_analysis.fastq")
+                                        for suffix in ('',) + utils.COMPRESSED_SUFFIXES]
+            for candidate in candidates:
+                if candidate in contents:
+                    absPath = op.join( absDir, candidate )
+                    if utils.isValidFastq( absPath ):
+                        return absPath
+            msg = "No valid analysis FASTQ files found in the input directory!"
+            log.error( msg )
+            raise IOError( msg )
         elif utils.isValidFile( inputArg ):
             if utils.isValidFasta( inputArg ):
                 return op.abspath( inputArg )
@@ -134,18 +185,135 @@ class LociTyper( object ):
             log.error( msg )
             raise IOError( msg )
 
-    def __call__(self, inputArg ):
-        # Second, get the input file if a directory was specified
-        inputFile = self.__validateInput( inputArg )
-        print "INPUT: ", inputFile
-        print "BLASR: ", self._blasr._exe
+    def __manifestFile( self, inputFile ):
+        """Name the sidecar stage manifest for an input file"""
+        basename = '.'.join( inputFile.split('.')[:-1] )
+        return '%s.stages.json' % basename
+
+    def __alignFile( self, inputFile ):
+        """Name the genomic alignment of an input file, beside it"""
+        basename = '.'.join( utils.stripCompressedSuffix( inputFile ).split('.')[:-1] )
+        return '%s.genomic.m5' % basename
+
+    def __hitsFile( self, inputFile ):
+        """Name the reference hit table of an input file, beside it"""
+        basename = '.'.join( utils.stripCompressedSuffix( inputFile ).split('.')[:-1] )
+        return '%s.hits.txt' % basename
 
-        alignFile = self._blasr.fullBestAlignment( inputFile, self.genomicRef )
-        print "FIRST ALIGN: ", alignFile
-        reoriented = orientSequences( inputFile, alignFile )
-        print "ORIENTED: ", reoriented
-        selected = self._selector( reoriented, alignFile=alignFile )
-        print "SELECTED: ", selected
+    def __typingFile( self, inputFile ):
+        """Name the MSA typing table of an input file, beside it"""
+        basename = '.'.join( utils.stripCompressedSuffix( inputFile ).split('.')[:-1] )
+        return '%s.typing.txt' % basename
+
+    def __inWorkspace( self, workspace, destination, func, *args, **kwargs ):
+        """
+        Run a stage function with its output file, the last positional
+        argument, in the workspace, then commit that output to destination
+        """
+        output = func( *(args + (workspace.file( destination ),)), **kwargs )
+        return workspace.commit( output, destination )
+
+    def __countFile( self, name, filepath ):
+        instrumentation.addCount( name, nBytes=op.getsize( filepath ))
+
+    ## Public methods
+
+    def resolveInput( self, inputArg ):
+        """Return the sequence file a run on this input file or directory would type"""
+        return self.__validateInput( inputArg )
+
+    def stageManifest( self, inputFile ):
+        """Return the stage manifest a run on this input file records its stages in"""
+        return op.abspath( self.__manifestFile( inputFile ))
+
+    def selectorParams( self ):
+        """Return the sequence selection settings, as recorded in the stage manifest"""
+        return {'method': self._selector.method,
+                'sort': self._selector.sort,
+                'loci': self._selector.loci,
+                'minFraction': self._selector.minFraction}
+
+    def prepare( self, inputArg, resume=None ):
+        """
+        Validate one input file or analysis directory and open the scratch
+        workspace its stages will write into.  `resume` overrides the
+        typer's default for this run.
+        """
+        with tracing.span( "prepare", "sample", sample=inputArg ), instrumentation.stage("validate"):
+            inputFile = self.__validateInput( inputArg )
+            self.__countFile( "input", inputFile )
+        log.info("Input: {0}".format( inputFile ))
+        log.info("BLASR: {0}".format( self._blasr._exe ))
+
+        resume = self.resume if resume is None else resume
+        stages = StageRunner( self.__manifestFile( inputFile ), self.version, resume=resume )
+        # Each stage writes into a private scratch workspace, and only its
+        #  finished output is committed beside the input
+        return _TypingRun( inputArg, inputFile, stages, Workspace( self.scratchDir ).open() )
+
+    def align( self, run ):
+        """Align a prepared run's sequences to the genomic reference"""
+        with tracing.span( "align", "sample", sample=run.inputFile ), instrumentation.stage("align"):
+            run.alignFile = run.stages.run( "align", [run.inputFile, self.genomicRef],
+                                            {'exe': self._blasr._exe},
+                                            self.__inWorkspace, run.workspace, self.__alignFile( run.inputFile ),
+                                            self._blasr.fullBestAlignment, run.inputFile, self.genomicRef )
+            self.__countFile( "alignment", run.alignFile )
+        log.info("First alignment: {0}".format( run.alignFile ))
+        return run
+
+    def finish( self, run ):
+        """Orient, select and report on an aligned run, returning the selected sequences"""
+        with tracing.span( "finish", "sample", sample=run.inputFile ):
+            return self.__finish( run )
+
+    def __finish( self, run ):
+        inputFile, alignFile, stages, workspace = run.inputFile, run.alignFile, run.stages, run.workspace
+        with instrumentation.stage("orient"):
+            reoriented = stages.run( "orient", [inputFile, alignFile], {},
+                                     self.__inWorkspace, workspace, utils.getOutputFile( inputFile, 'oriented' ),
+                                     orientSequences, inputFile, alignFile )
+            self.__countFile( "oriented", reoriented )
+        log.info("Oriented: {0}".format( reoriented ))
+        with instrumentation.stage("select"):
+            selected = stages.run( "select", [reoriented, alignFile], self.selectorParams(),
+                                   self.__inWorkspace, workspace, utils.getOutputFile( reoriented, 'selected' ),
+                                   self._selector, reoriented, alignFile=alignFile )
+            self.__countFile( "selected", selected )
+        log.info("Selected: {0}".format( selected ))
+        with instrumentation.stage("hits"):
+            aliasFile = references.genomicAliases()
+            hitInputs = [selected, alignFile] + ([aliasFile] if utils.isValidFile( aliasFile ) else [])
+            hits = stages.run( "hits", hitInputs, {},
+                               self.__inWorkspace, workspace, self.__hitsFile( inputFile ),
+                               expandHits, alignFile, aliasFile, queryFile=selected )
+        log.info("Hits: {0}".format( hits ))
+        typing = None
+        if self._msaTyper.loci:
+            with instrumentation.stage("msa"):
+                typing = stages.run( "msa", [selected, alignFile] + self._msaTyper.msaFiles,
+                                     {'top': self._msaTyper.top},
+                                     self.__inWorkspace, workspace, self.__typingFile( inputFile ),
+                                     self._msaTyper, alignFile, queryFile=selected )
+            log.info("MSA typing: {0}".format( typing ))
+        if self.results is not None:
+            self.results.addSample( run.inputArg, selected, hits, typing, timings=stages.timings,
+                                    referenceVersion=self.version, referenceDate=self.date,
+                                    preset=self.preset )
+        return selected
+
+    def __call__(self, inputArg, resume=None ):
+        """
+        Type one input file or analysis directory, returning the selected
+        sequences.  `resume` overrides the typer's default for this run.
+        """
+        with tracing.span( "typing", "sample", sample=inputArg ):
+            run = self.prepare( inputArg, resume=resume )
+            try:
+                self.align( run )
+                selected = self.finish( run )
+            finally:
+                run.close()
 
         #trimmed = trim_alleles( selected, trim=trim )
         #gDNA_alignment = full_align_best_reference( trimmed, genomic_reference )
@@ -153,3 +321,4 @@ class LociTyper( object ):
         #cDNA_alignment = align_by_identity( cDNA_file, cDNA_reference )
         #typing = summarize_typing( gDNA_alignment, cDNA_alignment )
         #return typing
+        return selected
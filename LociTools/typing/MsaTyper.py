@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+
+import string
+import logging
+
+from LociTools import utils
+from LociTools.io import openBlasrFile
+from LociTools.imgt.MsaMatrix import MsaMatrix
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOP = 5
+ALIGN_COLUMNS = ('qname', 'tname', 'tstrand', 'tstart', 'tend', 'tlength', 'qstring', 'tstring')
+HEADER = ('qname', 'locus', 'rank', 'allele', 'mismatches', 'compared')
+
+__all__ = ["MsaTyper"]
+
+_COMPLEMENT = string.maketrans( "ACGTNacgtn", "TGCANtgcan" )
+
+
+## Private utilities
+
+def _locusOf( tname ):
+    return tname.split('*')[0].split('_')[-1]
+
+def _reverseComplement( aligned ):
+    return aligned.translate( _COMPLEMENT )[::-1]
+
+def _forwardStrand( alignment ):
+    """
+    Return the (tstart, tstring, qstring) of an alignment along the forward
+    strand of its allele.  BLASR reports a reverse-strand hit with the query
+    forward against the reverse-complemented allele, in that strand's
+    coordinates.
+    """
+    if alignment.tstrand != '-':
+        return int(alignment.tstart), alignment.tstring, alignment.qstring
+    return (int(alignment.tlength) - int(alignment.tend),
+            _reverseComplement( alignment.tstring ), _reverseComplement( alignment.qstring ))
+
+
+class MsaTyper( object ):
+    """
+    Type sequences against whole loci at once.  Each query is projected
+    onto its locus's MSA columns through its one genomic alignment, then
+    every allele of the locus is scored against it together, so ranking
+    thousands of alleles costs one matrix operation rather than thousands
+    of alignments.
+    """
+
+    def __init__( self, msaFiles, top=DEFAULT_TOP ):
+        self._msaFiles = dict(msaFiles)
+        self._msas     = {}
+        self.top       = top
+
+    @property
+    def loci(self):
+        return sorted(self._msaFiles)
+
+    @property
+    def msaFiles(self):
+        return [self._msaFiles[locus] for locus in self.loci]
+
+    def _msa( self, locus ):
+        """Load a locus's MSA matrix on first use"""
+        if locus not in self._msas:
+            self._msas[locus] = MsaMatrix.load( self._msaFiles[locus] )
+        return self._msas[locus]
+
+    def typeAlignment( self, alignment ):
+        """
+        Rank the alleles of the aligned locus for one query, returning
+        (allele, mismatches, compared) tuples best first, or None if no
+        MSA covers the aligned allele
+        """
+        locus = _locusOf( alignment.tname )
+        if locus not in self._msaFiles:
+            return None
+        msa = self._msa( locus )
+        if alignment.tname not in msa:
+            log.warn('Allele "{0}" is not in the {1} MSA matrix'.format(alignment.tname, locus))
+            return None
+        query, start, end = msa.project( alignment.tname, *_forwardStrand( alignment ))
+        order, mismatches, compared = msa.rank( query, start, end )
+        return [(msa.alleles[i], int(mismatches[i]), int(compared[i])) for i in order[:self.top]]
+
+    def __call__( self, alignFile, outputFile, queryFile=None ):
+        """
+        Type every aligned query, or only those in `queryFile`, writing the
+        top-ranked alleles for each to a tab-delimited output file
+        """
+        queries = None
+        if queryFile is not None:
+            queries = set(r.name.split()[0] for r in utils.readSequenceRecords( queryFile ))
+        count = 0
+        with open( outputFile, 'w' ) as handle:
+            handle.write( '\t'.join( HEADER ) + '\n' )
+            for alignment in openBlasrFile( alignFile, columns=ALIGN_COLUMNS ):
+                if queries is not None and alignment.qname not in queries:
+                    continue
+                ranked = self.typeAlignment( alignment )
+                if ranked is None:
+                    continue
+                count += 1
+                locus = _locusOf( alignment.tname )
+                for rank, (allele, mismatches, compared) in enumerate( ranked, 1 ):
+                    handle.write( '\t'.join( str(v) for v in (alignment.qname, locus, rank, allele,
+                                                              mismatches, compared) ) + '\n' )
+        log.info('Typed {0} sequences against MSA matrices for {1}'.format(count, ', '.join(self.loci)))
+        return outputFile
@@ -0,0 +1,318 @@
+#! /usr/bin/env python
+
+import time
+import logging
+import sqlite3
+import threading
+import os.path as op
+
+from LociTools import utils
+
+log = logging.getLogger(__name__)
+
+__all__ = ["ResultsStore", "ResultsStoreError"]
+
+SCHEMA_VERSION = 2
+DEFAULT_BATCH_SIZE = 32
+BUSY_TIMEOUT = 60.0
+
+# One row per typed sample, keyed by its input file, with its selected
+#  sequences, best reference hits, MSA allele calls and stage timings in
+#  child tables.  A hit to a collapsed reference sequence stands for every
+#  allele identical to it, so each hit has one hitAlleles row per allele
+#  for the allele queries to find.  Re-typing an input replaces its rows.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id               INTEGER PRIMARY KEY,
+    input            TEXT NOT NULL UNIQUE,
+    sample           TEXT NOT NULL,
+    referenceVersion TEXT,
+    referenceDate    TEXT,
+    preset           TEXT,
+    typedAt          REAL
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    sampleId INTEGER NOT NULL,
+    name     TEXT NOT NULL,
+    length   INTEGER,
+    numReads INTEGER,
+    accuracy REAL
+);
+CREATE TABLE IF NOT EXISTS hits (
+    sampleId INTEGER NOT NULL,
+    qname    TEXT NOT NULL,
+    tname    TEXT NOT NULL,
+    locus    TEXT,
+    allele   TEXT,
+    nmis     INTEGER,
+    alleles  TEXT
+);
+CREATE TABLE IF NOT EXISTS hitAlleles (
+    sampleId INTEGER NOT NULL,
+    qname    TEXT NOT NULL,
+    locus    TEXT,
+    allele   TEXT
+);
+CREATE TABLE IF NOT EXISTS calls (
+    sampleId   INTEGER NOT NULL,
+    qname      TEXT NOT NULL,
+    locus      TEXT,
+    rank       INTEGER,
+    allele     TEXT,
+    mismatches INTEGER,
+    compared   INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    sampleId INTEGER NOT NULL,
+    stage    TEXT NOT NULL,
+    wallTime REAL,
+    skipped  INTEGER
+);
+CREATE INDEX IF NOT EXISTS samples_sample   ON samples (sample);
+CREATE INDEX IF NOT EXISTS sequences_sample ON sequences (sampleId);
+CREATE INDEX IF NOT EXISTS hits_sample      ON hits (sampleId);
+CREATE INDEX IF NOT EXISTS hits_locus       ON hits (locus, allele);
+CREATE INDEX IF NOT EXISTS hits_allele      ON hits (allele);
+CREATE INDEX IF NOT EXISTS hitAlleles_sample ON hitAlleles (sampleId, qname);
+CREATE INDEX IF NOT EXISTS hitAlleles_locus  ON hitAlleles (locus, allele);
+CREATE INDEX IF NOT EXISTS hitAlleles_allele ON hitAlleles (allele);
+CREATE INDEX IF NOT EXISTS calls_sample     ON calls (sampleId);
+CREATE INDEX IF NOT EXISTS calls_locus      ON calls (locus, allele);
+CREATE INDEX IF NOT EXISTS calls_allele     ON calls (allele);
+CREATE INDEX IF NOT EXISTS stages_sample    ON stages (sampleId);
+"""
+
+_CHILD_TABLES = ('sequences', 'hits', 'hitAlleles', 'calls', 'stages')
+
+
+class ResultsStoreError(Exception):
+    pass
+
+
+## Private utilities
+
+def _sampleName( inputArg ):
+    """Name a sample after its analysis directory, or its input file"""
+    inputArg = op.abspath( inputArg )
+    if op.isdir( inputArg ):
+        return op.basename( inputArg )
+    return op.basename( utils.stripCompressedSuffix( inputArg )).rsplit('.', 1)[0]
+
+def _readTable( filepath ):
+    """Read a tab-delimited table with a header line into dicts"""
+    if filepath is None or not utils.isValidFile( filepath ):
+        return []
+    with open( filepath ) as handle:
+        header = handle.readline().rstrip('\n').split('\t')
+        return [dict(zip(header, line.rstrip('\n').split('\t'))) for line in handle if line.strip()]
+
+def _sequenceRows( selectedFile ):
+    records = utils.readSequenceRecords( selectedFile )
+    accuracies = records.accuracies() if records.hasQuality else [None] * len(records)
+    return [(r.name, len(r), utils.getNumReads( r.name ), None if a is None else float(a))
+            for r, a in zip( records, accuracies )]
+
+def _alleleName( referenceName ):
+    """Return the allele a reference is named after, e.g. 'A*01:01' of 'HLA00001_A*01:01'"""
+    return referenceName.split()[0].split('_')[-1]
+
+def _hitAlleles( alleles ):
+    """Return the (locus, allele) of every allele a hit stands for"""
+    return [(_alleleName( name ).split('*')[0], _alleleName( name )) for name in alleles.split(',') if name]
+
+def _hitRows( hitsFile ):
+    rows = []
+    for hit in _readTable( hitsFile ):
+        allele = _alleleName( hit['tname'] )
+        rows.append( (hit['qname'], hit['tname'], allele.split('*')[0], allele,
+                      int(hit['nmis']), hit['alleles']) )
+    return rows
+
+def _callRows( typingFile ):
+    return [(c['qname'], c['locus'], int(c['rank']), c['allele'], int(c['mismatches']), int(c['compared']))
+            for c in _readTable( typingFile )]
+
+def _alleleFilter( column, allele ):
+    """
+    Match an allele or every allele under it, e.g. 'A*01:01' matches
+    'A*01:01:01:01' and 'A' every A allele, as an index-friendly range
+    rather than a LIKE
+    """
+    separator = ':' if '*' in allele else '*'
+    return ("({0} = ? OR ({0} >= ? AND {0} < ?))".format(column),
+            [allele, allele + separator, allele + chr(ord(separator) + 1)])
+
+
+class ResultsStore( object ):
+    """
+    A local SQLite database of typing results across runs.  Samples are
+    buffered and written in batched transactions, and the tables are
+    indexed by sample, locus and allele, so plate- and archive-wide
+    queries don't re-read any per-sample output files.  Safe to share
+    between the threads of one process.
+    """
+
+    def __init__( self, filename, batchSize=DEFAULT_BATCH_SIZE ):
+        self._filename  = op.abspath( filename )
+        self._batchSize = max(1, batchSize)
+        self._pending   = []
+        self._lock      = threading.RLock()
+        self._db = sqlite3.connect( self._filename, timeout=BUSY_TIMEOUT, check_same_thread=False )
+        self._db.row_factory = sqlite3.Row
+        version = self._db.execute( "PRAGMA user_version" ).fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ResultsStoreError('Results store "{0}" has schema version {1}, newer than {2}'.format(
+                                    self._filename, version, SCHEMA_VERSION))
+        with self._db:
+            self._db.executescript( _SCHEMA )
+            if version == 1:
+                self._addHitAlleles()
+            self._db.execute( "PRAGMA user_version = {0}".format(SCHEMA_VERSION) )
+
+    def _addHitAlleles( self ):
+        """Expand the hits of a version 1 store, which only kept their alleles as text"""
+        hits = self._db.execute( "SELECT sampleId, qname, alleles FROM hits" ).fetchall()
+        self._db.executemany( "INSERT INTO hitAlleles VALUES (?, ?, ?, ?)",
+                              [(hit['sampleId'], hit['qname']) + row
+                               for hit in hits for row in _hitAlleles( hit['alleles'] or '' )] )
+        log.info('Expanded the alleles of {0} stored hit(s)'.format(len(hits)))
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
+
+    def close( self ):
+        with self._lock:
+            if self._db is not None:
+                self.flush()
+                self._db.close()
+                self._db = None
+
+    def addSample( self, inputArg, selectedFile, hitsFile=None, typingFile=None, timings=(),
+                         referenceVersion=None, referenceDate=None, preset=None ):
+        """
+        Queue the results of one typed input, read from its output files,
+        writing the queue out once it holds a full batch
+        """
+        sample = {'input': op.abspath( inputArg ),
+                  'sample': _sampleName( inputArg ),
+                  'referenceVersion': referenceVersion,
+                  'referenceDate': referenceDate,
+                  'preset': preset,
+                  'typedAt': time.time(),
+                  'sequences': _sequenceRows( selectedFile ),
+                  'hits': _hitRows( hitsFile ),
+                  'calls': _callRows( typingFile ),
+                  'stages': [(stage, wallTime, int(skipped)) for stage, wallTime, skipped in timings]}
+        with self._lock:
+            self._pending.append( sample )
+            if len(self._pending) >= self._batchSize:
+                self.flush()
+
+    def flush( self ):
+        """Write every queued sample in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            with self._db:
+                for sample in self._pending:
+                    self._writeSample( sample )
+            log.info('Stored results of {0} sample(s) in "{1}"'.format(len(self._pending), op.basename( self._filename )))
+            self._pending = []
+
+    def _writeSample( self, sample ):
+        previous = self._db.execute( "SELECT id FROM samples WHERE input = ?", (sample['input'],) ).fetchone()
+        if previous is not None:
+            for table in _CHILD_TABLES:
+                self._db.execute( "DELETE FROM {0} WHERE sampleId = ?".format(table), (previous['id'],) )
+            self._db.execute( "DELETE FROM samples WHERE id = ?", (previous['id'],) )
+        cursor = self._db.execute( "INSERT INTO samples (input, sample, referenceVersion, referenceDate, preset, typedAt) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)",
+                                   (sample['input'], sample['sample'], sample['referenceVersion'],
+                                    sample['referenceDate'], sample['preset'], sample['typedAt']) )
+        sampleId = cursor.lastrowid
+        self._db.executemany( "INSERT INTO sequences VALUES (?, ?, ?, ?, ?)",
+                              [(sampleId,) + row for row in sample['sequences']] )
+        self._db.executemany( "INSERT INTO hits VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              [(sampleId,) + row for row in sample['hits']] )
+        self._db.executemany( "INSERT INTO hitAlleles VALUES (?, ?, ?, ?)",
+                              [(sampleId, row[0]) + allele for row in sample['hits'] for allele in _hitAlleles( row[-1] )] )
+        self._db.executemany( "INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              [(sampleId,) + row for row in sample['calls']] )
+        self._db.executemany( "INSERT INTO stages VALUES (?, ?, ?, ?)",
+                              [(sampleId,) + row for row in sample['stages']] )
+
+    ## Queries
+
+    def _query( self, table, columns, sample=None, locus=None, allele=None, extra=(), extraParams=() ):
+        clauses, params = list(extra), list(extraParams)
+        if sample is not None:
+            clauses.append( "s.sample = ?" )
+            params.append( sample )
+        if locus is not None:
+            clauses.append( "t.locus = ?" )
+            params.append( locus )
+        if allele is not None:
+            clause, values = _alleleFilter( "t.allele", allele )
+            clauses.append( clause )
+            params += values
+        sql = "SELECT s.sample, s.input, {0} FROM {1} t JOIN samples s ON s.id = t.sampleId".format(columns, table)
+        if clauses:
+            sql += " WHERE " + " AND ".join( clauses )
+        with self._lock:
+            self.flush()
+            return self._db.execute( sql + " ORDER BY s.sample, t.rowid", params ).fetchall()
+
+    def samples( self, sample=None ):
+        with self._lock:
+            self.flush()
+            if sample is None:
+                return self._db.execute( "SELECT * FROM samples ORDER BY sample" ).fetchall()
+            return self._db.execute( "SELECT * FROM samples WHERE sample = ?", (sample,) ).fetchall()
+
+    def sequences( self, sample=None ):
+        return self._query( "sequences", "t.name, t.length, t.numReads, t.accuracy", sample=sample )
+
+    def hits( self, sample=None, locus=None, allele=None ):
+        """
+        Best reference hits, filtered by sample, locus and allele or allele
+        prefix, matching any of the identical alleles a hit stands for
+        """
+        extra, params = [], []
+        if allele is not None:
+            clause, params = _alleleFilter( "a.allele", allele )
+            extra.append( "t.rowid IN (SELECT h.rowid FROM hitAlleles a JOIN hits h ON h.sampleId = a.sampleId "
+                          "AND h.qname = a.qname WHERE {0})".format(clause) )
+        return self._query( "hits", "t.qname, t.tname, t.locus, t.allele, t.nmis, t.alleles",
+                            sample=sample, locus=locus, extra=extra, extraParams=params )
+
+    def calls( self, sample=None, locus=None, allele=None, top=None ):
+        """MSA allele calls, optionally only those ranked `top` or better"""
+        extra = ["t.rank <= {0:d}".format(top)] if top is not None else []
+        return self._query( "calls", "t.qname, t.locus, t.rank, t.allele, t.mismatches, t.compared",
+                            sample=sample, locus=locus, allele=allele, extra=extra )
+
+    def alleleCounts( self, locus=None ):
+        """The number of samples with a best hit to each allele, or one identical to it"""
+        sql = "SELECT locus, allele, COUNT(DISTINCT sampleId) AS samples FROM hitAlleles"
+        params = []
+        if locus is not None:
+            sql += " WHERE locus = ?"
+            params.append( locus )
+        with self._lock:
+            self.flush()
+            return self._db.execute( sql + " GROUP BY locus, allele ORDER BY locus, samples DESC", params ).fetchall()
+
+    def stageTimings( self ):
+        """The mean and maximum wall time of every stage that actually ran"""
+        with self._lock:
+            self.flush()
+            return self._db.execute( "SELECT stage, COUNT(*) AS runs, AVG(wallTime) AS meanTime, "
+                                     "MAX(wallTime) AS maxTime FROM stages WHERE skipped = 0 "
+                                     "GROUP BY stage ORDER BY stage" ).fetchall()
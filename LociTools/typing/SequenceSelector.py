@@ -1,13 +1,16 @@
 #! /usr/bin/env python
 
+import shutil
 import logging
+import tempfile
+import os.path as op
 from operator import itemgetter
-from collections import defaultdict
-
-from pbcore.io.FastqIO import FastqWriter
+from collections import defaultdict, namedtuple
 
 from LociTools import utils
-from LociTools.io import BlasrReader
+from LociTools.utils import instrumentation
+from LociTools.utils.spill import externalGroupBy
+from LociTools.io import openBlasrFile
 
 log = logging.getLogger(__name__)
 
@@ -15,22 +18,30 @@ VALID_METHODS = ['barcode', 'locus', 'both', 'all']
 VALID_SORTS   = ['reads', 'accuracy', 'best', 'none']
 VALID_LOCI    = ['A', 'B', 'C', 'DPA1', 'DPB1', 'DQA1', 'DQB1', 'DRB1', 'DQB1']
 
-DEFAULT_NPROC = 8
 DEFAULT_LOCI = ['A', 'B', 'C', 'DPA1', 'DPB1', 'DQA1', 'DQB1', 'DRB1', 'DQB1']
 DEFAULT_METHOD = 'locus'
 DEFAULT_SORT = 'accuracy'
 DEFAULT_MIN_FRAC = 0.15
+ALIGN_COLUMNS = ('qname', 'tname', 'nmis')
+
+# The fields of an alignment that grouping, sorting and selection use, as
+#  spilled to disk and read back by the out-of-core grouping
+_Alignment = namedtuple('_Alignment', ALIGN_COLUMNS)
 
 class SequenceSelector( object ):
 
     def __init__(self, method=DEFAULT_METHOD,
                        sort=DEFAULT_SORT,
                        loci=DEFAULT_LOCI,
-                       minFraction=DEFAULT_MIN_FRAC):
+                       minFraction=DEFAULT_MIN_FRAC,
+                       alleleIndex=None,
+                       maxMemory=None):
         self.method = method
         self.sort = sort
         self.loci = loci
         self.minFraction = minFraction
+        self.alleleIndex = alleleIndex
+        self.maxMemory = maxMemory
 
     @property
     def method(self):
@@ -89,13 +100,40 @@ class SequenceSelector( object ):
             log.error( msg )
             raise ValueError( msg )
 
+    @property
+    def maxMemory(self):
+        return self._maxMemory
+
+    @maxMemory.setter
+    def maxMemory(self, arg):
+        if arg is None or (isinstance(arg, (int, long)) and arg > 0):
+            self._maxMemory = arg
+        else:
+            msg = "Invalid maxMemory: must be a positive number of bytes or None, but got '{0}'".format(arg)
+            log.error( msg )
+            raise ValueError( msg )
+
+    def _locusFunction( self ):
+        if self.alleleIndex is not None:
+            return self.alleleIndex.lociByName.__getitem__
+        return lambda tname: tname.split('*')[0].split('_')[-1]
+
+    @staticmethod
+    def _barcodeOf( qname ):
+        if qname.startswith('Barcode'):
+            qname = qname[7:]
+        if qname.startswith('_'):
+            qname = qname[1:]
+        return qname.split('_Cluster')[0]
+
     def _groupAlignmentsByLocus( self, alignments ):
         """Group sequences by the locus of their best alignment"""
         groups = defaultdict(list)
+        locusOf = self._locusFunction()
+        loci = set(self.loci)
         for record in alignments:
-            reference = record.tname.split('*')[0]
-            locus = reference.split('_')[-1]
-            if locus not in self.loci:
+            locus = locusOf( record.tname )
+            if locus not in loci:
                 continue
             groups[locus].append( record )
         return groups
@@ -104,13 +142,7 @@ class SequenceSelector( object ):
         """Group sequences by their barcode"""
         groups = defaultdict(list)
         for alignment in alignments:
-            name = alignment.qname
-            if name.startswith('Barcode'):
-                name = name[7:]
-            if name.startswith('_'):
-                name = name[1:]
-            barcode = name.split('_Cluster')[0]
-            groups[barcode].append( alignment )
+            groups[self._barcodeOf( alignment.qname )].append( alignment )
         return groups
 
     def _groupAlignmentsByBoth( self, alignments ):
@@ -118,7 +150,7 @@ class SequenceSelector( object ):
         groups = {}
         bcGroups = self._groupAlignmentsByBarcode( alignments )
         for barcode, bcAligns in bcGroups.iteritems():
-            locusGroups = self._groupAlignmentsByLocus( bcAligns, loci )
+            locusGroups = self._groupAlignmentsByLocus( bcAligns )
             for locus, locusAligns in locusGroups.iteritems():
                 groupName = '%s_%s' % (barcode, locus)
                 groups[groupName] = locusAligns
@@ -146,53 +178,139 @@ class SequenceSelector( object ):
             log.error( msg )
             raise ValueError( msg )
 
-    def _sortGroups( self, sequences, groups ):
-        """Order each group of records individually"""
-        log.debug('Sorting sequences with method "%s"' % self.sort)
-        # Generate a dictionary of sorting
+    def _groupKeyFunction( self ):
+        """
+        Return the function giving each alignment's group under the
+        user-specified method, or None for one no group takes, matching
+        the keys of the in-memory grouping
+        """
+        locusOf = self._locusFunction()
+        loci = set(self.loci)
+        def locusKey( alignment ):
+            locus = locusOf( alignment.tname )
+            return locus if locus in loci else None
+        if self.method == 'locus':
+            return locusKey
+        elif self.method == 'barcode':
+            return lambda a: self._barcodeOf( a.qname )
+        elif self.method == 'both':
+            def bothKey( alignment ):
+                locus = locusKey( alignment )
+                if locus is None:
+                    return None
+                return '%s_%s' % (self._barcodeOf( alignment.qname ), locus)
+            return bothKey
+        elif self.method == 'all':
+            return lambda a: a.qname
+        else:
+            msg = "Invalid Selection Metric: %s" % self.method
+            log.error( msg )
+            raise ValueError( msg )
+
+    def _spilledGroups( self, alignments, tempDir ):
+        """
+        Group alignments out of core: tag each with its group and file
+        position, external-sort them on disk within the memory budget, and
+        yield one group at a time with its alignments in file order
+        """
+        log.debug('Grouping sequences with method "%s" within %s bytes' % (self.method, self.maxMemory))
+        groupKey = self._groupKeyFunction()
+        def tagged():
+            for position, record in enumerate( alignments ):
+                key = groupKey( record )
+                if key is not None:
+                    yield (key, position, record.qname, record.tname, record.nmis)
+        for key, items in externalGroupBy( tagged(), self.maxMemory, tempDir ):
+            group = [_Alignment( *item[2:] ) for item in items]
+            # Mirror the in-memory grouping, where a later alignment of a
+            #  sequence replaces an earlier one
+            if self.method == 'all':
+                group = group[-1:]
+            yield key, group
+
+    def _sortingData( self, sequences ):
+        """
+        Generate the value of every sequence to order its group by, keyed by
+        its id - the BLASR qname - since reversed records are renamed
+        """
         if self.sort == 'reads':
-            data = {s.name: utils.recordSupport(s) for s in sequences}
+            data = {s.id: utils.recordSupport(s) for s in sequences}
         elif self.sort == 'accuracy':
-            data = {s.name: utils.recordAccuracy(s) for s in sequences}
+            data = dict( zip( (s.id for s in sequences), sequences.accuracies() ))
         elif self.sort == 'none':
-            data = {s.name: 1 for s in sequences}
+            data = {s.id: 1 for s in sequences}
         elif self.sort == 'best':
             data = None
         else:
             msg = "Invalid Sorting Metric: %s" % sort
             log.error( msg )
             raise ValueError( msg )
+        return data
 
+    def _sortGroups( self, sequences, groups ):
+        """Order each group of records individually"""
+        log.debug('Sorting sequences with method "%s"' % self.sort)
+        data = self._sortingData( sequences )
         ordered = {}
         for groupName, group in groups.iteritems():
             sortedRecords = sorted( group, key=lambda x: data[x.qname], reverse=True )
             ordered[groupName] = sortedRecords
         return ordered
 
+    def _selectFromGroup( self, group ):
+        """Select the top 1-2 sequences of one sorted group"""
+
+        # Take the first sequence from each group
+        first, rest = group[0], group[1:]
+        selectedIds = [first.qname]
+        firstReads = utils.getNumReads( first.qname )
+
+        # Take the second sequence with a different reference
+        for record in rest:
+            numReads = utils.getNumReads( record.qname )
+            if record.tname == first.tname and record.nmis == first.nmis:
+                firstReads += utils.getNumReads( record.qname )
+            elif numReads > (firstReads * self.minFraction):
+                selectedIds.append( record.qname )
+                break
+        return selectedIds
+
     def _selectSequences( self, sequences, groups ):
         """Select the top 1-2 sequences for each Locus"""
-
         selectedIds = []
         for group in groups.itervalues():
+            selectedIds += self._selectFromGroup( group )
+        return self._selected( sequences, selectedIds )
 
-            # Take the first sequence from each group
-            first, rest = group[0], group[1:]
-            selectedIds.append( first.qname )
-            firstReads = utils.getNumReads( first.qname )
-
-            # Take the second sequence with a different reference
-            for record in rest:
-                numReads = utils.getNumReads( record.qname )
-                if record.tname == first.tname and record.nmis == first.nmis:
-                    firstReads += utils.getNumReads( record.qname )
-                elif numReads > (firstReads * self.minFraction):
-                    selectedIds.append( record.qname )
-                    break
-
-        selected = [s for s in sequences if s.id in selectedIds]
+    def _selected( self, sequences, selectedIds ):
+        selected = sequences.select( selectedIds )
         log.info('Selected %s sequences from %s total for further analysis' % (len(selected), len(sequences)))
         return selected
 
+    def _selectOutOfCore( self, sequences, alignFile, outputFile ):
+        """
+        Group, sort and select one group at a time, spilling the grouped
+        alignments beside the output file, so memory is bounded by the
+        budget and the largest group rather than every alignment
+        """
+        data = self._sortingData( sequences )
+        nAlignments = [0]
+        def counted( alignments ):
+            for alignment in alignments:
+                nAlignments[0] += 1
+                yield alignment
+
+        tempDir = tempfile.mkdtemp( prefix="spill_", dir=op.dirname( op.abspath( outputFile )))
+        try:
+            alignments = counted( openBlasrFile( alignFile, columns=ALIGN_COLUMNS ))
+            selectedIds = []
+            for _, group in self._spilledGroups( alignments, tempDir ):
+                group.sort( key=lambda x: data[x.qname], reverse=True )
+                selectedIds += self._selectFromGroup( group )
+        finally:
+            shutil.rmtree( tempDir, ignore_errors=True )
+        return self._selected( sequences, selectedIds ), nAlignments[0]
+
     def __call__(self, inputFile, outputFile=None, alignFile=None):
         """Pick the consensus seqs per group from a sequence file"""
 
@@ -204,10 +322,17 @@ class SequenceSelector( object ):
         outputType = utils.getFileType( outputFile )
 
         # Group, sort, and select the sequences to be analyzed
-        alignments = list( BlasrReader( alignFile ))
-        groups = self._groupAlignments( alignments )
-        sortedGroups = self._sortGroups( sequences, groups )
-        selected = self._selectSequences( sequences, sortedGroups )
+        if self.maxMemory is None:
+            alignments = list( openBlasrFile( alignFile, columns=ALIGN_COLUMNS ))
+            groups = self._groupAlignments( alignments )
+            sortedGroups = self._sortGroups( sequences, groups )
+            selected = self._selectSequences( sequences, sortedGroups )
+            nAlignments = len(alignments)
+        else:
+            selected, nAlignments = self._selectOutOfCore( sequences, alignFile, outputFile )
+        instrumentation.addCount( "alignments", records=nAlignments )
+        instrumentation.addCount( "sequences", records=len(sequences) )
+        instrumentation.addCount( "selectedSequences", records=len(selected) )
 
         # Write the selected sequences out to file and return
         utils.writeSequenceRecords( outputFile, selected, outputType )
@@ -0,0 +1,331 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import os.path as op
+from collections import OrderedDict
+
+from LociTools import utils
+from LociTools.io import openBlasrFile
+from LociTools.io.BlasrIO import BlasrWriter
+from LociTools.typing.SequenceSelector import SequenceSelector
+from LociTools.utils.resources import detectResources
+from LociTools.utils.spill import externalSort
+
+log = logging.getLogger(__name__)
+
+SHARD_VERSION = 1
+PLATE_MANIFEST = "scatter.json"
+ORDER_FILE = "order.txt"
+SUMMARY_FILE = "gather.json"
+STAGES = ("align", "orient", "select", "hits")
+
+# A scatter writes, into a shard directory on a shared filesystem:
+#   scatter.json       the plate: source input, mode, pinned references,
+#                      reference version and date, preset, selection
+#                      settings and shards
+#   order.txt          the source record names, in their original order
+#   shard_NNN.json     one manifest per shard, with the same pinned values
+#   shard_NNN/         the shard's input, and later its stage outputs
+# Each shard runs anywhere the directory is mounted, and a gather merges
+#  the shards' stage outputs back in source order.  Selection groups may
+#  span shards, so the gather selects again from the merged alignments,
+#  and types any sequence it selects that no shard did.
+
+
+class ShardError(Exception):
+    pass
+
+
+## Private utilities
+
+def _recordId( name ):
+    return name.split()[0]
+
+def _sampleOf( name ):
+    """Return the sample (barcode) a consensus sequence belongs to"""
+    return _recordId( name ).split('_Cluster')[0]
+
+def _writeJson( filename, data ):
+    """Atomically write a JSON document"""
+    tempFile = filename + ".tmp"
+    with open( tempFile, 'w' ) as handle:
+        json.dump( data, handle, indent=2, sort_keys=True )
+    os.rename( tempFile, filename )
+
+def _readJson( filename ):
+    try:
+        with open( filename ) as handle:
+            data = json.load( handle )
+    except (IOError, ValueError) as e:
+        raise ShardError('Could not read shard manifest "{0}": {1}'.format(filename, e))
+    if data.get('version') != SHARD_VERSION:
+        raise ShardError('Shard manifest "{0}" has an unsupported version'.format(filename))
+    return data
+
+def _partitionBySample( records, nShards ):
+    """
+    Assign whole samples to shards, largest first onto the least-loaded
+    shard, so every shard's sequence groups are complete
+    """
+    samples = OrderedDict()
+    for record in records:
+        samples.setdefault( _sampleOf( record.name ), [] ).append( record )
+    loads = [0] * nShards
+    shards = [[] for _ in range(nShards)]
+    for sample in sorted( samples, key=lambda s: (-len(samples[s]), s) ):
+        index = loads.index( min(loads) )
+        shards[index].append( sample )
+        loads[index] += len(samples[sample])
+    return [(sorted(names), [r for name in sorted(names) for r in samples[name]])
+            for names in shards if names]
+
+def _partitionByChunk( records, nShards ):
+    """Split the records into contiguous, near-equal chunks"""
+    size, extra = divmod( len(records), nShards )
+    chunks, start = [], 0
+    for i in range(nShards):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            chunk = records[start:end]
+            chunks.append( (sorted(set(_sampleOf( r.name ) for r in chunk)), chunk) )
+        start = end
+    return chunks
+
+def _keyedSize( item ):
+    """Estimate the memory held by a (position, shard, index, alignment) tuple"""
+    alignment = item[-1]
+    return sys.getsizeof( item ) + sys.getsizeof( alignment ) + sum( sys.getsizeof( v ) for v in alignment )
+
+def _alignmentsInSourceOrder( alignFiles, position, maxMemory=None, tempDir=None ):
+    """
+    Merge the alignments of every shard into source order, ties kept in
+    shard and file order, sorting out of core beyond maxMemory bytes
+    """
+    keyed = ((position( a.qname ), shard, i, a)
+             for shard, alignFile in enumerate( alignFiles )
+             for i, a in enumerate( openBlasrFile( alignFile )))
+    if maxMemory is None:
+        keyed = iter( sorted( keyed ))
+    else:
+        keyed = externalSort( keyed, maxMemory, tempDir, sizeOf=_keyedSize )
+    return (item[-1] for item in keyed)
+
+def _readTable( filepath ):
+    """Return the header line and the row lines of a tab-delimited table"""
+    with open( filepath ) as handle:
+        header = handle.readline()
+        return header, [line for line in handle if line.strip()]
+
+def _mergeTables( tables, outputFile, position, keep ):
+    """
+    Merge per-query tables, e.g. hits or MSA calls, into source order,
+    keeping only the rows of the query IDs in `keep`
+    """
+    header, rows = None, []
+    for table in tables:
+        tableHeader, lines = _readTable( table )
+        header = header or tableHeader
+        for line in lines:
+            qname = line.split('\t', 1)[0]
+            if qname in keep:
+                rows.append( (position( qname ), len(rows), line) )
+    rows.sort()
+    with open( outputFile, 'w' ) as handle:
+        handle.write( header )
+        for _, _, line in rows:
+            handle.write( line )
+    return outputFile
+
+def _gatherTable( shardTables, outputFile, position, selected, missingFile, typeMissing ):
+    """
+    Merge the shards' tables for the selected sequences, first typing any
+    selected sequence that no shard selected, and so reported on, itself
+    """
+    tables = list( shardTables )
+    if missingFile is not None:
+        tables.append( typeMissing( missingFile, op.join( op.dirname( missingFile ), op.basename( outputFile ))))
+    return _mergeTables( tables, outputFile, position, selected )
+
+
+## Public functions
+
+def scatterInput( typer, inputArg, shardDir, nShards=None ):
+    """
+    Split a typing input into at most `nShards` independent shards, whole
+    samples at a time when there are enough samples and in contiguous query
+    chunks otherwise, and return the shard manifest files.  By default the
+    number of shards follows the CPUs available here.
+    """
+    nShards = nShards or detectResources().shards
+    inputFile = typer.resolveInput( inputArg )
+    fileType = utils.getFileType( inputFile )
+    records = utils.readSequenceRecords( inputFile )
+    if not records:
+        raise ShardError('No sequences to scatter in "{0}"'.format(inputFile))
+    nShards = max(1, min(nShards, len(records)))
+    nSamples = len(set(_sampleOf( r.name ) for r in records))
+    mode = 'sample' if nSamples >= nShards else 'chunk'
+    partition = _partitionBySample if mode == 'sample' else _partitionByChunk
+
+    shardDir = op.abspath( shardDir )
+    if not op.isdir( shardDir ):
+        os.makedirs( shardDir )
+    with open( op.join( shardDir, ORDER_FILE ), 'w' ) as handle:
+        for record in records:
+            handle.write( _recordId( record.name ) + '\n' )
+
+    pinned = {'version': SHARD_VERSION,
+              'source': inputFile,
+              'fileType': fileType,
+              'mode': mode,
+              'referenceVersion': typer.version,
+              'referenceDate': typer.date,
+              'preset': typer.preset,
+              'references': {'genomic': op.abspath( typer.genomicRef ),
+                             'cDNA': op.abspath( typer.cDnaRef ),
+                             'exon': op.abspath( typer.exonRef )},
+              'selector': typer.selectorParams()}
+
+    manifests = []
+    for index, (samples, shardRecords) in enumerate( partition( records, nShards )):
+        name = "shard_{0:03d}".format(index)
+        if not op.isdir( op.join( shardDir, name )):
+            os.makedirs( op.join( shardDir, name ))
+        shardInput = op.join( shardDir, name, "input." + fileType )
+        utils.writeSequenceRecords( shardInput, shardRecords, fileType )
+        shard = dict( pinned, index=index, input=shardInput, samples=samples,
+                      records=len(shardRecords), stages=typer.stageManifest( shardInput ))
+        manifestFile = op.join( shardDir, name + ".json" )
+        _writeJson( manifestFile, shard )
+        manifests.append( op.basename( manifestFile ))
+
+    _writeJson( op.join( shardDir, PLATE_MANIFEST ), dict( pinned, shards=manifests ))
+    log.info('Scattered {0} sequences into {1} shard(s) by {2} in "{3}"'.format(len(records), len(manifests), mode, shardDir))
+    return [op.join( shardDir, m ) for m in manifests]
+
+def runShard( manifestFile, blasrExe=None, resume=True, scratchDir=None, selectMemory=None ):
+    """
+    Type one shard with its pinned references and settings, refusing to
+    run against a different reference version
+    """
+    from LociTools.typing.LociTyper import LociTyper
+    shard = _readJson( manifestFile )
+    refs = shard['references']
+    typer = LociTyper( "all", blasrExe=blasrExe, genomicRef=refs['genomic'],
+                       cDnaRef=refs['cDNA'], exonRef=refs['exon'], resume=resume,
+                       scratchDir=scratchDir, selectMemory=selectMemory )
+    if typer.version != shard['referenceVersion']:
+        raise ShardError('Shard "{0}" was scattered with references version {1}, but {2} is installed'.format(
+                         manifestFile, shard['referenceVersion'], typer.version))
+    for key, value in shard['selector'].iteritems():
+        setattr( typer._selector, key, value )
+    log.info('Running shard {0} ({1} sequences)'.format(shard['index'], shard['records']))
+    return typer( shard['input'] )
+
+def gatherShards( shardDir, selectMemory=None, store=None ):
+    """
+    Merge the alignments and oriented sequences of every finished shard in
+    source order, then select from the merged results and report their
+    hits and MSA calls exactly as a single run would have.  The alignments
+    are merged within `selectMemory` bytes when given, and the gathered
+    results recorded under the source input in the ResultsStore `store`
+    when given.  Returns the gathered output files.
+    """
+    start = time.time()
+    shardDir = op.abspath( shardDir )
+    plate = _readJson( op.join( shardDir, PLATE_MANIFEST ))
+    shards = [_readJson( op.join( shardDir, m )) for m in plate['shards']]
+
+    results, unfinished = [], []
+    for shard in shards:
+        stages = {}
+        if utils.isValidFile( shard['stages'] ):
+            with open( shard['stages'] ) as handle:
+                stages = json.load( handle ).get('stages', {})
+        done = all( s in stages and stages[s].get('referenceVersion') == plate['referenceVersion']
+                    for s in STAGES )
+        if not done:
+            unfinished.append( shard['index'] )
+        else:
+            results.append( (shard, stages) )
+    if unfinished:
+        raise ShardError('Shard(s) {0} have not finished'.format(', '.join(str(i) for i in unfinished)))
+
+    with open( op.join( shardDir, ORDER_FILE )) as handle:
+        order = {name.strip(): i for i, name in enumerate( handle )}
+    position = lambda name: order.get( _recordId( name ), len(order) )
+
+    basename = '.'.join( op.basename( utils.stripCompressedSuffix( plate['source'] )).split('.')[:-1] )
+    fileType = plate['fileType']
+    alignFile    = op.join( shardDir, "{0}.genomic.m5".format(basename) )
+    orientedFile = op.join( shardDir, "{0}.oriented.{1}".format(basename, fileType) )
+    selectedFile = op.join( shardDir, "{0}.oriented.selected.{1}".format(basename, fileType) )
+
+    with BlasrWriter( alignFile ) as writer:
+        writer.write( _alignmentsInSourceOrder( [stages['align']['result'] for _, stages in results],
+                                                position, selectMemory, shardDir ))
+
+    oriented = [r for _, stages in results for r in utils.readSequenceRecords( stages['orient']['result'] )]
+    oriented.sort( key=lambda r: position( r.name ))
+    utils.writeSequenceRecords( orientedFile, oriented, fileType )
+
+    selector = SequenceSelector( maxMemory=selectMemory, **plate['selector'] )
+    selector( orientedFile, selectedFile, alignFile=alignFile )
+    outputs = {'alignment': alignFile,
+               'oriented': orientedFile,
+               'selected': selectedFile}
+
+    # The selected sequences that no shard selected have no rows in any
+    #  shard's tables yet, so are typed here against the merged alignments
+    selectedRecords = utils.readSequenceRecords( selectedFile )
+    selected = set( r.id for r in selectedRecords )
+    covered = set( r.id for _, stages in results
+                        for r in utils.readSequenceRecords( stages['select']['result'] ))
+    missing = [r for r in selectedRecords if r.id not in covered]
+    tempDir = tempfile.mkdtemp( prefix="gather_", dir=shardDir )
+    try:
+        missingFile = None
+        if missing:
+            log.info('Typing {0} selected sequence(s) no shard selected'.format(len(missing)))
+            missingFile = utils.writeSequenceRecords( op.join( tempDir, "missing." + fileType ), missing, fileType )
+
+        from LociTools import references
+        from LociTools.utils.aliases import expandHits
+        aliasFile = references.genomicAliases()
+        outputs['hits'] = _gatherTable( [stages['hits']['result'] for _, stages in results],
+                                        op.join( shardDir, "{0}.hits.txt".format(basename) ),
+                                        position, selected, missingFile,
+                                        lambda queries, output: expandHits( alignFile, aliasFile, output, queryFile=queries ))
+        if all( 'msa' in stages for _, stages in results ):
+            from LociTools.typing.MsaTyper import MsaTyper
+            msaTyper = MsaTyper( references.msaReferences(), top=results[0][1]['msa']['params']['top'] )
+            outputs['typing'] = _gatherTable( [stages['msa']['result'] for _, stages in results],
+                                              op.join( shardDir, "{0}.typing.txt".format(basename) ),
+                                              position, selected, missingFile,
+                                              lambda queries, output: msaTyper( alignFile, output, queryFile=queries ))
+    finally:
+        shutil.rmtree( tempDir, ignore_errors=True )
+
+    summary = {'version': SHARD_VERSION,
+               'source': plate['source'],
+               'mode': plate['mode'],
+               'referenceVersion': plate['referenceVersion'],
+               'shards': [{'index': shard['index'],
+                           'samples': shard['samples'],
+                           'records': shard['records'],
+                           'selected': stages['select']['result']} for shard, stages in results],
+               'outputs': outputs}
+    _writeJson( op.join( shardDir, SUMMARY_FILE ), summary )
+    if store is not None:
+        store.addSample( plate['source'], selectedFile, outputs['hits'], outputs.get('typing'),
+                           timings=[("gather", time.time() - start, False)],
+                           referenceVersion=plate['referenceVersion'], referenceDate=plate.get('referenceDate'),
+                           preset=plate.get('preset') )
+    log.info('Gathered {0} shard(s) into "{1}"'.format(len(results), selectedFile))
+    return summary['outputs']
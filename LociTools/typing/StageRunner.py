@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+
+import os
+import json
+import time
+import hashlib
+import logging
+import os.path as op
+
+from LociTools import utils
+
+log = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class StageManifestError(Exception):
+    pass
+
+
+class StageRunner( object ):
+    """
+    Run the named stages of a pipeline, recording the content hashes of
+    each stage's inputs and outputs, its parameters and the reference
+    version in a sidecar JSON manifest.  A stage is only skipped when all
+    of these still match, so a re-run resumes from the first invalidated
+    stage.
+    """
+
+    def __init__( self, manifestFile, referenceVersion, resume=True ):
+        self._manifestFile = op.abspath( manifestFile )
+        self._refVersion   = referenceVersion
+        self._resume       = resume
+        self._hashes       = {}
+        self._timings      = []
+        self._stages       = self._readManifest()
+
+    @property
+    def manifestFile(self):
+        return self._manifestFile
+
+    @property
+    def timings(self):
+        """The (stage, wall time, skipped) of every stage run so far"""
+        return list(self._timings)
+
+    def _readManifest( self ):
+        if not self._resume or not utils.isValidFile( self._manifestFile ):
+            return {}
+        try:
+            with open( self._manifestFile ) as handle:
+                data = json.load( handle )
+        except ValueError:
+            log.warn('Ignoring unreadable stage manifest "{0}"'.format( self._manifestFile ))
+            return {}
+        if data.get('version') != MANIFEST_VERSION:
+            return {}
+        return data.get('stages', {})
+
+    def _writeManifest( self ):
+        """Atomically replace the manifest with the current stage records"""
+        tempFile = self._manifestFile + ".tmp"
+        try:
+            with open( tempFile, 'w' ) as handle:
+                json.dump({'version': MANIFEST_VERSION, 'stages': self._stages},
+                          handle, indent=2, sort_keys=True)
+            os.rename( tempFile, self._manifestFile )
+        except (IOError, OSError):
+            msg = 'Unable to write stage manifest "{0}"'.format( self._manifestFile )
+            log.error( msg )
+            raise StageManifestError( msg )
+
+    def _fileHash( self, filepath ):
+        """Return the SHA-1 of a file's contents, cached by size and mtime"""
+        filepath = op.abspath( filepath )
+        stat = os.stat( filepath )
+        key = (filepath, stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            digest = hashlib.sha1()
+            with open( filepath, 'rb' ) as handle:
+                for block in iter(lambda: handle.read( HASH_BLOCK_SIZE ), ''):
+                    digest.update( block )
+            self._hashes[key] = digest.hexdigest()
+        return self._hashes[key]
+
+    def _fileHashes( self, filepaths ):
+        return {op.abspath(f): self._fileHash( f ) for f in filepaths}
+
+    def _isCurrent( self, name, inputs, params ):
+        """Check whether a recorded stage still matches its inputs and outputs"""
+        record = self._stages.get( name )
+        if record is None:
+            return False
+        if record['referenceVersion'] != self._refVersion or record['params'] != params:
+            return False
+        if record['inputs'] != self._fileHashes( inputs ):
+            return False
+        for output, outputHash in record['outputs'].iteritems():
+            if not utils.isValidFile( output ) or self._fileHash( output ) != outputHash:
+                return False
+        return True
+
+    def run( self, name, inputs, params, func, *args, **kwargs ):
+        """
+        Run func(*args, **kwargs) as the named stage, unless an identical
+        run is already recorded, and return its output file(s)
+        """
+        # Round-trip the parameters so they compare equal to the manifest's
+        params = json.loads( json.dumps( params or {}, sort_keys=True ))
+        start = time.time()
+        if self._isCurrent( name, inputs, params ):
+            log.info('Inputs to stage "{0}" are unchanged, skipping'.format( name ))
+            self._timings.append( (name, time.time() - start, True) )
+            return self._stages[name]['result']
+
+        # Drop the old record first, so an interrupted stage is never trusted
+        if name in self._stages:
+            del self._stages[name]
+            self._writeManifest()
+
+        result = func( *args, **kwargs )
+        if isinstance(result, basestring):
+            result = op.abspath( result )
+            outputs = [result]
+        else:
+            result = [op.abspath(r) for r in result]
+            outputs = result
+        self._stages[name] = {'referenceVersion': self._refVersion,
+                              'params': params,
+                              'inputs': self._fileHashes( inputs ),
+                              'outputs': self._fileHashes( outputs ),
+                              'result': result}
+        self._writeManifest()
+        self._timings.append( (name, time.time() - start, False) )
+        return result
@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+import logging
+import threading
+from Queue import Queue
+
+log = logging.getLogger(__name__)
+
+STAGES = ("prepare", "align", "finish")
+DEFAULT_QUEUE_SIZE = 2
+
+# Each stage has its own worker threads, joined to the next stage by a
+#  bounded queue, so while one sample aligns the next is being validated
+#  and the previous one oriented, selected and written.  A full queue blocks
+#  the stage feeding it, which bounds how many samples are in flight.
+
+_DONE = object()
+
+
+class PipelineError(Exception):
+    pass
+
+
+## Private utilities
+
+def _parseWorkers( workers ):
+    """Fill in one worker per stage for any stage not given"""
+    counts = dict.fromkeys( STAGES, 1 )
+    for stage, count in (workers or {}).iteritems():
+        if stage not in counts:
+            raise PipelineError('Unknown typing stage "{0}", expected one of {1}'.format(stage, ', '.join(STAGES)))
+        counts[stage] = max(1, int(count))
+    return counts
+
+
+class TypingPipeline( object ):
+    """
+    Type many samples with one LociTyper, overlapping the stages of
+    different samples: validation and parsing, BLASR alignment, and
+    orientation, selection and reporting.  Concurrent alignments share the
+    typer's BLASR threads rather than each taking all of them.
+    """
+
+    def __init__( self, typer, workers=None, queueSize=DEFAULT_QUEUE_SIZE, resume=None ):
+        self._typer     = typer
+        self._workers   = _parseWorkers( workers )
+        self._queueSize = max(1, queueSize)
+        self._resume    = resume
+        if self._workers['align'] > 1:
+            typer.blasrThreads = typer.blasrThreads // self._workers['align']
+
+    @property
+    def workers(self):
+        return dict(self._workers)
+
+    def _prepare( self, inputArg ):
+        return self._typer.prepare( inputArg, resume=self._resume )
+
+    def _align( self, run ):
+        try:
+            return self._typer.align( run )
+        except:
+            run.close()
+            raise
+
+    def _finish( self, run ):
+        try:
+            return self._typer.finish( run )
+        finally:
+            run.close()
+
+    def _work( self, stage, func, inbox, outbox, results, inputs ):
+        """Run one stage on every item in its queue until the end is signalled"""
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put( _DONE )   # Let this stage's other workers see it too
+                return
+            index, payload = item
+            try:
+                output = func( payload )
+            except Exception as e:
+                log.exception('Typing "{0}" failed in stage "{1}"'.format(inputs[index], stage))
+                results[index] = e
+                continue
+            if outbox is None:
+                results[index] = output
+            else:
+                outbox.put( (index, output) )
+
+    def __call__( self, inputs ):
+        """
+        Type every input, returning their selected sequence files in input
+        order.  A failed sample doesn't stop the others, but PipelineError
+        is raised once they have all finished.
+        """
+        inputs = list(inputs)
+        results = [None] * len(inputs)
+        funcs = {'prepare': self._prepare, 'align': self._align, 'finish': self._finish}
+        queues = [Queue( maxsize=self._queueSize ) for _ in STAGES]
+        threads = []
+        for i, stage in enumerate( STAGES ):
+            outbox = queues[i+1] if i + 1 < len(STAGES) else None
+            stageThreads = [threading.Thread( target=self._work, name="{0}-{1}".format(stage, n),
+                                              args=(stage, funcs[stage], queues[i], outbox, results, inputs) )
+                            for n in range(self._workers[stage])]
+            for thread in stageThreads:
+                thread.daemon = True
+                thread.start()
+            threads.append( stageThreads )
+        log.info('Typing {0} sample(s) with {1} worker(s) per stage'.format(len(inputs),
+                 ', '.join('{0} {1}'.format(self._workers[s], s) for s in STAGES)))
+
+        for index, inputArg in enumerate( inputs ):
+            queues[0].put( (index, inputArg) )
+        queues[0].put( _DONE )
+        # A stage is over once all of its workers are, and only then is the
+        #  end passed on, so no sample is still on its way to the next stage
+        for i, stageThreads in enumerate( threads ):
+            for thread in stageThreads:
+                thread.join()
+            if i + 1 < len(STAGES):
+                queues[i+1].put( _DONE )
+
+        failed = [inputs[i] for i, result in enumerate( results ) if isinstance( result, Exception )]
+        if failed:
+            raise PipelineError('Typing failed for {0} of {1} sample(s): {2}'.format(len(failed), len(inputs), ', '.join(failed)))
+        return results
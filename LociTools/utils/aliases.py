@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+
+import logging
+from collections import OrderedDict
+
+from LociTools.io.BlasrBinaryIO import openBlasrFile
+from LociTools import utils
+
+log = logging.getLogger(__name__)
+
+__all__ = ["collapseRecords", "writeAliasTable", "readAliasTable", "expandHits"]
+
+# An alias table has one "representative<TAB>allele" line per allele in the
+#  source reference, including the representative itself, so every allele
+#  whose sequence was collapsed can be recovered from the one kept.
+
+HITS_HEADER = ('qname', 'tname', 'nmis', 'alleles')
+
+
+def collapseRecords( records ):
+    """
+    Keep the first record of every distinct sequence, returning the kept
+    records and the names of the identical alleles each one stands for
+    """
+    representatives = OrderedDict()
+    aliases = OrderedDict()
+    for record in records:
+        seq = record.sequence.upper()
+        if seq not in representatives:
+            representatives[seq] = record
+            aliases[record.id] = []
+        aliases[representatives[seq].id].append( record.id )
+    log.info('Collapsed {0} reference sequences into {1} distinct sequences'.format(len(records), len(representatives)))
+    return representatives.values(), aliases
+
+def writeAliasTable( filepath, aliases ):
+    with open( filepath, 'w' ) as handle:
+        for representative, names in aliases.iteritems():
+            for name in names:
+                handle.write("{0}\t{1}\n".format(representative, name))
+    return filepath
+
+def readAliasTable( filepath ):
+    """Read an alias table into lists of alleles by representative"""
+    aliases = OrderedDict()
+    if filepath is None or not utils.isValidFile( filepath ):
+        return aliases
+    with open( filepath ) as handle:
+        for line in handle:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 2:
+                aliases.setdefault( parts[0], [] ).append( parts[1] )
+    return aliases
+
+def expandHits( alignFile, aliasFile, outputFile, queryFile=None ):
+    """
+    Report the best hit of every aligned query, or only those in
+    `queryFile`, with every allele identical to the representative hit
+    """
+    aliases = readAliasTable( aliasFile )
+    queries = None
+    if queryFile is not None:
+        queries = set(r.name.split()[0] for r in utils.readSequenceRecords( queryFile ))
+    with open( outputFile, 'w' ) as handle:
+        handle.write( '\t'.join( HITS_HEADER ) + '\n' )
+        for record in openBlasrFile( alignFile, columns=('qname', 'tname', 'nmis') ):
+            if queries is not None and record.qname not in queries:
+                continue
+            alleles = aliases.get( record.tname, [record.tname] )
+            handle.write( '\t'.join( [record.qname, record.tname, str(record.nmis), ','.join(alleles)] ) + '\n' )
+    return outputFile
@@ -0,0 +1,216 @@
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+from LociTools.utils import tracing
+
+log = logging.getLogger(__name__)
+
+__all__ = ["enable", "disable", "isEnabled", "stage", "addCount",
+           "recordProcess", "report", "writeReport"]
+
+## Private module state
+
+_lock   = threading.Lock()
+_local  = threading.local()
+_run    = None
+_active = []   # The stages running on every thread, as (thread, record)
+
+_PROC_STATUS     = "/proc/self/status"
+_PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+# Stages may run concurrently, e.g. in a TypingPipeline, so their CPU time
+#  is taken from the calling thread alone (RUSAGE_THREAD is 1 on Linux, but
+#  not exposed by Python 2).  Peak RSS is process-wide, so it is only reset
+#  and attributed to a stage while no other thread is running one.
+_RUSAGE_THREAD = getattr( resource, 'RUSAGE_THREAD', 1 if sys.platform.startswith('linux') else None )
+
+
+class _RunReport( object ):
+    """The stages, counters and subprocesses recorded over one run"""
+
+    def __init__( self ):
+        self.start     = time.time()
+        self.stages    = []
+        self.processes = []
+        self.counters  = {}
+
+    def toDict( self ):
+        usage = resource.getrusage( resource.RUSAGE_SELF )
+        children = resource.getrusage( resource.RUSAGE_CHILDREN )
+        return {'start': self.start,
+                'wallTime': time.time() - self.start,
+                'cpuTime': usage.ru_utime + usage.ru_stime,
+                'childCpuTime': children.ru_utime + children.ru_stime,
+                'peakRssKb': _peakRss(),
+                'counters': dict(self.counters),
+                'stages': list(self.stages),
+                'processes': list(self.processes)}
+
+
+## Private utilities
+
+def _peakRss():
+    """
+    Return the peak resident set size of this process in KB, preferring
+    the resettable high-water mark from /proc when it is available
+    """
+    try:
+        with open( _PROC_STATUS ) as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+def _resetPeakRss():
+    """Reset the kernel's RSS high-water mark, where permitted"""
+    try:
+        with open( _PROC_CLEAR_REFS, 'w' ) as handle:
+            handle.write("5")
+    except (IOError, OSError):
+        pass
+
+def _threadCpuTime():
+    """Return the CPU time of the calling thread, or None if unavailable"""
+    if _RUSAGE_THREAD is None:
+        return None
+    usage = resource.getrusage( _RUSAGE_THREAD )
+    return usage.ru_utime + usage.ru_stime
+
+def _stageStack():
+    if not hasattr( _local, 'stack' ):
+        _local.stack = []
+    return _local.stack
+
+def _addCounters( counters, records, nBytes ):
+    counters['records'] = counters.get('records', 0) + records
+    counters['bytes'] = counters.get('bytes', 0) + nBytes
+
+## Public module functions
+
+def enable():
+    global _run
+    _run = _RunReport()
+
+def disable():
+    global _run
+    _run = None
+    del _active[:]
+
+def isEnabled():
+    return _run is not None
+
+@contextmanager
+def stage( name ):
+    """
+    Record the wall time, CPU time, peak RSS and counters of a pipeline
+    stage, and trace its span.  Stages may be nested, and do nothing
+    unless enabled.  A stage that overlaps another thread's is marked
+    concurrent and has no peak RSS of its own; the run's covers it.
+    """
+    with tracing.span( name, "stage" ):
+        with _profiledStage( name ):
+            yield
+
+@contextmanager
+def _profiledStage( name ):
+    if _run is None:
+        yield
+        return
+
+    stack = _stageStack()
+    parent = stack[-1] if stack else None
+    thread = threading.current_thread().ident
+    record = {'name': name,
+              'parent': parent['name'] if parent else None,
+              'start': time.time() - _run.start,
+              'peakRssKb': 0,
+              'concurrent': False,
+              'counters': {}}
+    with _lock:
+        if any( other != thread for other, _ in _active ):
+            for _, active in _active:
+                active['concurrent'] = True
+            record['concurrent'] = True
+        if not record['concurrent']:
+            if parent is not None:
+                parent['peakRssKb'] = max(parent['peakRssKb'], _peakRss())
+            _resetPeakRss()
+        _active.append( (thread, record) )
+    stack.append( record )
+    cpuStart = _threadCpuTime()
+    start = time.time()
+    try:
+        yield
+    finally:
+        cpuEnd = _threadCpuTime()
+        record['wallTime'] = time.time() - start
+        record['cpuTime']  = None if cpuStart is None else cpuEnd - cpuStart
+        stack.pop()
+        with _lock:
+            _active[:] = [(t, r) for t, r in _active if r is not record]
+            if record['concurrent']:
+                # Overlapped another thread's stage, so the peak isn't its own
+                record['peakRssKb'] = None
+            else:
+                record['peakRssKb'] = max(record['peakRssKb'], _peakRss())
+                if parent is not None:
+                    parent['peakRssKb'] = max(parent['peakRssKb'], record['peakRssKb'])
+            _run.stages.append( record )
+        log.debug('Stage "{0}" finished in {1:.3f}s'.format(name, record['wallTime']))
+
+def addCount( name, records=0, nBytes=0 ):
+    """
+    Add record and byte counts to the named run-level counter and to the
+    innermost active stage
+    """
+    if _run is None:
+        return
+    with _lock:
+        _addCounters( _run.counters.setdefault(name, {}), records, nBytes )
+        stack = _stageStack()
+        if stack:
+            _addCounters( stack[-1]['counters'].setdefault(name, {}), records, nBytes )
+
+def recordProcess( name, command, wallTime, userTime, systemTime, maxRssKb, returnCode ):
+    """
+    Record the resource usage of a single external subprocess
+    """
+    if _run is None:
+        return
+    stack = _stageStack()
+    with _lock:
+        _run.processes.append({'name': name,
+                               'command': list(command),
+                               'stage': stack[-1]['name'] if stack else None,
+                               'wallTime': wallTime,
+                               'userTime': userTime,
+                               'systemTime': systemTime,
+                               'maxRssKb': maxRssKb,
+                               'returnCode': returnCode})
+
+def report():
+    if _run is None:
+        return None
+    with _lock:
+        return _run.toDict()
+
+def writeReport( filepath ):
+    """
+    Write the machine-readable JSON report for this run to a file
+    """
+    data = report()
+    if data is None:
+        return None
+    with open( filepath, 'w' ) as handle:
+        json.dump( data, handle, indent=2, sort_keys=True )
+    log.info('Wrote profiling report to "{0}"'.format( os.path.basename(filepath) ))
+    return filepath
@@ -2,8 +2,9 @@
 
 import logging
 
-from LociTools.io.BlasrIO import BlasrReader
-import LociTools.utils.utils as utils
+from LociTools.io.BlasrBinaryIO import openBlasrFile
+from LociTools import utils
+from LociTools.utils import instrumentation
 
 log = logging.getLogger(__name__)
 
@@ -13,9 +14,7 @@ def _getOutputFile( inputFile ):
     """
     Get the output file, either as provided or from the input filename
     """
-    basename = '.'.join( inputFile.split('.')[:-1] )
-    inputType = utils.getFileType( inputFile )
-    return '%s.oriented.%s' % (basename, inputType)
+    return utils.getOutputFile( inputFile, 'oriented' )
 
 def _getOutputType( outputFile ):
     """
@@ -34,23 +33,21 @@ def _identifyReversedRecords( alignFile ):
     Identify hits where the query and reference have difference orientations
     """
     reversedIds = []
-    for record in BlasrReader( alignFile ):
-        if record.qstrand != record.tstrand:
-            reversedIds.append( record.qname )
+    count = 0
+    with openBlasrFile( alignFile, columns=('qname', 'qstrand', 'tstrand') ) as reader:
+        for record in reader:
+            count += 1
+            if record.qstrand != record.tstrand:
+                reversedIds.append( record.qname )
+    instrumentation.addCount( "alignments", records=count )
     return set(reversedIds)
 
 def _orientRecords( records, reversedIds ):
     """
-    Reverse-comeplement the records specified in a list
+    Reverse-complement the specified records of a RecordStore
     """
-    oriented = []
-    for record in records:
-        name = record.name.split()[0]
-        if name in reversedIds:
-            oriented.append( record.reverseComplement() )
-        else:
-            oriented.append( record )
-    return oriented
+    indices = [i for i in xrange( len(records) ) if records.id( i ) in reversedIds]
+    return records.reverseComplement( indices )
 
 def orientSequences( inputFile, alignFile, outputFile=None ):
     """
@@ -61,14 +58,11 @@ def orientSequences( inputFile, alignFile, outputFile=None ):
     outputFile = outputFile or _getOutputFile( inputFile )
     outputType = _getOutputType( outputFile )
 
-    if utils.isValidFile( outputFile ):
-        log.info("Found existing output file %s, skipping orientation step" % outputFile)
-        return outputFile
-
     # Check the input files, and align the input file if needed
     reversedIds = _identifyReversedRecords( alignFile )
     records = utils.readSequenceRecords( inputFile )
     orientedRecords = _orientRecords( records, reversedIds )
+    instrumentation.addCount( "sequences", records=len(records) )
 
     utils.writeSequenceRecords( outputFile, orientedRecords, outputType )
     return outputFile
@@ -0,0 +1,319 @@
+#! /usr/bin/env python
+
+import string
+import logging
+from cStringIO import StringIO
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+__all__ = ["RecordStore", "parseSequenceLines", "parseSequenceText"]
+
+# Reverse-complemented records are renamed as by pbcore's reverseComplement()
+REVCOMP_SUFFIX = " [revcomp]"
+
+QUALITY_OFFSET = 33
+
+_COMPLEMENT = string.maketrans( "ACGTURYSWKMBDHVNacgturyswkmbdhvn",
+                                "TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn" )
+_COMPLEMENT_CODES = np.frombuffer( _COMPLEMENT, dtype=np.uint8 )
+
+
+## Private utilities
+
+def _gather( offsets, indices ):
+    """Return the buffer positions of the given records, in order"""
+    starts = offsets[:-1][indices]
+    lengths = offsets[1:][indices] - starts
+    total = int(lengths.sum())
+    recordStarts = np.zeros( len(indices) + 1, dtype=np.int64 )
+    np.cumsum( lengths, out=recordStarts[1:] )
+    positions = np.arange( total, dtype=np.int64 ) + np.repeat( starts - recordStarts[:-1], lengths )
+    return positions, recordStarts
+
+def _parseFasta( lines ):
+    """Parse FASTA lines straight into a name list, sequence buffer and offsets"""
+    names, sequence, offsets = [], bytearray(), [0]
+    for line in lines:
+        if line.startswith('>'):
+            if names:
+                offsets.append( len(sequence) )
+            names.append( line[1:].rstrip() )
+        elif names:
+            sequence.extend( line.strip() )
+    if names:
+        offsets.append( len(sequence) )
+    return names, sequence, offsets, None
+
+def _parseFastq( lines ):
+    """Parse four-line FASTQ records straight into name, sequence and quality buffers"""
+    names, sequence, quality, offsets = [], bytearray(), bytearray(), [0]
+    lines = iter( lines )
+    lineNumber = 0
+    for header in lines:
+        lineNumber += 1
+        if not header.strip():
+            continue
+        bases, separator, values = next( lines, '' ).strip(), next( lines, '' ), next( lines, '' ).strip()
+        if not header.startswith('@') or not separator.startswith('+') or len(bases) != len(values):
+            raise ValueError("Malformed FASTQ record at line {0}".format(lineNumber))
+        lineNumber += 3
+        names.append( header[1:].rstrip() )
+        sequence.extend( bases )
+        quality.extend( values )
+        offsets.append( len(sequence) )
+    return names, sequence, offsets, quality
+
+def parseSequenceLines( lines, fileType ):
+    """
+    Parse an iterable of FASTA or FASTQ lines, e.g. an open file, into a
+    RecordStore, appending each record to the store's buffers as it is read
+    """
+    if fileType == 'fasta':
+        return RecordStore.fromBuffers( *_parseFasta( lines ))
+    elif fileType == 'fastq':
+        return RecordStore.fromBuffers( *_parseFastq( lines ))
+    raise TypeError("Sequence text must be either FASTA or FASTQ")
+
+def parseSequenceText( text, fileType ):
+    """Parse FASTA or FASTQ text straight into a RecordStore"""
+    return parseSequenceLines( StringIO( text ), fileType )
+
+
+class RecordView( object ):
+    """
+    A read-only record of a RecordStore, with the attributes of the pbcore
+    FastaRecord / FastqRecord it stands in for
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__( self, store, index ):
+        self._store = store
+        self._index = index
+
+    @property
+    def header(self):
+        return self._store.name( self._index )
+
+    name = header
+
+    @property
+    def id(self):
+        return self.header.split()[0]
+
+    @property
+    def sequence(self):
+        return self._store.sequence( self._index )
+
+    @property
+    def quality(self):
+        return self._store.quality( self._index )
+
+    @property
+    def qualityString(self):
+        return (self.quality + QUALITY_OFFSET).tostring()
+
+    def __len__( self ):
+        return self._store.length( self._index )
+
+    def toRecord( self ):
+        """Return an equivalent pbcore record, e.g. for the pbcore writers"""
+        from pbcore.io import FastaRecord, FastqRecord
+        if self._store.hasQuality:
+            return FastqRecord( self.header, self.sequence, self.quality )
+        return FastaRecord( self.header, self.sequence )
+
+    def reverseComplement( self ):
+        return self.toRecord().reverseComplement()
+
+
+class RecordStore( object ):
+    """
+    Sequence records held compactly: every sequence in one string, every
+    quality value in one uint8 array, and the start of each record in an
+    offset array.  Iterating or indexing gives pbcore-like record views,
+    while lengths, accuracies, subsets and reverse-complements are computed
+    over the whole buffers at once.
+    """
+
+    def __init__( self, names, sequences, offsets, qualities=None ):
+        self._names     = list(names)
+        self._sequences = sequences
+        self._offsets   = np.asarray( offsets, dtype=np.int64 )
+        self._qualities = qualities
+        self._ids       = None
+
+    @classmethod
+    def fromParts( cls, names, sequences, qualities=None ):
+        """Build a store from lists of names, sequences and quality strings"""
+        offsets = np.zeros( len(sequences) + 1, dtype=np.int64 )
+        np.cumsum( [len(s) for s in sequences], out=offsets[1:] )
+        quality = None
+        if qualities is not None:
+            quality = (np.frombuffer( ''.join( qualities ), dtype=np.uint8 ) - QUALITY_OFFSET).astype( np.uint8 )
+        return cls( names, ''.join( sequences ), offsets, quality )
+
+    @classmethod
+    def fromBuffers( cls, names, sequence, offsets, quality=None ):
+        """
+        Build a store from a bytearray of every sequence and one of every
+        quality string, as filled by the parsers, decoding the qualities in place
+        """
+        if quality is not None:
+            quality = np.frombuffer( quality, dtype=np.uint8 )
+            quality -= QUALITY_OFFSET
+        return cls( names, str(sequence), offsets, quality )
+
+    @classmethod
+    def fromRecords( cls, records ):
+        """Build a store from pbcore records, or views of another store"""
+        records = list(records)
+        names = [r.header for r in records]
+        sequences = [r.sequence for r in records]
+        if records and hasattr( records[0], 'quality' ):
+            offsets = np.zeros( len(records) + 1, dtype=np.int64 )
+            np.cumsum( [len(s) for s in sequences], out=offsets[1:] )
+            quality = np.concatenate( [np.asarray( r.quality, dtype=np.uint8 ) for r in records] )
+            return cls( names, ''.join( sequences ), offsets, quality )
+        return cls.fromParts( names, sequences )
+
+    @classmethod
+    def concatenate( cls, stores ):
+        stores = [s for s in stores if len(s)]
+        if not stores:
+            return cls( [], '', [0] )
+        names = [n for s in stores for n in s._names]
+        offsets = [stores[0]._offsets]
+        for store in stores[1:]:
+            offsets.append( store._offsets[1:] + offsets[-1][-1] )
+        quality = None
+        if stores[0].hasQuality:
+            quality = np.concatenate( [s._qualities for s in stores] )
+        return cls( names, ''.join( s._sequences for s in stores ), np.concatenate( offsets ), quality )
+
+    @property
+    def hasQuality(self):
+        return self._qualities is not None
+
+    @property
+    def fileType(self):
+        return 'fastq' if self.hasQuality else 'fasta'
+
+    @property
+    def nBytes(self):
+        """The size of the sequence, quality and offset buffers"""
+        size = len(self._sequences) + self._offsets.nbytes
+        if self.hasQuality:
+            size += self._qualities.nbytes
+        return size
+
+    def __len__( self ):
+        return len(self._names)
+
+    def __iter__( self ):
+        for i in xrange( len(self._names) ):
+            yield RecordView( self, i )
+
+    def __getitem__( self, key ):
+        if isinstance( key, slice ):
+            return self.take( range( *key.indices( len(self) )))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("RecordStore index out of range")
+        return RecordView( self, key )
+
+    def name( self, i ):
+        return self._names[i]
+
+    def id( self, i ):
+        return self._names[i].split()[0]
+
+    def sequence( self, i ):
+        return self._sequences[self._offsets[i]:self._offsets[i+1]]
+
+    def quality( self, i ):
+        if not self.hasQuality:
+            raise AttributeError("FASTA records have no quality values")
+        return self._qualities[self._offsets[i]:self._offsets[i+1]]
+
+    def length( self, i ):
+        return int(self._offsets[i+1] - self._offsets[i])
+
+    def index( self, recordId ):
+        """Return the position of a record by its id, the first word of its name"""
+        if self._ids is None:
+            self._ids = {}
+            for i, name in enumerate( self._names ):
+                self._ids.setdefault( name.split()[0], i )
+        return self._ids[recordId]
+
+    def __contains__( self, recordId ):
+        try:
+            self.index( recordId )
+        except KeyError:
+            return False
+        return True
+
+    def lengths( self ):
+        return np.diff( self._offsets )
+
+    def accuracies( self, precision=7 ):
+        """The mean per-base accuracy of every record from its quality values"""
+        if not self.hasQuality:
+            raise AttributeError("FASTA records have no quality values")
+        pValues = 1.0 - 10.0 ** (-self._qualities.astype( np.float64 ) / 10.0)
+        lengths = self.lengths()
+        sums = np.zeros( len(self), dtype=np.float64 )
+        nonEmpty = lengths > 0
+        if nonEmpty.any():
+            sums[nonEmpty] = np.add.reduceat( pValues, self._offsets[:-1][nonEmpty] )
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            return np.round( sums / lengths, precision )
+
+    def take( self, indices ):
+        """Return a new store of the given records, in the given order"""
+        indices = np.asarray( indices, dtype=np.int64 )
+        if not len(indices):
+            return RecordStore( [], '', [0], np.zeros( 0, dtype=np.uint8 ) if self.hasQuality else None )
+        positions, offsets = _gather( self._offsets, indices )
+        sequences = np.frombuffer( self._sequences, dtype=np.uint8 )[positions].tostring()
+        quality = self._qualities[positions] if self.hasQuality else None
+        return RecordStore( [self._names[i] for i in indices], sequences, offsets, quality )
+
+    def select( self, recordIds ):
+        """Return a new store of the records with the given ids, in store order"""
+        recordIds = set(recordIds)
+        return self.take( [i for i in xrange( len(self) ) if self.id( i ) in recordIds] )
+
+    def filterLengths( self, minLength=0, maxLength=None ):
+        """Return a new store of the records within a length range"""
+        lengths = self.lengths()
+        keep = lengths >= minLength
+        if maxLength is not None:
+            keep &= lengths <= maxLength
+        return self.take( np.flatnonzero( keep ))
+
+    def reverseComplement( self, indices ):
+        """
+        Return a new store with the given records reverse-complemented in
+        place, and renamed with the suffix pbcore's reverseComplement() adds
+        """
+        indices = np.asarray( indices, dtype=np.int64 )
+        names = list(self._names)
+        for i in indices:
+            names[i] += REVCOMP_SUFFIX
+        lengths = self.lengths()
+        total = int(self._offsets[-1])
+        flip = np.zeros( len(self), dtype=bool )
+        flip[indices] = True
+        flipBase = np.repeat( flip, lengths )
+        positions = np.arange( total, dtype=np.int64 )
+        within = positions - np.repeat( self._offsets[:-1], lengths )
+        source = np.where( flipBase, np.repeat( self._offsets[1:], lengths ) - 1 - within, positions )
+        codes = np.frombuffer( self._sequences, dtype=np.uint8 )[source]
+        codes[flipBase] = _COMPLEMENT_CODES[codes[flipBase]]
+        quality = self._qualities[source] if self.hasQuality else None
+        return RecordStore( names, codes.tostring(), self._offsets.copy(), quality )
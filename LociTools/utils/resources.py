@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+
+import os
+import logging
+import multiprocessing
+import os.path as op
+
+log = logging.getLogger(__name__)
+
+__all__ = ["detectResources", "Resources"]
+
+CGROUP_ROOT       = "/sys/fs/cgroup"
+UNLIMITED_MEMORY  = 1 << 60   # cgroup v1 reports "no limit" as a huge page-rounded value
+THREADS_PER_SHARD = 8
+THREADS_PER_JOB   = 4
+MAX_WORKERS       = 4
+MAX_BGZF_THREADS  = 4
+MIN_PARSE_CHUNK   = 8 * 1024 * 1024
+MAX_PARSE_CHUNK   = 64 * 1024 * 1024
+
+_detected = None
+
+
+## Private utilities
+
+def _readFirstLine( filepath ):
+    try:
+        with open( filepath ) as handle:
+            return handle.readline().strip()
+    except (IOError, OSError):
+        return None
+
+def _cgroupPaths( controller ):
+    """
+    Return the candidate directories of this process's cgroup for a
+    controller, v2 (unified) first, then v1, then the mount roots
+    """
+    paths = []
+    try:
+        with open( "/proc/self/cgroup" ) as handle:
+            for line in handle:
+                parts = line.strip().split(':', 2)
+                if len(parts) != 3:
+                    continue
+                _, controllers, path = parts
+                if controllers == '':
+                    paths.append( op.join( CGROUP_ROOT, path.lstrip('/') ))
+                elif controller in controllers.split(','):
+                    paths.append( op.join( CGROUP_ROOT, controllers, path.lstrip('/') ))
+    except (IOError, OSError):
+        pass
+    paths += [CGROUP_ROOT, op.join( CGROUP_ROOT, controller ), op.join( CGROUP_ROOT, "cpu,cpuacct" )]
+    return paths
+
+def _parseCpuList( text ):
+    """Count the CPUs in a list like '0-3,6,8-9'"""
+    count = 0
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            count += int(last) - int(first) + 1
+        else:
+            count += 1
+    return count
+
+def _affinityCpus():
+    """The CPUs this process may run on, from its affinity mask"""
+    try:
+        with open( "/proc/self/status" ) as handle:
+            for line in handle:
+                if line.startswith("Cpus_allowed_list:"):
+                    return _parseCpuList( line.split(':', 1)[1] ), "affinity mask"
+    except (IOError, OSError, ValueError):
+        pass
+    return multiprocessing.cpu_count(), "CPU count"
+
+def _cpuQuota():
+    """The CPU quota of this process's cgroup, in CPUs, or None if unlimited"""
+    for path in _cgroupPaths( "cpu" ):
+        line = _readFirstLine( op.join( path, "cpu.max" ))
+        if line:
+            quota, _, period = line.partition(' ')
+            if quota == 'max':
+                return None, None
+            return float(quota) / float(period or 100000), "cgroup v2 cpu.max"
+        quota = _readFirstLine( op.join( path, "cpu.cfs_quota_us" ))
+        period = _readFirstLine( op.join( path, "cpu.cfs_period_us" ))
+        if quota and period:
+            if int(quota) <= 0:
+                return None, None
+            return float(quota) / float(period), "cgroup v1 cpu.cfs_quota_us"
+    return None, None
+
+def _memoryLimit():
+    """The memory available to this process: its cgroup limit, or physical memory"""
+    for path in _cgroupPaths( "memory" ):
+        line = _readFirstLine( op.join( path, "memory.max" ))
+        if line:
+            if line != 'max':
+                return int(line), "cgroup v2 memory.max"
+            break
+        line = _readFirstLine( op.join( path, "memory.limit_in_bytes" ))
+        if line:
+            if int(line) < UNLIMITED_MEMORY:
+                return int(line), "cgroup v1 memory.limit_in_bytes"
+            break
+    try:
+        with open( "/proc/meminfo" ) as handle:
+            for line in handle:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024, "physical memory"
+    except (IOError, OSError, ValueError):
+        pass
+    return None, "unknown"
+
+
+class Resources( object ):
+    """
+    The CPUs and memory this process may actually use, and the defaults
+    for parallelism and buffer sizes derived from them
+    """
+
+    def __init__( self, cpus, memory, cpuSource="", memorySource="" ):
+        self.cpus         = max(1, int(cpus))
+        self.memory       = memory
+        self.cpuSource    = cpuSource
+        self.memorySource = memorySource
+
+    @property
+    def blasrThreads(self):
+        return self.cpus
+
+    @property
+    def parseProcesses(self):
+        return self.cpus
+
+    @property
+    def bgzfThreads(self):
+        return min(MAX_BGZF_THREADS, self.cpus)
+
+    @property
+    def serverWorkers(self):
+        return max(1, min(MAX_WORKERS, self.cpus // THREADS_PER_JOB))
+
+    @property
+    def shards(self):
+        return max(2, self.cpus // THREADS_PER_SHARD)
+
+    @property
+    def parseChunkSize(self):
+        """Each parsing process holds about four copies of its chunk at once"""
+        if self.memory is None:
+            return MAX_PARSE_CHUNK
+        chunk = self.memory // (4 * self.parseProcesses)
+        return max(MIN_PARSE_CHUNK, min(MAX_PARSE_CHUNK, chunk))
+
+    def report( self ):
+        """Describe the detected limits and every default derived from them"""
+        memory = "unknown" if self.memory is None else "{0:.1f} GiB".format(self.memory / float(1 << 30))
+        lines = ["CPUs:            {0} (from {1})".format(self.cpus, self.cpuSource),
+                 "Memory:          {0} (from {1})".format(memory, self.memorySource),
+                 "BLASR threads:   {0} (one per CPU)".format(self.blasrThreads),
+                 "Parse processes: {0} (one per CPU)".format(self.parseProcesses),
+                 "Parse chunk:     {0} MiB (a quarter of memory per process, {1}-{2} MiB)".format(
+                     self.parseChunkSize >> 20, MIN_PARSE_CHUNK >> 20, MAX_PARSE_CHUNK >> 20),
+                 "BGZF threads:    {0} (one per CPU, at most {1})".format(self.bgzfThreads, MAX_BGZF_THREADS),
+                 "Server workers:  {0} (one per {1} CPUs, 1-{2})".format(self.serverWorkers, THREADS_PER_JOB, MAX_WORKERS),
+                 "Scatter shards:  {0} (one per {1} CPUs, at least 2)".format(self.shards, THREADS_PER_SHARD)]
+        return "\n".join(lines)
+
+
+## Public functions
+
+def detectResources():
+    """
+    Detect, once per process, the usable CPUs - the affinity mask, capped
+    by any cgroup v1/v2 CPU quota - and the memory limit
+    """
+    global _detected
+    if _detected is None:
+        cpus, cpuSource = _affinityCpus()
+        quota, quotaSource = _cpuQuota()
+        if quota is not None and quota < cpus:
+            cpus, cpuSource = max(1, int(quota)), "{0} ({1:.2f} CPUs)".format(quotaSource, quota)
+        memory, memorySource = _memoryLimit()
+        _detected = Resources( cpus, memory, cpuSource, memorySource )
+        log.debug('Detected {0} usable CPU(s) from {1}'.format(_detected.cpus, cpuSource))
+    return _detected
@@ -1,20 +1,59 @@
 
 import os
+import mmap
 import os.path as op
 import shutil
 import logging
+import multiprocessing
 
-from pbcore.io import FastaReader, FastqReader, FastaWriter, FastqWriter
-
-from .utils import isValidFile, isFastaFile, isFastqFile, getFileType
+from .utils import isValidFile, isFastaFile, isFastqFile, isCompressedFile, getFileType
 
 log = logging.getLogger(__name__)
 
+# Uncompressed inputs at least this large are parsed in record-aligned
+#  byte ranges by a pool of processes, both sized to the resources available
+PARALLEL_PARSE_SIZE = 256 * 1024 * 1024
+
+# pbcore.io pulls in h5py and the DataSet stack, so the readers and writers
+#  are only imported once a sequence file actually needs to be parsed
+
+def openSequenceFile( filename, mode='r' ):
+    """
+    Return something a pbcore reader or writer can be opened on: the file
+    name itself for plain files, or a gzip/BGZF file handle, read with
+    parallel decompression, for compressed ones
+    """
+    if not isCompressedFile( filename ):
+        return filename
+    from LociTools.io.BgzfIO import openCompressedFile
+    from LociTools.utils.resources import detectResources
+    return openCompressedFile( filename, mode, nproc=detectResources().bgzfThreads )
+
+def decompressSequenceFile( filename, outputFile ):
+    """Stream the decompressed contents of a compressed sequence file to a new file"""
+    from LociTools.io.BgzfIO import openCompressedFile
+    from LociTools.utils.resources import detectResources
+    with openCompressedFile( filename, nproc=detectResources().bgzfThreads ) as source:
+        with open( outputFile, 'wb' ) as handle:
+            shutil.copyfileobj( source, handle, 1 << 20 )
+    return outputFile
+
+def _pbcoreRecord( record ):
+    """Convert RecordStore views for the pbcore writers, which check types"""
+    if hasattr( record, 'toRecord' ):
+        return record.toRecord()
+    return record
+
+def _readAll( readerType, filename ):
+    with readerType( openSequenceFile( filename )) as reader:
+        return list( reader )
+
 def isValidFasta( filename ):
     if not isValidFile( filename ) or not isFastaFile( filename ):
         return False
+    from pbcore.io import FastaReader
     try:
-        list(FastaReader(filename))
+        _readAll(FastaReader, filename)
     except:
         return False
     return True
@@ -22,45 +61,148 @@ def isValidFasta( filename ):
 def isValidFastq( filename ):
     if not isValidFile( filename ) or not isFastqFile( filename ):
         return False
+    from pbcore.io import FastqReader
     try:
-        list(FastqReader(filename))
+        _readAll(FastqReader, filename)
     except:
         return False
     return True
 
 def fastaRecordCount( filepath ):
+    from pbcore.io import FastaReader
     try:
-        return len(list(FastaReader(filepath)))
+        return len(_readAll(FastaReader, filepath))
     except:
         return None
 
-def readSequenceRecords( filename ):
+def _rangeLines( handle, size ):
+    """Yield the lines of the next `size` bytes of an open file"""
+    while size > 0:
+        line = handle.readline( size )
+        if not line:
+            return
+        size -= len(line)
+        yield line
+
+def _nextLine( mm, pos, size ):
+    """Return the start of the line after the one containing pos"""
+    newline = mm.find('\n', pos)
+    return size if newline == -1 else newline + 1
+
+def _fastaBoundary( mm, pos, size ):
+    """Return the start of the first FASTA record at or after pos"""
+    if pos == 0:
+        return 0
+    header = mm.find('\n>', pos - 1)
+    return size if header == -1 else header + 1
+
+def _fastqBoundary( mm, pos, size ):
     """
-    Parse the input sequence records with the appropriate pbcore Reader
+    Return the start of the first FASTQ record at or after pos.  Quality
+    lines may also start with '@', so a candidate header is only accepted
+    if the line two below it starts with '+' and the sequence and quality
+    lines that frame it are the same length.
     """
+    line = pos if pos == 0 or mm[pos-1] == '\n' else _nextLine( mm, pos, size )
+    while line < size:
+        if mm[line] == '@':
+            sequence = _nextLine( mm, line, size )
+            separator = _nextLine( mm, sequence, size )
+            quality = _nextLine( mm, separator, size )
+            end = _nextLine( mm, quality, size )
+            if separator < size and mm[separator] == '+' and \
+               len(mm[sequence:separator].rstrip()) == len(mm[quality:end].rstrip()):
+                return line
+        line = _nextLine( mm, line, size )
+    return size
+
+def _recordAlignedRanges( filename, fileType, chunkSize ):
+    """
+    Split a sequence file into (start, end) byte ranges of roughly
+    chunkSize that each begin at a record boundary
+    """
+    size = op.getsize( filename )
+    if size == 0:
+        return []
+    boundary = _fastaBoundary if fileType == 'fasta' else _fastqBoundary
+    with open( filename, 'rb' ) as handle:
+        mm = mmap.mmap( handle.fileno(), 0, access=mmap.ACCESS_READ )
+        try:
+            starts = [0]
+            while starts[-1] + chunkSize < size:
+                start = boundary( mm, starts[-1] + chunkSize, size )
+                if start >= size:
+                    break
+                starts.append( start )
+        finally:
+            mm.close()
+    return zip( starts, starts[1:] + [size] )
+
+def _parseRange( task ):
+    """Parse the records in one byte range of a file into a RecordStore"""
+    from LociTools.utils.records import parseSequenceLines
+    from LociTools.utils import tracing
+    filename, fileType, start, end = task
+    with tracing.span( "parse", "chunk", file=op.basename( filename ), start=start, end=end ):
+        with open( filename, 'rb' ) as handle:
+            handle.seek( start )
+            return parseSequenceLines( _rangeLines( handle, end - start ), fileType )
+
+def _readParallel( filename, fileType, nproc, chunkSize ):
+    """Parse a large file in record-aligned ranges across processes, in order"""
+    from LociTools.utils.records import RecordStore
+    tasks = [(filename, fileType, start, end)
+             for start, end in _recordAlignedRanges( filename, fileType, chunkSize )]
+    nproc = max(1, min(nproc, len(tasks)))
+    log.debug('Parsing "{0}" in {1} ranges with {2} process(es)'.format(filename, len(tasks), nproc))
+    if nproc == 1:
+        return RecordStore.concatenate( [_parseRange( task ) for task in tasks] )
+    pool = multiprocessing.Pool( nproc )
+    try:
+        stores = pool.map( _parseRange, tasks )
+        pool.close()
+    finally:
+        pool.terminate()
+    return RecordStore.concatenate( stores )
+
+def readSequenceRecords( filename, nproc=None ):
+    """
+    Parse the input sequence records into a compact RecordStore, whose
+    records look like those of the pbcore Readers.  Large uncompressed
+    files are parsed in parallel, by `nproc` processes or one per usable CPU,
+    and others line by line as they are read.
+    """
+    from LociTools.utils.records import parseSequenceLines
     fileType = getFileType( filename )
-    if fileType == 'fasta':
-        return list( FastaReader( filename ))
-    elif fileType == 'fastq':
-        return list( FastqReader( filename ))
-    else:
+    if fileType not in ('fasta', 'fastq'):
         msg = 'Input file must be either FASTA or FASTQ'
         log.error( msg )
         raise TypeError( msg )
+    if isCompressedFile( filename ):
+        handle = openSequenceFile( filename )
+    elif op.getsize( filename ) >= PARALLEL_PARSE_SIZE:
+        from LociTools.utils.resources import detectResources
+        resources = detectResources()
+        return _readParallel( filename, fileType, nproc or resources.parseProcesses, resources.parseChunkSize )
+    else:
+        handle = open( filename )
+    with handle:
+        return parseSequenceLines( handle, fileType )
 
 def writeSequenceRecords( filename, records, filetype=None ):
     """
     Write the records out to file
     """
+    from pbcore.io import FastaWriter, FastqWriter
     fileType = filetype or getFileType( filename )
     if fileType == 'fasta':
-        with FastaWriter( filename ) as writer:
+        with FastaWriter( openSequenceFile( filename, 'w' )) as writer:
             for record in records:
-                writer.writeRecord( record )
+                writer.writeRecord( _pbcoreRecord( record ))
     elif fileType == 'fastq':
-        with FastqWriter( filename ) as writer:
+        with FastqWriter( openSequenceFile( filename, 'w' )) as writer:
             for record in records:
-                writer.writeRecord( record )
+                writer.writeRecord( _pbcoreRecord( record ))
     else:
         msg = 'Output filetype must be either FASTA or FASTQ'
         log.error( msg )
@@ -69,9 +211,9 @@ def writeSequenceRecords( filename, records, filetype=None ):
 
 def getNumReads( recordName ):
     assert 'NumReads' in recordName
-    return int(recordName.split('NumReads')[1])
+    return int(recordName.split('NumReads')[1].split()[0])
 
-def recordSuppot( record ):
+def recordSupport( record ):
     return getNumReads( record.name )
 
 def qualityToP(qv):
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+
+import sys
+import heapq
+import logging
+import tempfile
+import cPickle as pickle
+from itertools import groupby
+from operator import itemgetter
+
+log = logging.getLogger(__name__)
+
+__all__ = ["externalSort", "externalGroupBy"]
+
+MAX_OPEN_RUNS = 64
+
+# Items are buffered until their estimated size reaches the memory budget,
+#  then sorted and spilled to an anonymous temporary file as one sorted run.
+#  The runs are merged back lazily, at most MAX_OPEN_RUNS at a time, so only
+#  one buffer of items and one item per run are ever held in memory.
+
+
+## Private utilities
+
+def _itemSize( item ):
+    """Estimate the memory held by a tuple of small values"""
+    return sys.getsizeof( item ) + sum( sys.getsizeof( value ) for value in item )
+
+def _writeRun( items, tempDir ):
+    handle = tempfile.TemporaryFile( prefix="spill_", dir=tempDir )
+    pickler = pickle.Pickler( handle, pickle.HIGHEST_PROTOCOL )
+    for item in items:
+        pickler.dump( item )
+        pickler.memo.clear()
+    handle.seek( 0 )
+    return handle
+
+def _readRun( handle ):
+    unpickler = pickle.Unpickler( handle )
+    try:
+        while True:
+            yield unpickler.load()
+    except EOFError:
+        pass
+    finally:
+        handle.close()
+
+def _mergeRuns( runs, tempDir ):
+    """Merge sorted runs, first collapsing them until few enough are open at once"""
+    while len(runs) > MAX_OPEN_RUNS:
+        merged = _writeRun( heapq.merge( *[_readRun( r ) for r in runs[:MAX_OPEN_RUNS]] ), tempDir )
+        runs = runs[MAX_OPEN_RUNS:] + [merged]
+    return heapq.merge( *[_readRun( r ) for r in runs] )
+
+
+## Public functions
+
+def externalSort( items, maxBytes, tempDir=None, sizeOf=_itemSize ):
+    """
+    Sort an iterable of tuples in bounded memory, yielding them in order.
+    Items that fit the budget are sorted in memory without touching disk.
+    """
+    buffered, size, runs = [], 0, []
+    for item in items:
+        buffered.append( item )
+        size += sizeOf( item )
+        if size >= maxBytes:
+            buffered.sort()
+            runs.append( _writeRun( buffered, tempDir ))
+            buffered, size = [], 0
+    buffered.sort()
+    if not runs:
+        return iter( buffered )
+    if buffered:
+        runs.append( _writeRun( buffered, tempDir ))
+    log.debug('Spilled {0} sorted run(s) to merge'.format(len(runs)))
+    return _mergeRuns( runs, tempDir )
+
+def externalGroupBy( items, maxBytes, tempDir=None, sizeOf=_itemSize ):
+    """
+    Yield each distinct first element of a set of tuples, with the list of
+    its tuples in sorted order, holding only one group in memory at a time
+    """
+    for key, group in groupby( externalSort( items, maxBytes, tempDir, sizeOf ), key=itemgetter(0) ):
+        yield key, list(group)
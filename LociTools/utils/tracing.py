@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+
+import os
+import json
+import glob
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import os.path as op
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+__all__ = ["enable", "disable", "isEnabled", "span", "addSpan", "writeTrace"]
+
+# Spans are recorded as Chrome trace-event "complete" events, with times in
+#  microseconds from the start of the trace, viewable in chrome://tracing or
+#  Perfetto.  The process that enabled tracing keeps its events in memory;
+#  forked workers, e.g. of a multiprocessing Pool, inherit the trace and
+#  append theirs to a per-process spool file, merged in by writeTrace().
+
+## Private module state
+
+_lock  = threading.Lock()
+_trace = None
+
+_SPOOL_PATTERN = "events.{0}.json"
+
+
+class _Trace( object ):
+    """The events recorded since tracing was enabled"""
+
+    def __init__( self ):
+        self.pid       = os.getpid()
+        self.start     = time.time()
+        self.events    = []
+        self.processes = {self.pid: "loci"}
+        self.spoolDir  = tempfile.mkdtemp( prefix="loci_trace_" )
+
+
+## Private utilities
+
+def _microseconds( seconds ):
+    return int(round( seconds * 1e6 ))
+
+def _record( event ):
+    """Keep an event in memory, or spool it when recorded by a forked worker"""
+    pid = os.getpid()
+    event['pid'] = event.get('pid', pid)
+    if pid == _trace.pid:
+        with _lock:
+            _trace.events.append( event )
+        return
+    with open( op.join( _trace.spoolDir, _SPOOL_PATTERN.format(pid) ), 'a' ) as handle:
+        handle.write( json.dumps( event ) + "\n" )
+
+def _spooledEvents():
+    events = []
+    for filepath in glob.glob( op.join( _trace.spoolDir, _SPOOL_PATTERN.format('*') )):
+        with open( filepath ) as handle:
+            events += [json.loads( line ) for line in handle if line.strip()]
+    return events
+
+def _metadata( events ):
+    """Name every process and thread seen, for the trace viewer's tracks"""
+    processes, threads = {}, {}
+    for event in events:
+        processes.setdefault( event['pid'], event.pop('processName', None) )
+        threads.setdefault( (event['pid'], event['tid']), event.pop('threadName', None) )
+    for pid in processes:
+        processes[pid] = _trace.processes.get( pid ) or processes[pid] or "loci worker {0}".format(pid)
+    metadata = [{'ph': 'M', 'name': 'process_name', 'pid': pid, 'tid': 0, 'args': {'name': name}}
+                for pid, name in sorted( processes.iteritems() )]
+    metadata += [{'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for (pid, tid), name in sorted( threads.iteritems() ) if name]
+    return metadata
+
+## Public module functions
+
+def enable():
+    global _trace
+    disable()
+    _trace = _Trace()
+
+def disable():
+    global _trace
+    if _trace is not None and os.getpid() == _trace.pid:
+        shutil.rmtree( _trace.spoolDir, ignore_errors=True )
+    _trace = None
+
+def isEnabled():
+    return _trace is not None
+
+@contextmanager
+def span( name, category="loci", **args ):
+    """
+    Record the start and duration of a block on the current thread, with
+    any keyword arguments shown alongside it.  Does nothing unless enabled.
+    """
+    if _trace is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        thread = threading.current_thread()
+        _record({'ph': 'X', 'name': name, 'cat': category,
+                 'ts': _microseconds( start - _trace.start ),
+                 'dur': _microseconds( time.time() - start ),
+                 'tid': thread.ident,
+                 'threadName': thread.name,
+                 'args': args})
+
+def addSpan( name, category, start, duration, pid, processName=None, **args ):
+    """
+    Record a span that has already finished, e.g. an external subprocess
+    timed by its supervisor, on the track of the process that ran it
+    """
+    if _trace is None:
+        return
+    _record({'ph': 'X', 'name': name, 'cat': category,
+             'ts': _microseconds( start - _trace.start ),
+             'dur': _microseconds( duration ),
+             'pid': pid,
+             'tid': pid,
+             'processName': processName or name,
+             'args': args})
+
+def writeTrace( filepath ):
+    """
+    Write every event recorded so far, by this process and its workers, as
+    a Chrome trace-event JSON file
+    """
+    if _trace is None:
+        return None
+    with _lock:
+        events = [dict(e) for e in _trace.events]
+    events = sorted( events + _spooledEvents(), key=lambda e: e['ts'] )
+    with open( filepath, 'w' ) as handle:
+        json.dump( {'traceEvents': _metadata( events ) + events,
+                    'displayTimeUnit': 'ms'}, handle )
+    log.info('Wrote trace of {0} events to "{1}"'.format(len(events), os.path.basename(filepath)))
+    return filepath
@@ -6,6 +6,17 @@ import logging
 
 log = logging.getLogger(__name__)
 
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+def isCompressedFile( filename ):
+    return filename.lower().endswith( COMPRESSED_SUFFIXES )
+
+def stripCompressedSuffix( filename ):
+    """Remove any gzip/BGZF suffix, e.g. 'reads.fastq.gz' to 'reads.fastq'"""
+    if isCompressedFile( filename ):
+        return op.splitext( filename )[0]
+    return filename
+
 def isValidFile( filepath ):
     return op.exists( filepath ) and op.isfile( filepath )
 
@@ -13,13 +24,13 @@ def isValidDirectory( dirpath ):
     return op.exists( dirpath ) and op.isdir( dirpath )
 
 def isFastaFile( filename ):
-    fn = filename.lower()
+    fn = stripCompressedSuffix( filename ).lower()
     if fn.endswith('.fa') or fn.endswith('.fasta'):
         return True
     return False
 
 def isFastqFile( filename ):
-    fn = filename.lower()
+    fn = stripCompressedSuffix( filename ).lower()
     if fn.endswith('.fastq') or fn.endswith('.fq'):
         return True
     return False
@@ -56,6 +67,7 @@ def removeFile( filepath ):
             raise IOError( msg )
 
 def getFileType( filename ):
+    filename = stripCompressedSuffix( filename )
     if filename.endswith('.fa') or filename.endswith('.fasta'):
         return 'fasta'
     elif filename.endswith('.fq') or filename.endswith('.fastq'):
@@ -68,6 +80,10 @@ def getFileType( filename ):
         return 'm1'
     elif filename.endswith('.m5'):
         return 'm5'
+    elif filename.endswith('.m1b'):
+        return 'm1b'
+    elif filename.endswith('.m5b'):
+        return 'm5b'
     else:
         msg = 'File is not of a recognized filetype'
         log.error( msg )
@@ -76,8 +92,10 @@ def getFileType( filename ):
 def getOutputFile( inputFile, fileTag ):
     """
     Name a new file with the same type as the old, but a new descriptive tag
-     before the suffix
+     before the suffix.  Compressed inputs give compressed outputs.
     """
-    basename = '.'.join( inputFile.split('.')[:-1] )
+    uncompressed = stripCompressedSuffix( inputFile )
+    compression = inputFile[len(uncompressed):]
+    basename = '.'.join( uncompressed.split('.')[:-1] )
     fileType = getFileType( inputFile )
-    return '%s.%s.%s' % (basename, fileTag, fileType)
+    return '%s.%s.%s%s' % (basename, fileTag, fileType, compression)
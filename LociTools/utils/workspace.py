@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+
+import os
+import errno
+import shutil
+import logging
+import tempfile
+import os.path as op
+
+log = logging.getLogger(__name__)
+
+SCRATCH_ENV = "LOCITOOLS_SCRATCH"
+PREFIX = "loci_"
+
+
+class WorkspaceError(IOError):
+    pass
+
+
+## Private utilities
+
+def _scratchRoot( scratchDir ):
+    """Choose the scratch root: as given, from the environment, or the system temp"""
+    root = scratchDir or os.environ.get( SCRATCH_ENV ) or tempfile.gettempdir()
+    if not op.isdir( root ) or not os.access( root, os.W_OK ):
+        raise WorkspaceError('Scratch directory "{0}" is not a writable directory'.format(root))
+    return root
+
+
+class Workspace( object ):
+    """
+    A private, uniquely named scratch directory for the intermediates of one
+    run, e.g. on /dev/shm or a local SSD rather than beside the inputs.
+    Finished outputs are committed to their destination atomically, so a
+    destination only ever holds complete files, and the workspace and
+    anything left in it are removed when the run ends, however it ends.
+    """
+
+    def __init__( self, scratchDir=None, prefix=PREFIX ):
+        self._root   = _scratchRoot( scratchDir )
+        self._prefix = prefix
+        self._path   = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def open( self ):
+        if self._path is None:
+            self._path = tempfile.mkdtemp( prefix=self._prefix, dir=self._root )
+            log.debug('Created workspace "{0}"'.format(self._path))
+        return self
+
+    def file( self, filename ):
+        """Return a path in the workspace for an intermediate file"""
+        return op.join( self._path, op.basename( filename ))
+
+    def commit( self, filepath, destination ):
+        """
+        Atomically move a finished file to its destination, copying to a
+        temporary name beside the destination first if it is on another
+        filesystem, and return the destination
+        """
+        destination = op.abspath( destination )
+        try:
+            os.rename( filepath, destination )
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            handle, partial = tempfile.mkstemp( prefix='.' + op.basename( destination ) + '.',
+                                                dir=op.dirname( destination ))
+            os.close( handle )
+            try:
+                shutil.copyfile( filepath, partial )
+                os.rename( partial, destination )
+            except:
+                if op.exists( partial ):
+                    os.remove( partial )
+                raise
+            os.remove( filepath )
+        log.debug('Committed "{0}"'.format(destination))
+        return destination
+
+    def close( self ):
+        if self._path is not None:
+            shutil.rmtree( self._path, ignore_errors=True )
+            log.debug('Removed workspace "{0}"'.format(self._path))
+            self._path = None
+
+    def __enter__( self ):
+        return self.open()
+
+    def __exit__( self, *args ):
+        self.close()
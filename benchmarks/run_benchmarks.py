@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+
+"""
+Benchmark the LociTools hot paths on synthetic HLA-like data.
+
+Each component runs in its own subprocess so its peak memory is measured in
+isolation.  Throughput (records per second) and peak RSS are compared with
+a stored baseline, and the run fails if any component regresses by more
+than the given threshold:
+
+    python benchmarks/run_benchmarks.py [--samples N] [--threshold 0.25]
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --ci
+
+With --ci, or when $CI is set, a missing baseline for the chosen scale or
+component is itself a failure, so a regression check can't silently pass.
+
+The typing component runs the full 'loci typing' command against the
+deterministic fake_blasr stand-in, so no aligner or network is required.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import resource
+import subprocess
+import os.path as op
+from collections import OrderedDict
+
+BENCH_DIR = op.dirname( op.abspath(__file__) )
+REPO_DIR  = op.dirname( BENCH_DIR )
+sys.path.insert(0, REPO_DIR)
+
+import synthetic
+
+BASELINE  = op.join( BENCH_DIR, "baseline.json" )
+FAKE_BLASR = op.join( BENCH_DIR, "fake_blasr" )
+LOCI_EXE  = op.join( REPO_DIR, "bin", "loci" )
+
+## Components
+#
+# Each component is a (setup, run) pair of functions taking the synthetic
+#  data paths and a private working directory.  Only run() is measured, and
+#  it returns the number of records it processed.
+
+def _countLines( filepath ):
+    with open( filepath ) as handle:
+        return sum(1 for _ in handle)
+
+def _copyInput( paths, workdir ):
+    fastq = op.join( workdir, op.basename(paths['fastq']) )
+    shutil.copy( paths['fastq'], fastq )
+    return fastq
+
+def _runTextReader( paths, workdir ):
+    from LociTools.io import BlasrReader
+    return sum(1 for _ in BlasrReader( paths['m5'] ))
+
+def _runMappedReader( paths, workdir ):
+    from LociTools.io import MappedBlasrReader
+    reader = MappedBlasrReader( paths['m5'], columns=('qname', 'tname', 'nmis'), nproc=4,
+                                chunkSize=max(1, op.getsize(paths['m5']) // 8) )
+    return sum(1 for _ in reader)
+
+def _setupBinaryReader( paths, workdir ):
+    from LociTools.io.BlasrBinaryIO import convertBlasrFile
+    convertBlasrFile( paths['m5'], op.join(workdir, "alignments.m5b") )
+
+def _runBinaryReader( paths, workdir ):
+    from LociTools.io import BlasrBinaryReader
+    reader = BlasrBinaryReader( op.join(workdir, "alignments.m5b"), columns=('qname', 'tname', 'nmis') )
+    return sum(1 for _ in reader)
+
+def _runOrientation( paths, workdir ):
+    from LociTools.utils.orientation import orientSequences
+    orientSequences( _copyInput(paths, workdir), paths['m5'] )
+    return _countLines( paths['fastq'] ) // 4
+
+def _setupSelection( paths, workdir ):
+    from LociTools.utils.orientation import orientSequences
+    orientSequences( _copyInput(paths, workdir), paths['m5'] )
+
+def _runSelection( paths, workdir ):
+    from LociTools.typing.SequenceSelector import SequenceSelector
+    fastq = op.join( workdir, op.basename(paths['fastq']) )
+    oriented = fastq.replace(".fastq", ".oriented.fastq")
+    SequenceSelector()( oriented, alignFile=paths['m5'] )
+    return _countLines( paths['m5'] )
+
+def _runImgt( paths, workdir ):
+    from LociTools.imgt.ImgtAlignment import ImgtGenomicAlignment
+    count = 0
+    os.chdir( workdir )
+    with zipfile.ZipFile( paths['imgtZip'] ) as archive:
+        for filename in archive.namelist():
+            if filename.endswith("_gen.txt"):
+                locus = op.basename(filename).split('_')[0]
+                alignment = ImgtGenomicAlignment( locus, archive.open(filename) )
+                alignment.Write()
+                count += len(alignment._dict)
+    return count
+
+def _runReferences( paths, workdir ):
+    from LociTools import references
+    genomic = op.join( paths['references'], "genomic.fasta" )
+    records = references._readFasta( genomic )
+    references._writeFasta( op.join(workdir, "genomic.fasta"), records )
+    return len(records)
+
+def _setupTyping( paths, workdir ):
+    binDir = op.join( workdir, "bin" )
+    os.makedirs( binDir )
+    os.symlink( FAKE_BLASR, op.join(binDir, "blasr") )
+
+def _runTyping( paths, workdir ):
+    env = dict(os.environ)
+    env["PATH"] = op.join(workdir, "bin") + os.pathsep + env.get("PATH", "")
+    env["LOCITOOLS_REFERENCES"] = paths['references']
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    with open( os.devnull, 'w' ) as devnull:
+        subprocess.check_call( [sys.executable, LOCI_EXE, "typing", _copyInput(paths, workdir)],
+                               cwd=workdir, env=env, stdout=devnull, stderr=devnull )
+    return _countLines( paths['fastq'] ) // 4
+
+COMPONENTS = OrderedDict([
+    ("blasrio.text",   (None, _runTextReader)),
+    ("blasrio.mapped", (None, _runMappedReader)),
+    ("blasrio.binary", (_setupBinaryReader, _runBinaryReader)),
+    ("orientation",    (None, _runOrientation)),
+    ("selection",      (_setupSelection, _runSelection)),
+    ("imgt",           (None, _runImgt)),
+    ("references",     (None, _runReferences)),
+    ("typing",         (_setupTyping, _runTyping)),
+])
+
+## Measurement
+
+def _peakRssKb():
+    own = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    children = resource.getrusage( resource.RUSAGE_CHILDREN ).ru_maxrss
+    return max(own, children)
+
+def measureComponent( name, paths ):
+    """Set up and time a single component in the current process"""
+    setup, run = COMPONENTS[name]
+    workdir = tempfile.mkdtemp( prefix="loci_bench_" )
+    try:
+        if setup is not None:
+            setup( paths, workdir )
+        start = time.time()
+        records = run( paths, workdir )
+        wallTime = time.time() - start
+    finally:
+        os.chdir( REPO_DIR )
+        shutil.rmtree( workdir, ignore_errors=True )
+    return {'records': records,
+            'wallTime': wallTime,
+            'throughput': records / max(wallTime, 1e-9),
+            'peakRssKb': _peakRssKb()}
+
+def runComponent( name, dataDir, repeat ):
+    """Run a component in fresh subprocesses, keeping the fastest result"""
+    best = None
+    for _ in range(repeat):
+        try:
+            output = subprocess.check_output( [sys.executable, op.abspath(__file__),
+                                               "--component", name, "--data", dataDir] )
+        except subprocess.CalledProcessError:
+            return None
+        result = json.loads( output.strip().splitlines()[-1] )
+        if best is None or result['wallTime'] < best['wallTime']:
+            best = result
+    return best
+
+def compare( results, baseline, threshold, strict=False ):
+    """
+    Return a list of regressions relative to the baseline, counting
+    components without a baseline as regressions if strict
+    """
+    regressions = []
+    for name, result in results.iteritems():
+        if name not in baseline:
+            if strict:
+                regressions.append('{0}: no stored baseline'.format(name))
+            continue
+        expected = baseline[name]
+        if result['throughput'] < expected['throughput'] * (1.0 - threshold):
+            regressions.append('{0}: throughput {1:.1f}/s is below baseline {2:.1f}/s'.format(
+                               name, result['throughput'], expected['throughput']))
+        if result['peakRssKb'] > expected['peakRssKb'] * (1.0 + threshold):
+            regressions.append('{0}: peak RSS {1}KB is above baseline {2}KB'.format(
+                               name, result['peakRssKb'], expected['peakRssKb']))
+    return regressions
+
+def _scaleKey( args ):
+    return "samples={0},alleles={1},length={2},seed={3}".format(args.samples, args.alleles, args.length, args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LociTools components on synthetic data")
+    parser.add_argument("--samples", type=int, default=24, help="Number of barcoded samples")
+    parser.add_argument("--alleles", type=int, default=100, help="Alleles per locus")
+    parser.add_argument("--length", type=int, default=3000, help="Genomic allele length")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per component, keeping the fastest")
+    parser.add_argument("--only", help="Comma-separated list of components to run")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed fractional regression in throughput or peak memory")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the baseline for this scale")
+    parser.add_argument("--ci", action="store_true", default=bool(os.environ.get("CI")),
+                        help="Fail when no baseline is stored for this scale or a component. "
+                             "Default = on when $CI is set")
+    parser.add_argument("--keep", help="Generate the data into this directory and keep it")
+    parser.add_argument("--component", help=argparse.SUPPRESS)
+    parser.add_argument("--data", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.component:
+        with open( op.join(args.data, "paths.json") ) as handle:
+            paths = json.load( handle )
+        print(json.dumps( measureComponent(args.component, paths) ))
+        return 0
+
+    dataDir = args.keep or tempfile.mkdtemp( prefix="loci_bench_data_" )
+    try:
+        paths = synthetic.generate( dataDir, args.seed, args.alleles, args.length, args.samples )
+        with open( op.join(dataDir, "paths.json"), 'w' ) as handle:
+            json.dump( paths, handle )
+
+        names = args.only.split(',') if args.only else list(COMPONENTS)
+        results = OrderedDict()
+        failed = []
+        for name in names:
+            result = runComponent( name, dataDir, args.repeat )
+            if result is None:
+                print("{0:<16} FAILED".format(name))
+                failed.append( name )
+                continue
+            results[name] = result
+            print("{0:<16} {1:>8} records  {2:>8.3f}s  {3:>12.1f}/s  {4:>8} KB".format(
+                  name, results[name]['records'], results[name]['wallTime'],
+                  results[name]['throughput'], results[name]['peakRssKb']))
+    finally:
+        if not args.keep:
+            shutil.rmtree( dataDir, ignore_errors=True )
+
+    if failed:
+        print("Failed components: {0}".format(', '.join(failed)))
+        return 1
+
+    stored = {}
+    if op.exists( args.baseline ):
+        with open( args.baseline ) as handle:
+            stored = json.load( handle )
+    scale = _scaleKey( args )
+
+    if args.save_baseline:
+        stored.setdefault(scale, {}).update( results )
+        with open( args.baseline, 'w' ) as handle:
+            json.dump( stored, handle, indent=2, sort_keys=True )
+        print('Saved baseline for "{0}" to {1}'.format(scale, args.baseline))
+        return 0
+
+    if scale not in stored:
+        print('No stored baseline for "{0}" in {1}; run with --save-baseline to record one'.format(scale, args.baseline))
+        return 1 if args.ci else 0
+    regressions = compare( results, stored[scale], args.threshold, strict=args.ci )
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
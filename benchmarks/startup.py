@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+"""
+Measure 'loci' start-up cost and fail if it exceeds a time budget.
+
+Two commands are timed, keeping the fastest of several runs:
+  * 'loci --help', which should import nothing beyond the option parser
+  * a no-op 'loci typing' run, in which every stage is resumed from the
+    stage manifest of a previous run against the fake_blasr stand-in
+
+    python benchmarks/startup.py [--help-budget 0.5] [--typing-budget 2.0]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import os.path as op
+
+BENCH_DIR = op.dirname( op.abspath(__file__) )
+REPO_DIR  = op.dirname( BENCH_DIR )
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+LOCI_EXE   = op.join( REPO_DIR, "bin", "loci" )
+FAKE_BLASR = op.join( BENCH_DIR, "fake_blasr" )
+
+# Modules that the '--help' path must not import
+HEAVY_MODULES = ["pbcore", "pkg_resources", "numpy", "h5py"]
+
+HEAVY_CHECK = """
+import sys
+sys.argv = ['loci', '--help']
+from LociTools.main import main
+try:
+    main()
+except SystemExit:
+    pass
+sys.stderr.write(' '.join(m for m in %r if m in sys.modules))
+""" % (HEAVY_MODULES,)
+
+def _environment( workdir, references=None ):
+    env = dict(os.environ)
+    env["PATH"] = op.join(workdir, "bin") + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    if references:
+        env["LOCITOOLS_REFERENCES"] = references
+    return env
+
+def timeCommand( command, env, cwd, repeat ):
+    """Return the fastest wall time of several runs of a command"""
+    best = None
+    with open( os.devnull, 'w' ) as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call( command, env=env, cwd=cwd, stdout=devnull, stderr=devnull )
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def heavyImports( env, cwd ):
+    """Return the heavy modules imported while printing the help message"""
+    process = subprocess.Popen( [sys.executable, "-c", HEAVY_CHECK], env=env, cwd=cwd,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+    _, stderr = process.communicate()
+    return stderr.strip().splitlines()[-1].split() if stderr.strip() else []
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the start-up time of the loci command")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per command, keeping the fastest")
+    parser.add_argument("--help-budget", type=float, default=0.5, help="Seconds allowed for 'loci --help'")
+    parser.add_argument("--typing-budget", type=float, default=2.0, help="Seconds allowed for a no-op typing run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp( prefix="loci_startup_" )
+    failures = []
+    try:
+        os.makedirs( op.join(workdir, "bin") )
+        os.symlink( FAKE_BLASR, op.join(workdir, "bin", "blasr") )
+        paths = synthetic.generate( op.join(workdir, "data"), nAlleles=10, nSamples=2 )
+        env = _environment( workdir, paths['references'] )
+
+        heavy = heavyImports( env, workdir )
+        if heavy:
+            failures.append("'loci --help' imported {0}".format(', '.join(heavy)))
+
+        helpTime = timeCommand( [sys.executable, LOCI_EXE, "--help"], env, workdir, args.repeat )
+        print("loci --help        {0:.3f}s (budget {1:.3f}s)".format(helpTime, args.help_budget))
+        if helpTime > args.help_budget:
+            failures.append("'loci --help' took {0:.3f}s".format(helpTime))
+
+        # Prime the stage manifest, so the timed runs resume every stage
+        typing = [sys.executable, LOCI_EXE, "typing", paths['fastq']]
+        timeCommand( typing, env, workdir, 1 )
+        typingTime = timeCommand( typing, env, workdir, args.repeat )
+        print("no-op loci typing  {0:.3f}s (budget {1:.3f}s)".format(typingTime, args.typing_budget))
+        if typingTime > args.typing_budget:
+            failures.append("no-op 'loci typing' took {0:.3f}s".format(typingTime))
+    finally:
+        shutil.rmtree( workdir, ignore_errors=True )
+
+    for failure in failures:
+        print("FAILED " + failure)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+
+"""
+Generate synthetic HLA-like benchmark data: an IMGT-format alignment ZIP,
+a matching LociTools reference directory, multi-sample consensus FASTQ
+and the m5 alignments of that FASTQ against the reference.
+
+    python benchmarks/synthetic.py OUTPUT_DIR [--samples N] [--alleles N] ...
+"""
+
+import os
+import os.path as op
+import random
+import zipfile
+import argparse
+from string import maketrans
+
+LOCI        = ["A", "B", "C"]
+VERSION     = "3.25.0"
+DATE        = "2016 July 15"
+BASES       = "ACGT"
+COMPLEMENT  = maketrans("ACGT", "TGCA")
+BLOCK       = 10
+LINE_BLOCKS = 10
+
+## Allele generation
+
+def _randomSequence( rng, length ):
+    return ''.join( rng.choice(BASES) for _ in range(length) )
+
+def _mutate( rng, sequence, rate ):
+    """Substitute bases at the given per-base rate"""
+    bases = list(sequence)
+    for i in range(len(bases)):
+        if bases[i] in BASES and rng.random() < rate:
+            bases[i] = rng.choice([b for b in BASES if b != bases[i]])
+    return ''.join(bases)
+
+def _segmentLengths( length, nExons=3 ):
+    """Split a genomic length into UTR, exon and intron segment lengths"""
+    nSegments = 2 * nExons + 1
+    size = length // nSegments
+    lengths = [size] * nSegments
+    lengths[-1] += length - size * nSegments
+    return lengths
+
+def makeAlleles( rng, locus, nAlleles, length, rate=0.01 ):
+    """
+    Build aligned genomic alleles for a locus as lists of segments.  Alleles
+    after the first carry substitutions, and a few have insertions ('.'
+    gaps in the others) or unsequenced ('*') UTRs.
+    """
+    reference = [_randomSequence( rng, l ) for l in _segmentLengths( length )]
+    alleles = [(reference, "{0}*01:01:01:01".format(locus))]
+    for i in range(1, nAlleles):
+        segments = [_mutate( rng, s, rate ) for s in reference]
+        if i % 7 == 0:
+            segments[0] = '*' * len(segments[0])
+            segments[-1] = '*' * len(segments[-1])
+        name = "{0}*{1:02d}:{2:02d}:{3:02d}".format(locus, 1 + i // 50, 1 + (i % 50) // 5, 1 + i % 5)
+        if i % 11 == 0:
+            name += "N"
+        alleles.append( (segments, name) )
+
+    # Give every tenth allele a short insertion in its second intron
+    insertSize = 3
+    gapped = []
+    for i, (segments, name) in enumerate(alleles):
+        segments = list(segments)
+        pos = len(segments[4]) // 2
+        insert = _randomSequence( rng, insertSize ) if i % 10 == 9 else '.' * insertSize
+        segments[4] = segments[4][:pos] + insert + segments[4][pos:]
+        gapped.append( (segments, name) )
+    return gapped
+
+def ungapped( segments ):
+    return ''.join( segments ).replace('.', '').replace('*', '')
+
+def exons( segments ):
+    return segments[1::2]
+
+## IMGT alignment text formatting
+
+def _formatAlignment( title, entries ):
+    """
+    Format aligned sequences in the IMGT alignment layout, with alleles
+    after the first written relative to it using '-'
+    """
+    lines = [title,
+             "IPD-IMGT/HLA Release: {0}".format(VERSION),
+             "Sequences Aligned: {0}".format(DATE),
+             "", ""]
+    reference = entries[0][1]
+    rows = []
+    for i, (name, seq) in enumerate(entries):
+        if i > 0:
+            seq = ''.join('-' if b == r and b not in '.*|' else b for b, r in zip(seq, reference))
+        rows.append( (name, seq) )
+    width = BLOCK * LINE_BLOCKS
+    for start in range(0, len(reference), width):
+        for name, seq in rows:
+            chunk = seq[start:start + width]
+            blocks = [chunk[j:j + BLOCK] for j in range(0, len(chunk), BLOCK)]
+            lines.append(" {0:<18}{1}".format(name, ' '.join(blocks)))
+        lines.append("")
+    return '\n'.join(lines) + '\n'
+
+def writeImgtZip( filepath, allelesByLocus ):
+    with zipfile.ZipFile( filepath, 'w', zipfile.ZIP_DEFLATED ) as archive:
+        for locus, alleles in sorted(allelesByLocus.items()):
+            gen = [(name, '|'.join(segments)) for segments, name in alleles]
+            nuc = [(name, '|'.join(exons(segments))) for segments, name in alleles]
+            archive.writestr("alignments/{0}_gen.txt".format(locus),
+                             _formatAlignment("HLA-{0} Genomic Sequence Alignments".format(locus), gen))
+            archive.writestr("alignments/{0}_nuc.txt".format(locus),
+                             _formatAlignment("HLA-{0} Nucleotide Sequence Alignments".format(locus), nuc))
+    return filepath
+
+## Reference directory
+
+def _writeFasta( filepath, records ):
+    with open( filepath, 'w' ) as handle:
+        for name, seq in records:
+            handle.write(">{0}\n{1}\n".format(name, seq))
+
+def writeReferenceDirectory( dirpath, allelesByLocus ):
+    """
+    Write the combined reference files that LociTools.references serves
+    """
+    if not op.isdir( dirpath ):
+        os.makedirs( dirpath )
+    genomic = []
+    cDNA = []
+    exonMap = {}
+    refId = 0
+    for locus, alleles in sorted(allelesByLocus.items()):
+        exonRecords = [[] for _ in exons(alleles[0][0])]
+        for segments, name in alleles:
+            refId += 1
+            refName = "HLA{0:05d}_{1}".format(refId, name)
+            genomic.append( (refName, ungapped(segments)) )
+            cDNA.append( (refName, ungapped(exons(segments))) )
+            for i, exon in enumerate(exons(segments)):
+                exonRecords[i].append( (refName, ungapped([exon])) )
+        exonMap[locus] = op.join( dirpath, "{0}_exons.map".format(locus) )
+        with open( exonMap[locus], 'w' ) as handle:
+            for i, records in enumerate(exonRecords):
+                exonFasta = op.join( dirpath, "{0}_exon{1}.fasta".format(locus, i + 1) )
+                _writeFasta( exonFasta, records )
+                handle.write("{0}\t{1}\n".format(i + 1, exonFasta))
+    _writeFasta( op.join(dirpath, "genomic.fasta"), genomic )
+    _writeFasta( op.join(dirpath, "cDNA.fasta"), cDNA )
+    with open( op.join(dirpath, "exon.map"), 'w' ) as handle:
+        for locus in sorted(exonMap):
+            handle.write("{0}\t{1}\n".format(locus, exonMap[locus]))
+    with open( op.join(dirpath, "version.txt"), 'w' ) as handle:
+        handle.write(VERSION + "\n")
+    with open( op.join(dirpath, "date.txt"), 'w' ) as handle:
+        handle.write(DATE + "\n")
+    return genomic
+
+## Consensus sequences and alignments
+
+def _reverseComplement( seq ):
+    return seq.translate( COMPLEMENT )[::-1]
+
+def makeConsensus( rng, genomic, nSamples, lociPerSample=None, rate=0.002 ):
+    """
+    Simulate two consensus sequences per locus per sample, as reported by
+    Amplicon Analysis, each tagged with its true reference of origin
+    """
+    byLocus = {}
+    for refName, seq in genomic:
+        locus = refName.split('*')[0].split('_')[-1]
+        byLocus.setdefault(locus, []).append( (refName, seq) )
+    loci = sorted(byLocus)[:lociPerSample] if lociPerSample else sorted(byLocus)
+
+    records = []
+    for sample in range(nSamples):
+        barcode = "{0}--{0}".format(sample)
+        cluster = 0
+        for locus in loci:
+            for phase in range(2):
+                refName, refSeq = rng.choice( byLocus[locus] )
+                seq = _mutate( rng, refSeq, rate )
+                reverse = rng.random() < 0.5
+                if reverse:
+                    seq = _reverseComplement( seq )
+                numReads = rng.randint(20, 400)
+                name = "Barcode{0}_Cluster{1}_Phase{2}_NumReads{3}".format(barcode, cluster, phase, numReads)
+                quality = ''.join( chr(33 + rng.randint(30, 93 - 33)) for _ in seq )
+                records.append( (name, seq, quality, refName, refSeq, reverse) )
+                cluster += 1
+    return records
+
+def writeFastq( filepath, records ):
+    with open( filepath, 'w' ) as handle:
+        for name, seq, quality, _, _, _ in records:
+            handle.write("@{0}\n{1}\n+\n{2}\n".format(name, seq, quality))
+
+def m5Line( qname, qseq, tname, tseq, reverse ):
+    """
+    Format a gapless m5 alignment of a query to its reference, reporting a
+    reverse-strand hit as BLASR does, against the reverse-complemented
+    reference
+    """
+    aligned = _reverseComplement( qseq ) if reverse else qseq
+    length = min(len(aligned), len(tseq))
+    qstring, tstring = aligned[:length], tseq[:length]
+    qstart, tstart = 0, 0
+    if reverse:
+        qstring, tstring = _reverseComplement( qstring ), _reverseComplement( tstring )
+        qstart, tstart = len(qseq) - length, len(tseq) - length
+    astring = ''.join('|' if q == t else '*' for q, t in zip(qstring, tstring))
+    nmat = astring.count('|')
+    nmis = length - nmat
+    fields = [qname, len(qseq), qstart, qstart + length, '+', tname, len(tseq), tstart, tstart + length,
+              '-' if reverse else '+', -5 * nmat + 6 * nmis, nmat, nmis, 0, 0, 254,
+              qstring, astring, tstring]
+    return ' '.join(str(f) for f in fields)
+
+def writeM5( filepath, records ):
+    with open( filepath, 'w' ) as handle:
+        for name, seq, _, refName, refSeq, reverse in records:
+            handle.write( m5Line(name, seq, refName, refSeq, reverse) + "\n" )
+
+## Public entry point
+
+def generate( outputDir, seed=42, nAlleles=100, length=3000, nSamples=24, lociPerSample=None ):
+    """
+    Generate a complete synthetic data set, returning a dict of the paths
+    """
+    rng = random.Random( seed )
+    if not op.isdir( outputDir ):
+        os.makedirs( outputDir )
+    allelesByLocus = {locus: makeAlleles( rng, locus, nAlleles, length ) for locus in LOCI}
+    paths = {'imgtZip': op.join(outputDir, "hla_alignments.zip"),
+             'references': op.join(outputDir, "references"),
+             'fastq': op.join(outputDir, "amplicon_analysis.fastq"),
+             'm5': op.join(outputDir, "amplicon_analysis.m5")}
+    writeImgtZip( paths['imgtZip'], allelesByLocus )
+    genomic = writeReferenceDirectory( paths['references'], allelesByLocus )
+    records = makeConsensus( rng, genomic, nSamples, lociPerSample )
+    writeFastq( paths['fastq'], records )
+    writeM5( paths['m5'], records )
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic HLA-like benchmark data")
+    parser.add_argument("outputDir")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--alleles", type=int, default=100, help="Alleles per locus")
+    parser.add_argument("--length", type=int, default=3000, help="Genomic allele length")
+    parser.add_argument("--samples", type=int, default=24, help="Number of barcoded samples")
+    args = parser.parse_args()
+    paths = generate( args.outputDir, args.seed, args.alleles, args.length, args.samples )
+    for key in sorted(paths):
+        print("{0}\t{1}".format(key, paths[key]))
+
+if __name__ == '__main__':
+    main()
@@ -32,4 +32,5 @@ setup(
     zip_safe = False,
     scripts = scripts,
     install_requires = required,
+    test_suite = 'tests',
 )
@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+import os.path as op
+
+TESTS_DIR = op.dirname( op.abspath(__file__) )
+REPO_DIR  = op.dirname( TESTS_DIR )
+BENCH_DIR = op.join( REPO_DIR, "benchmarks" )
+FAKE_BLASR = op.join( BENCH_DIR, "fake_blasr" )
+LOCI_EXE  = op.join( REPO_DIR, "bin", "loci" )
+
+# The benchmark data generator doubles as the test fixture
+sys.path.insert(0, BENCH_DIR)
+import synthetic
+
+
+def typingEnvironment( paths, workdir ):
+    """
+    Return an environment for 'loci' subprocesses that types against the
+    synthetic references with the fake_blasr stand-in
+    """
+    binDir = op.join( workdir, "bin" )
+    if not op.isdir( binDir ):
+        os.makedirs( binDir )
+        os.symlink( FAKE_BLASR, op.join(binDir, "blasr") )
+    env = dict(os.environ)
+    env["PATH"] = binDir + os.pathsep + env.get("PATH", "")
+    env["LOCITOOLS_REFERENCES"] = paths['references']
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+def runLoci( args, env, cwd ):
+    """Run one 'loci' command, returning its stdout lines"""
+    process = subprocess.Popen( [sys.executable, LOCI_EXE] + list(args), cwd=cwd, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise AssertionError('"loci {0}" failed:\n{1}'.format(' '.join(args), stderr))
+    return stdout.splitlines()
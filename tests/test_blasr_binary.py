@@ -0,0 +1,49 @@
+import shutil
+import tempfile
+import unittest
+import os.path as op
+
+from LociTools.io.BlasrBinaryIO import BlasrBinaryReader, convertBlasrFile
+from LociTools.io.BlasrIO import BlasrReader
+
+from tests.support import synthetic
+
+# (qname, query, tname, reference, reversed), half of them reverse-strand hits
+QUERIES = [("q{0}".format(i), "ACGTTGCA" * (i + 2), "HLA0000{0}_A*01:01".format(i % 3),
+            "ACGATGCA" * (i + 3), i % 2 == 1) for i in range(6)]
+
+
+class BlasrBinaryReaderTest( unittest.TestCase ):
+    """Binary columns match the text file, and outlive the reader"""
+
+    def setUp( self ):
+        self.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+        self.textFile = op.join( self.tempDir, "hits.m5" )
+        with open( self.textFile, 'w' ) as handle:
+            for qname, qseq, tname, tseq, reverse in QUERIES:
+                handle.write( synthetic.m5Line( qname, qseq, tname, tseq, reverse ) + '\n' )
+        self.binaryFile = convertBlasrFile( self.textFile, op.join( self.tempDir, "hits.m5b" ))
+        self.nmis = [int(record.nmis) for record in BlasrReader( self.textFile )]
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempDir )
+
+    def test_records( self ):
+        with BlasrBinaryReader( self.binaryFile ) as reader:
+            self.assertEqual( list(reader), list(BlasrReader( self.textFile )) )
+
+    def test_column_after_close( self ):
+        reader = BlasrBinaryReader( self.binaryFile )
+        nmis = reader.column( 'nmis' )
+        reader.close()
+        self.assertEqual( nmis.tolist(), self.nmis )
+        self.assertEqual( int(nmis.sum()), sum(self.nmis) )
+
+    def test_column_after_with_block( self ):
+        with BlasrBinaryReader( self.binaryFile, columns=('qname', 'tstart') ) as reader:
+            tstart = reader.column( 'tstart' )
+        self.assertEqual( tstart.tolist(), [int(r.tstart) for r in BlasrReader( self.textFile )] )
+
+
+if __name__ == '__main__':
+    unittest.main()
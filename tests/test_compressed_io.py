@@ -0,0 +1,104 @@
+import gzip
+import shutil
+import tempfile
+import unittest
+import os.path as op
+
+import numpy as np
+from pbcore.io import FastaReader, FastaRecord, FastqReader, FastqRecord
+
+from LociTools.io import BgzfIO
+from LociTools.utils import sequences
+
+
+def _fastaRecords( count, length=120 ):
+    bases = 'ACGT'
+    return [FastaRecord( 'seq{0} NumReads{1}'.format(i, i + 1),
+                         ''.join( bases[(i + j) % 4] for j in range(length) ))
+            for i in range(count)]
+
+def _fastqRecords( count, length=120 ):
+    return [FastqRecord( r.header, r.sequence, np.array([(i + j) % 41 for j in range(length)], dtype=np.uint8) )
+            for i, r in enumerate( _fastaRecords( count, length ))]
+
+
+class CompressedRoundTripTest( unittest.TestCase ):
+    """FASTA and FASTQ records written and read back through gzip and BGZF"""
+
+    def setUp( self ):
+        self.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempDir )
+
+    def _path( self, name ):
+        return op.join( self.tempDir, name )
+
+    def assertSameRecords( self, records, expected ):
+        records = list( records )
+        self.assertEqual( [r.header for r in records], [r.header for r in expected] )
+        self.assertEqual( [r.sequence for r in records], [r.sequence for r in expected] )
+        if hasattr( expected[0], 'quality' ):
+            self.assertEqual( [r.qualityString for r in records], [r.qualityString for r in expected] )
+
+    def _roundTrip( self, filename, records, readerType, isValid ):
+        sequences.writeSequenceRecords( filename, records )
+        self.assertTrue( BgzfIO.isBgzfFile( filename ))
+        self.assertTrue( isValid( filename ))
+        self.assertSameRecords( sequences.readSequenceRecords( filename ), records )
+        with readerType( sequences.openSequenceFile( filename )) as reader:
+            self.assertSameRecords( reader, records )
+
+    def test_fasta_bgzf( self ):
+        self._roundTrip( self._path( "reads.fasta.gz" ), _fastaRecords( 20 ),
+                         FastaReader, sequences.isValidFasta )
+
+    def test_fastq_bgzf( self ):
+        self._roundTrip( self._path( "reads.fastq.gz" ), _fastqRecords( 20 ),
+                         FastqReader, sequences.isValidFastq )
+
+    def test_fastq_bgzf_many_blocks( self ):
+        # Enough records to span several BGZF blocks, inflated in parallel
+        records = _fastqRecords( 2000 )
+        filename = self._path( "reads.fastq.bgz" )
+        self._roundTrip( filename, records, FastqReader, sequences.isValidFastq )
+        with BgzfIO.openCompressedFile( filename, nproc=4 ) as handle:
+            self.assertSameRecords( FastqReader( handle ), records )
+
+    def test_bgzf_is_plain_gzip( self ):
+        records = _fastaRecords( 500 )
+        filename = self._path( "reads.fasta.gz" )
+        sequences.writeSequenceRecords( filename, records )
+        with open( self._path( "reads.fasta" ), 'w' ) as handle:
+            for r in records:
+                handle.write( '>{0}\n{1}\n'.format(r.header, r.sequence) )
+        with gzip.open( filename ) as handle:
+            with open( self._path( "reads.fasta" )) as plain:
+                self.assertEqual( handle.read(), plain.read() )
+
+    def test_plain_gzip_input( self ):
+        records = _fastqRecords( 20 )
+        plain = self._path( "reads.fastq" )
+        sequences.writeSequenceRecords( plain, records )
+        filename = self._path( "gzipped.fastq.gz" )
+        with open( plain, 'rb' ) as source:
+            with gzip.open( filename, 'wb' ) as handle:
+                shutil.copyfileobj( source, handle )
+        self.assertFalse( BgzfIO.isBgzfFile( filename ))
+        self.assertTrue( sequences.isValidFastq( filename ))
+        self.assertSameRecords( sequences.readSequenceRecords( filename ), records )
+
+    def test_handles_are_file_like( self ):
+        filename = self._path( "reads.fasta.gz" )
+        with BgzfIO.openCompressedFile( filename, 'w' ) as writer:
+            writer.writelines( ['>a\n', 'ACGT\n'] )
+            self.assertRaises( IOError, writer.read )
+        with BgzfIO.openCompressedFile( filename ) as reader:
+            self.assertEqual( next( reader ), '>a\n' )
+            self.assertEqual( reader.readlines(), ['ACGT\n'] )
+            self.assertRaises( IOError, reader.write, 'ACGT' )
+        self.assertTrue( reader.closed )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import string
+import shutil
+import tempfile
+import unittest
+import os.path as op
+from collections import namedtuple
+
+from LociTools import references
+from LociTools.imgt.ImgtAlignment import ImgtGenomicAlignment
+from LociTools.imgt.ImgtReference import ImgtReference
+from LociTools.imgt.MsaMatrix import MsaMatrix
+from LociTools.typing.MsaTyper import MsaTyper
+
+from tests.support import synthetic
+
+# A toy IMGT genomic alignment: '-' is the first allele's base, '|' an
+#  exon/intron boundary, '.' an insertion column and '*' unsequenced
+TOY_ALIGNMENT = """\
+HLA-A Genomic Sequence Alignments
+IPD-IMGT/HLA Release: 3.25.0
+Sequences Aligned: 2016 July 15
+
+ gDNA              1
+                   |
+ A*01:01:01:01     ACGTACGTAC|GGATCCAATT|TTGACCA.GT
+ A*01:02           ----T-----|----------|-------.--
+ A*02:01           ----------|--C-------|-------A--
+ A*03:01           **********|----G-----|-------.**
+"""
+
+Alignment = namedtuple('Alignment', ('qname', 'tname', 'tstrand', 'tstart', 'tend', 'tlength', 'qstring', 'tstring'))
+
+COMPLEMENT = string.maketrans( "ACGT", "TGCA" )
+
+
+def _ungapped( seq ):
+    return seq.replace('|', '').replace('.', '').replace('*', '')
+
+def _reverseComplement( seq ):
+    return seq.translate( COMPLEMENT )[::-1]
+
+def _forwardHit( tname, target, query ):
+    return Alignment( "q", tname, '+', "0", str(len(target)), str(len(target)), query, target )
+
+
+class MsaMatrixTest( unittest.TestCase ):
+    """An MSA matrix built from a toy alignment ranks projected queries"""
+
+    def setUp( self ):
+        self.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+        alignment = ImgtGenomicAlignment( "A", TOY_ALIGNMENT.splitlines( True ))
+        self.msa = MsaMatrix.load( alignment.WriteMatrix( self.tempDir ))
+        self.sequences = {allele: _ungapped( seq ) for allele, seq in alignment._dict.iteritems()}
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempDir )
+
+    def _rank( self, tname, tstart, tstring, qstring ):
+        query, start, end = self.msa.project( tname, tstart, tstring, qstring )
+        order, mismatches, compared = self.msa.rank( query, start, end )
+        return [(self.msa.alleles[i], mismatches[i], compared[i]) for i in order]
+
+    def test_matrix( self ):
+        self.assertEqual( self.msa.locus, "A" )
+        self.assertEqual( self.msa.alleles, ["A*01:01:01:01", "A*01:02", "A*02:01", "A*03:01"] )
+        self.assertEqual( self.msa.matrix.shape, (4, 30) )
+        self.assertEqual( list(self.msa.boundaries), [10, 20] )
+        self.assertFalse( self.msa.mask[3, :10].any() )
+
+    def test_rank_substitution( self ):
+        # A copy of A*01:02 aligned to A*01:01 differs from it at one base
+        target = self.sequences["A*01:01:01:01"]
+        query = self.sequences["A*01:02"]
+        ranked = self._rank( "HLA00001_A*01:01:01:01", 0, target, query )
+        self.assertEqual( ranked[0][:2], ("A*01:02", 0) )
+        self.assertEqual( ranked[1][:2], ("A*01:01:01:01", 1) )
+
+    def test_rank_insertion( self ):
+        # A*02:01's inserted base fills the insertion column of A*01:01
+        target = self.sequences["A*01:01:01:01"]
+        query = self.sequences["A*02:01"]
+        tstring = target[:27] + '-' + target[27:]
+        ranked = self._rank( "A*01:01:01:01", 0, tstring, query )
+        self.assertEqual( ranked[0][:2], ("A*02:01", 0) )
+        self.assertTrue( all( mismatches > 0 for _, mismatches, _ in ranked[1:] ))
+
+    def test_unsequenced_columns_not_counted( self ):
+        # A*03:01 is only compared over the 18 columns it was sequenced over
+        target = self.sequences["A*01:01:01:01"]
+        ranked = self._rank( "A*01:01:01:01", 0, target, target )
+        self.assertEqual( ranked[0], ("A*01:01:01:01", 0, 30) )
+        self.assertEqual( dict( (allele, (m, c)) for allele, m, c in ranked )["A*03:01"], (1, 18) )
+
+    def test_typer( self ):
+        typer = MsaTyper( {"A": op.join( self.tempDir, "A_msa.npz" )}, top=2 )
+        target = self.sequences["A*01:01:01:01"]
+        calls = typer.typeAlignment( _forwardHit( "A*01:01:01:01", target, self.sequences["A*01:02"] ))
+        self.assertEqual( [allele for allele, _, _ in calls], ["A*01:02", "A*01:01:01:01"] )
+        self.assertIsNone( typer.typeAlignment( _forwardHit( "B*07:02", "ACGT", "ACGT" )))
+
+    def test_typer_reverse_strand( self ):
+        # BLASR reports a reverse-strand hit with the query forward, against
+        #  the reverse-complemented allele in that strand's coordinates, so
+        #  this hit from base 5 of A*01:01 on is at 0 to 24 on the reverse strand
+        typer = MsaTyper( {"A": op.join( self.tempDir, "A_msa.npz" )}, top=4 )
+        target = self.sequences["A*01:01:01:01"]
+        query = self.sequences["A*02:01"][5:]
+        tstring = target[5:27] + '-' + target[27:]
+        forward = Alignment( "q", "HLA00001_A*01:01:01:01", '+', "5", str(len(target)), str(len(target)),
+                             query, tstring )
+        reverse = Alignment( "q", "HLA00001_A*01:01:01:01", '-', "0", str(len(target) - 5), str(len(target)),
+                             _reverseComplement( query ), _reverseComplement( tstring ))
+        calls = typer.typeAlignment( reverse )
+        self.assertEqual( calls[0][:2], ("A*02:01", 0) )
+        self.assertEqual( calls, typer.typeAlignment( forward ))
+
+
+class MsaUpdateTest( unittest.TestCase ):
+    """The reference update writes every locus's matrix where typing finds it"""
+
+    def setUp( self ):
+        self.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+        self.paths = synthetic.generate( op.join( self.tempDir, "data" ), nAlleles=6, length=400, nSamples=1 )
+        self.environ = os.environ.get( references._REF_ENV )
+        os.environ[references._REF_ENV] = self.paths['references']
+        references._refPath = None
+
+    def tearDown( self ):
+        if self.environ is None:
+            del os.environ[references._REF_ENV]
+        else:
+            os.environ[references._REF_ENV] = self.environ
+        references._refPath = None
+        shutil.rmtree( self.tempDir )
+
+    def test_update_writes_matrices( self ):
+        ImgtReference( self.paths['imgtZip'] ).updateGenomicReference( references.referenceDirectory() )
+        msaFiles = references.msaReferences()
+        self.assertEqual( sorted(msaFiles), synthetic.LOCI )
+        for locus, filename in msaFiles.iteritems():
+            self.assertEqual( filename, op.join( self.paths['references'], locus, "{0}_msa.npz".format(locus) ))
+            self.assertEqual( len(MsaMatrix.load( filename )), 6 )
+
+
+if __name__ == '__main__':
+    unittest.main()
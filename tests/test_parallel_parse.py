@@ -0,0 +1,72 @@
+import random
+import shutil
+import tempfile
+import unittest
+import os.path as op
+
+from LociTools.utils import sequences
+from LociTools.utils.records import parseSequenceLines
+
+CHUNK_SIZES = (37, 500, 4096)
+
+
+def _randomSequence( rng, length ):
+    return ''.join( rng.choice("ACGT") for _ in range(length) )
+
+def _fastq( rng, count ):
+    """FASTQ whose quality lines often start with '@' or '+', like a header or separator"""
+    lines = []
+    for i in range(count):
+        length = rng.randint(1, 120)
+        quality = ''.join( chr(rng.randint(33, 74)) for _ in range(length) )
+        if i % 3 != 2:
+            quality = "@+"[i % 3] + quality[1:]
+        lines += ["@read{0}_NumReads{1}".format(i, length), _randomSequence( rng, length ), "+", quality]
+    return '\n'.join( lines ) + '\n'
+
+def _fasta( rng, count ):
+    """FASTA with sequences wrapped over several lines of varying width"""
+    lines = []
+    for i in range(count):
+        sequence, width = _randomSequence( rng, rng.randint(0, 300) ), rng.choice((10, 60, 70))
+        lines.append( ">seq{0} some description".format(i) )
+        lines += [sequence[j:j+width] for j in range(0, len(sequence), width)]
+    return '\n'.join( lines ) + '\n'
+
+
+class ParallelParseTest( unittest.TestCase ):
+    """Parsing in record-aligned byte ranges gives the same records as a serial parse"""
+
+    def setUp( self ):
+        self.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+        self.rng = random.Random( 7 )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempDir )
+
+    def _write( self, name, text ):
+        filepath = op.join( self.tempDir, name )
+        with open( filepath, 'w' ) as handle:
+            handle.write( text )
+        return filepath
+
+    def _records( self, store ):
+        return [(r.name, r.sequence, r.qualityString if store.hasQuality else None) for r in store]
+
+    def assertParallelMatchesSerial( self, filename, fileType ):
+        with open( filename ) as handle:
+            serial = self._records( parseSequenceLines( handle, fileType ))
+        for chunkSize in CHUNK_SIZES:
+            for nproc in (1, 2):
+                parallel = self._records( sequences._readParallel( filename, fileType, nproc, chunkSize ))
+                self.assertEqual( parallel, serial, "Chunks of {0} bytes differ".format(chunkSize) )
+
+    def test_fastq( self ):
+        self.assertParallelMatchesSerial( self._write( "reads.fastq", _fastq( self.rng, 200 )), 'fastq' )
+
+    def test_multiline_fasta( self ):
+        self.assertParallelMatchesSerial( self._write( "reads.fasta", _fasta( self.rng, 200 )), 'fasta' )
+
+
+if __name__ == '__main__':
+    unittest.main()
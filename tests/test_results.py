@@ -0,0 +1,75 @@
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import os.path as op
+
+from LociTools.typing.ResultsStore import ResultsStore, SCHEMA_VERSION
+
+SELECTED = ("@Barcode0--0_Cluster0_Phase0_NumReads90\nACGT\n+\nIIII\n"
+            "@Barcode0--0_Cluster1_Phase0_NumReads80\nTTGA\n+\nIIII\n")
+
+# The first hit is to a reference collapsed from three identical alleles
+HITS = ("qname\ttname\tnmis\talleles\n"
+        "Barcode0--0_Cluster0_Phase0_NumReads90\tHLA00001_A*01:01:01:01\t2\t"
+        "HLA00001_A*01:01:01:01,HLA00002_A*01:01:01:02N,HLA00003_A*01:37\n"
+        "Barcode0--0_Cluster1_Phase0_NumReads80\tHLA00010_B*07:02:01\t0\tHLA00010_B*07:02:01\n")
+
+
+class ResultsStoreAliasTest( unittest.TestCase ):
+    """Hits to collapsed references are found by every allele they stand for"""
+
+    def setUp( self ):
+        self.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+        self.selected = self._write( "sample1.selected.fastq", SELECTED )
+        self.hits = self._write( "sample1.hits.txt", HITS )
+        self.filename = op.join( self.tempDir, "results.db" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempDir )
+
+    def _write( self, name, text ):
+        filepath = op.join( self.tempDir, name )
+        with open( filepath, 'w' ) as handle:
+            handle.write( text )
+        return filepath
+
+    def assertAliasesFound( self, store ):
+        self.assertEqual( [r['qname'] for r in store.hits( allele="A*01:01:01:02N" )],
+                          ["Barcode0--0_Cluster0_Phase0_NumReads90"] )
+        self.assertEqual( len(store.hits( allele="A*01:37" )), 1 )
+        self.assertEqual( len(store.hits( allele="A*01" )), 1 )
+        self.assertEqual( len(store.hits( allele="A*02" )), 0 )
+        self.assertEqual( len(store.hits( locus="B" )), 1 )
+        self.assertEqual( len(store.hits()), 2 )
+        self.assertEqual( sorted( (r['allele'], r['samples']) for r in store.alleleCounts( locus="A" )),
+                          [("A*01:01:01:01", 1), ("A*01:01:01:02N", 1), ("A*01:37", 1)] )
+
+    def test_aliases( self ):
+        with ResultsStore( self.filename ) as store:
+            store.addSample( self.selected, self.selected, self.hits )
+            self.assertAliasesFound( store )
+
+    def test_retyping_replaces_aliases( self ):
+        with ResultsStore( self.filename ) as store:
+            store.addSample( self.selected, self.selected, self.hits )
+            store.addSample( self.selected, self.selected, self.hits )
+            self.assertAliasesFound( store )
+
+    def test_upgrades_version_1( self ):
+        with ResultsStore( self.filename ) as store:
+            store.addSample( self.selected, self.selected, self.hits )
+        db = sqlite3.connect( self.filename )
+        with db:
+            db.execute( "DROP TABLE hitAlleles" )
+            db.execute( "PRAGMA user_version = 1" )
+        db.close()
+        with ResultsStore( self.filename ) as store:
+            self.assertAliasesFound( store )
+        db = sqlite3.connect( self.filename )
+        self.assertEqual( db.execute( "PRAGMA user_version" ).fetchone()[0], SCHEMA_VERSION )
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import glob
+import shutil
+import filecmp
+import tempfile
+import unittest
+import os.path as op
+
+from tests.support import synthetic, typingEnvironment, runLoci
+
+OUTPUTS = ("genomic.m5", "oriented.fastq", "oriented.selected.fastq", "hits.txt")
+
+
+class ScatterGatherTest( unittest.TestCase ):
+    """A scattered, sharded and gathered plate matches a single typing run"""
+
+    @classmethod
+    def setUpClass( cls ):
+        cls.tempDir = tempfile.mkdtemp( prefix="loci_test_" )
+        cls.paths = synthetic.generate( op.join( cls.tempDir, "data" ), nAlleles=8, length=600, nSamples=5 )
+        cls.env = typingEnvironment( cls.paths, cls.tempDir )
+        cls.single = cls._copyInput( "single" )
+        runLoci( ["typing", cls.single], cls.env, cls.tempDir )
+
+    @classmethod
+    def tearDownClass( cls ):
+        shutil.rmtree( cls.tempDir )
+
+    @classmethod
+    def _copyInput( cls, name ):
+        dirpath = op.join( cls.tempDir, name )
+        if not op.isdir( dirpath ):
+            os.makedirs( dirpath )
+        inputFile = op.join( dirpath, op.basename( cls.paths['fastq'] ))
+        shutil.copy( cls.paths['fastq'], inputFile )
+        return inputFile
+
+    def _scatter( self, name, shards ):
+        shardDir = op.join( self.tempDir, name )
+        output = runLoci( ["typing", self.paths['fastq'], "--scatter", shardDir, "--shards", str(shards)],
+                          self.env, self.tempDir )
+        manifests = [line for line in output if line.endswith(".json")]
+        self.assertEqual( len(manifests), shards )
+        for manifest in manifests:
+            runLoci( ["typing", manifest, "--shard"], self.env, self.tempDir )
+        return shardDir
+
+    def assertMatchesSingleRun( self, shardDir ):
+        for output in OUTPUTS:
+            name = "amplicon_analysis." + output
+            self.assertTrue( filecmp.cmp( op.join( shardDir, name ), op.join( op.dirname( self.single ), name ),
+                                          shallow=False ), '"{0}" differs from the single run'.format(output) )
+
+    def test_by_sample( self ):
+        shardDir = self._scatter( "bySample", 2 )
+        runLoci( ["typing", shardDir, "--gather"], self.env, self.tempDir )
+        self.assertMatchesSingleRun( shardDir )
+
+    def test_by_chunk_out_of_core( self ):
+        # More shards than samples splits samples, and the 1MB budget spills the merge
+        shardDir = self._scatter( "byChunk", 7 )
+        runLoci( ["typing", shardDir, "--gather", "--selectMemory", "1"], self.env, self.tempDir )
+        self.assertMatchesSingleRun( shardDir )
+
+    def test_types_sequences_no_shard_selected( self ):
+        # Drop a sequence from its shard's selection and hits, as if the
+        #  shard's partial selection group had not picked it
+        shardDir = self._scatter( "unselected", 2 )
+        selected = sorted( glob.glob( op.join( shardDir, "shard_000", "*.selected.fastq" )))[0]
+        hits = sorted( glob.glob( op.join( shardDir, "shard_000", "*.hits.txt" )))[0]
+        with open( selected ) as handle:
+            lines = handle.readlines()
+        dropped = lines[0][1:].split()[0]
+        with open( selected, 'w' ) as handle:
+            handle.writelines( lines[4:] )
+        with open( hits ) as handle:
+            rows = [row for row in handle if row.split('\t')[0] != dropped]
+        with open( hits, 'w' ) as handle:
+            handle.writelines( rows )
+        runLoci( ["typing", shardDir, "--gather"], self.env, self.tempDir )
+        self.assertMatchesSingleRun( shardDir )
+
+    def test_gather_records_results( self ):
+        from LociTools.typing.ResultsStore import ResultsStore
+        shardDir = self._scatter( "results", 2 )
+        gathered, single = op.join( self.tempDir, "gathered.db" ), op.join( self.tempDir, "single.db" )
+        runLoci( ["typing", shardDir, "--gather", "--results", gathered], self.env, self.tempDir )
+        runLoci( ["typing", self.single, "--results", single], self.env, self.tempDir )
+        with ResultsStore( gathered ) as g, ResultsStore( single ) as s:
+            self.assertEqual( [r['input'] for r in g.samples()], [op.abspath( self.paths['fastq'] )] )
+            for query in ("sequences", "hits", "calls"):
+                self.assertEqual( [tuple(r)[2:] for r in getattr( g, query )()],
+                                  [tuple(r)[2:] for r in getattr( s, query )()] )
+            self.assertEqual( map(tuple, g.alleleCounts()), map(tuple, s.alleleCounts()) )
+
+    def test_results_rejected_for_shards( self ):
+        with self.assertRaises( AssertionError ):
+            runLoci( ["typing", self.paths['fastq'], "--scatter", op.join( self.tempDir, "rejected" ),
+                      "--results", op.join( self.tempDir, "rejected.db" )], self.env, self.tempDir )
+
+
+if __name__ == '__main__':
+    unittest.main()